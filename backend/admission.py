@@ -0,0 +1,80 @@
+"""
+Admission control for new generations
+Before a generation starts, the estimated queue delay of the provider pools
+(the fair scheduler's estimated_wait) decides whether it is worth starting:
+
+- text delay above ADMISSION_REJECT_DELAY_SECONDS: rejected with 503 and a
+  Retry-After of the time the backlog needs to drain below that threshold
+- text or image delay above ADMISSION_DOWNGRADE_DELAY_SECONDS: admitted
+  without images (draft mode, "images" listed as degraded), so it only
+  needs the cheaper text calls; its prompts can be rendered later
+- otherwise admitted as asked
+
+With IMAGE_RENDERING=queue the image workers render outside this process,
+so the image delay also counts the image job queue's backlog
+(ImageJobQueue.estimated_wait).
+
+Rejecting early keeps a spike from filling the queues with work that would
+only time out. ADMISSION_REJECT_DELAY_SECONDS=0 turns rejection off and
+ADMISSION_DOWNGRADE_DELAY_SECONDS=0 turns downgrading off.
+"""
+
+import math
+import os
+from typing import NamedTuple, Optional
+
+from image_queue import ImageJobQueue
+from metrics import ADMISSION_DECISIONS, ADMISSION_ESTIMATED_DELAY
+from scheduler import FairScheduler
+
+ADMISSION_DOWNGRADE_DELAY_SECONDS = float(os.getenv("ADMISSION_DOWNGRADE_DELAY_SECONDS", "10"))
+ADMISSION_REJECT_DELAY_SECONDS = float(os.getenv("ADMISSION_REJECT_DELAY_SECONDS", "30"))
+
+ADMIT = "admit"
+DOWNGRADE = "downgrade"
+REJECT = "reject"
+
+
+class AdmissionDecision(NamedTuple):
+    action: str
+    estimated_delay: float  # seconds, of the pool the decision was based on
+    retry_after: int = 0  # seconds, for rejections
+
+
+class AdmissionController:
+    """Admit, downgrade or reject new generations from the provider pools' backlog"""
+
+    def __init__(
+        self,
+        text_scheduler: FairScheduler,
+        image_scheduler: FairScheduler,
+        downgrade_delay: float = ADMISSION_DOWNGRADE_DELAY_SECONDS,
+        reject_delay: float = ADMISSION_REJECT_DELAY_SECONDS,
+        image_queue: Optional[ImageJobQueue] = None
+    ) -> None:
+        self.text_scheduler = text_scheduler
+        self.image_scheduler = image_scheduler
+        self.image_queue = image_queue
+        self.downgrade_delay = downgrade_delay
+        self.reject_delay = reject_delay
+
+    def decide(self, with_images: bool = True) -> AdmissionDecision:
+        """Decision for a generation arriving now; with_images=False for drafts"""
+        text_delay = self.text_scheduler.estimated_wait()
+        image_delay = 0.0
+        if with_images:
+            image_delay = self.image_scheduler.estimated_wait()
+            if self.image_queue is not None:
+                image_delay += self.image_queue.estimated_wait()
+        ADMISSION_ESTIMATED_DELAY.labels("text").set(text_delay)
+        ADMISSION_ESTIMATED_DELAY.labels("image").set(image_delay)
+
+        if self.reject_delay > 0 and text_delay > self.reject_delay:
+            # The estimate falls about one second per second once arrivals stop
+            decision = AdmissionDecision(REJECT, text_delay, max(1, math.ceil(text_delay - self.reject_delay)))
+        elif with_images and self.downgrade_delay > 0 and max(text_delay, image_delay) > self.downgrade_delay:
+            decision = AdmissionDecision(DOWNGRADE, max(text_delay, image_delay))
+        else:
+            decision = AdmissionDecision(ADMIT, max(text_delay, image_delay))
+        ADMISSION_DECISIONS.labels(decision.action).inc()
+        return decision
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark for the knowledge base retrieval index
+Fills a VectorIndex with synthetic chunks (Zipf-distributed vocabulary, like
+real brand text) and measures single-query and batched top-k search latency,
+over every brand and over one brand's share of the index.
+
+Run from backend/: python bench_knowledge.py [chunks] [iterations]
+"""
+
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from knowledge import KNOWLEDGE_CHUNK_WORDS, KNOWLEDGE_TOP_K, HashedTfidf, VectorIndex
+
+VOCABULARY = 20000
+BATCH = 8
+BRANDS = 10
+
+
+def synthetic_chunks(count, rng):
+    words = [f"w{index}" for index in range(VOCABULARY)]
+    ranks = np.minimum(rng.zipf(1.2, size=(count, KNOWLEDGE_CHUNK_WORDS)), VOCABULARY) - 1
+    return [" ".join(words[rank] for rank in row) for row in ranks]
+
+
+def timed(function, iterations):
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(name, durations, per=1):
+    print(
+        f"{name:>16}: median {statistics.median(durations) * 1000 / per:6.2f} ms  "
+        f"p95 {sorted(durations)[int(len(durations) * 0.95) - 1] * 1000 / per:6.2f} ms"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = np.random.default_rng(0)
+    embedder = HashedTfidf()
+    index = VectorIndex(embedder.dimensions)
+
+    # Embedding is the slow part of ingestion; a small sample is enough to
+    # measure it, the rest of the index reuses perturbed copies of the sample
+    sample = synthetic_chunks(min(count, 2000), rng)
+    start = time.perf_counter()
+    vectors = embedder.embed(sample)
+    embed_ms = (time.perf_counter() - start) * 1000 / len(sample)
+    for offset in range(0, count, len(sample)):
+        block = vectors[:min(len(sample), count - offset)]
+        noisy = block + rng.normal(0, 0.01, block.shape).astype(np.float32)
+        brand_code = offset * BRANDS // count
+        index.add(range(offset, offset + len(block)), noisy / np.linalg.norm(noisy, axis=1, keepdims=True), brand_code)
+    print(f"Index: {index.size} chunks x {index.dimensions} dims, {index.size * index.dimensions * 4 / 1e6:.0f} MB; "
+          f"embedding {embed_ms:.3f} ms per chunk")
+
+    queries = embedder.embed(synthetic_chunks(BATCH, rng), index.idf())
+    report("single query", timed(lambda: index.search(queries[:1], KNOWLEDGE_TOP_K), iterations))
+    report(f"one of {BRANDS} brands", timed(lambda: index.search(queries[:1], KNOWLEDGE_TOP_K, brand_code=0), iterations))
+    report(f"batch of {BATCH} (each)", timed(lambda: index.search(queries, KNOWLEDGE_TOP_K), iterations), per=BATCH)
+
+
+if __name__ == "__main__":
+    main()
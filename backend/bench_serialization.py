@@ -0,0 +1,111 @@
+"""
+Micro-benchmark for /api/generate-content response serialization
+Compares the previous path (pydantic models, response_model re-validation,
+jsonable_encoder and the standard-library JSON encoder) with the orjson
+fast path on a realistic five-image payload.
+
+Run from backend/: python bench_serialization.py [iterations]
+"""
+
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+# main.py refuses to import without keys; no provider is called here
+os.environ.setdefault("GEMINI_TEXT_API_KEY", "benchmark")
+os.environ.setdefault("GEMINI_IMAGE_API_KEY", "benchmark")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from main import ContentIdea, ContentResponse, PostContent, VisualPrompt
+from serialization import FastJSONResponse, content_response_payload
+
+IMAGE_SIDE = 640  # noise PNGs of ~1.2 MB, close to what the image model returns
+
+
+def build_final_state():
+    """Workflow output with five ideas, posts and PNG images"""
+    images = []
+    for _ in range(5):
+        buffer = BytesIO()
+        Image.frombytes("RGB", (IMAGE_SIDE, IMAGE_SIDE), os.urandom(IMAGE_SIDE * IMAGE_SIDE * 3)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return {
+        "context": "Recetas veganas fáciles para principiantes, tono cercano",
+        "ideas": [{"title": f"Idea {i}", "description": "Descripción breve de la idea " * 3} for i in range(5)],
+        "posts": [{
+            "hook": "🌱 ¡Transforma tu cocina en 15 minutos!",
+            "body": "Estas recetas veganas son perfectas para principiantes. " * 8,
+            "cta": "¿Cuál vas a probar primero? ¡Cuéntanos en los comentarios!",
+            "hashtags": ["#vegano", "#recetasfaciles", "#saludable", "#plantbased", "#comidavegana"],
+        } for _ in range(5)],
+        "visual_prompts": [{"description": "Overhead shot of a colorful vegan bowl, natural light", "image_data": image} for image in images],
+        "error": None,
+    }
+
+
+def previous_path(final_state):
+    """What generate_content and FastAPI did before the fast path"""
+    visual_prompts = [
+        VisualPrompt(
+            description=visual["description"],
+            image_url=f"data:image/png;base64,{base64.b64encode(visual['image_data']).decode()}"
+        )
+        for visual in final_state["visual_prompts"]
+    ]
+    response = ContentResponse(
+        ideas=[ContentIdea(**idea) for idea in final_state["ideas"]],
+        posts=[PostContent(**post) for post in final_state["posts"]],
+        visual_prompts=visual_prompts,
+        context_summary=final_state["context"],
+    )
+    # response_model handling: dump, validate again, encode, serialize
+    validated = ContentResponse.model_validate(response.model_dump())
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def fast_path(final_state):
+    return FastJSONResponse(content_response_payload(final_state, final_state["context"])).body
+
+
+def measure(function, final_state, iterations):
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        body = function(final_state)
+        durations.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(final_state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return body, durations, peak
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    final_state = build_final_state()
+    image_bytes = sum(len(visual["image_data"]) for visual in final_state["visual_prompts"])
+    print(f"Payload: 5 images, {image_bytes / 1e6:.1f} MB of PNG, {iterations} iterations")
+
+    results = {}
+    for name, function in (("previous", previous_path), ("fast", fast_path)):
+        body, durations, peak = measure(function, final_state, iterations)
+        results[name] = body
+        print(
+            f"{name:>9}: median {statistics.median(durations) * 1000:7.1f} ms  "
+            f"p95 {sorted(durations)[int(len(durations) * 0.95) - 1] * 1000:7.1f} ms  "
+            f"peak alloc {peak / 1e6:6.1f} MB  body {len(body) / 1e6:.1f} MB"
+        )
+
+    assert json.loads(results["previous"])["visual_prompts"] == json.loads(results["fast"])["visual_prompts"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Persistent brand profiles
+A profile holds the analysis of a repeat customer's brand (context summary,
+tone, audience and keywords) together with the input it was derived from, in
+a local SQLite database. Requests that reference a profile id use the stored
+analysis as their context, so they skip the page fetch and the context
+analysis call and start directly with idea generation.
+
+Profiles older than BRAND_PROFILE_REFRESH_SECONDS are served as they are and
+re-analyzed in the background; they can also be refreshed explicitly.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+
+BRAND_PROFILES_DB = os.getenv("BRAND_PROFILES_DB", "brand_profiles.db")
+BRAND_PROFILE_REFRESH_SECONDS = float(os.getenv("BRAND_PROFILE_REFRESH_SECONDS", str(7 * 86400)))
+
+# Inputs a profile can be (re)built from; an uploaded image is not kept
+PROFILE_INPUT_TYPES = ("text", "url", "guided")
+
+_COLUMNS = "id, brand, name, input_type, source, summary, tone, audience, keywords, created_at, refreshed_at"
+
+
+def profile_context(profile: Dict[str, Any]) -> str:
+    """Context for the ideas stage built from a stored profile"""
+    lines = [profile["summary"]]
+    if profile["tone"]:
+        lines.append(f"Tono de la marca: {profile['tone']}")
+    if profile["audience"]:
+        lines.append(f"Audiencia: {profile['audience']}")
+    if profile["keywords"]:
+        lines.append(f"Palabras clave: {', '.join(profile['keywords'])}")
+    return "\n".join(lines)
+
+
+class BrandProfileStore:
+    """Brand profiles by id, with the staleness check for scheduled refreshes"""
+
+    def __init__(
+        self,
+        path: str = BRAND_PROFILES_DB,
+        refresh_seconds: float = BRAND_PROFILE_REFRESH_SECONDS,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        self.refresh_seconds = refresh_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS profiles (
+                    id TEXT PRIMARY KEY,
+                    brand TEXT NOT NULL,
+                    name TEXT,
+                    input_type TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    tone TEXT NOT NULL,
+                    audience TEXT NOT NULL,
+                    keywords TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    refreshed_at REAL NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def _row(row: tuple) -> Dict[str, Any]:
+        profile = dict(zip(_COLUMNS.split(", "), row))
+        profile["keywords"] = orjson.loads(profile["keywords"])
+        profile["source"] = orjson.loads(profile["source"])
+        return profile
+
+    def create(
+        self,
+        brand: str,
+        input_type: str,
+        source: Any,
+        analysis: Dict[str, Any],
+        name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Store a new profile. source is what the analysis was derived from (the
+        text, the URL or the guided answers); analysis has summary, tone,
+        audience and keywords.
+        """
+        profile_id = uuid.uuid4().hex
+        now = self._clock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO profiles ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (profile_id, brand, name, input_type, orjson.dumps(source).decode(), analysis["summary"],
+                 analysis["tone"], analysis["audience"], orjson.dumps(analysis["keywords"]).decode(), now, now)
+            )
+        return self.get(profile_id)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM profiles WHERE id = ?", (profile_id,)).fetchone()
+        return self._row(row) if row is not None else None
+
+    def list_profiles(self, brand: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = f"SELECT {_COLUMNS} FROM profiles"
+        params: tuple = ()
+        if brand is not None:
+            query += " WHERE brand = ?"
+            params = (brand,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [self._row(row) for row in rows]
+
+    def update_analysis(self, profile_id: str, analysis: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Replace a profile's analysis after a refresh"""
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE profiles SET summary = ?, tone = ?, audience = ?, keywords = ?, refreshed_at = ? WHERE id = ?",
+                (analysis["summary"], analysis["tone"], analysis["audience"],
+                 orjson.dumps(analysis["keywords"]).decode(), self._clock(), profile_id)
+            ).rowcount
+        return self.get(profile_id) if updated else None
+
+    def delete(self, profile_id: str) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM profiles WHERE id = ?", (profile_id,)).rowcount > 0
+
+    def is_stale(self, profile: Dict[str, Any]) -> bool:
+        return self._clock() - profile["refreshed_at"] >= self.refresh_seconds
+
+
+brand_profile_store = BrandProfileStore()
@@ -0,0 +1,73 @@
+"""
+In-process result cache for expensive provider calls
+Entries expire after a TTL and the least recently used ones are evicted once
+the cache is full. Keys are hashes of everything that determines the result
+(model and prompt), so identical requests reuse the stored output.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", "3600"))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "64"))
+PROMPT_STORE_TTL_SECONDS = float(os.getenv("PROMPT_STORE_TTL_SECONDS", "86400"))
+PROMPT_STORE_MAX_ENTRIES = int(os.getenv("PROMPT_STORE_MAX_ENTRIES", "10000"))
+CONTEXT_STORE_TTL_SECONDS = float(os.getenv("CONTEXT_STORE_TTL_SECONDS", "3600"))
+CONTEXT_STORE_MAX_ENTRIES = int(os.getenv("CONTEXT_STORE_MAX_ENTRIES", "1000"))
+
+
+def cache_key(*parts: str) -> str:
+    """Stable key for the given result-determining inputs"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_entries: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# Provider-rendered images by cache_key(model, prompt); placeholders are never stored
+image_cache = TTLCache(IMAGE_CACHE_MAX_ENTRIES, IMAGE_CACHE_TTL_SECONDS)
@@ -0,0 +1,96 @@
+"""
+Cancellation of generation requests whose client has gone away
+The pipeline runs in a worker thread while the endpoint polls
+request.is_disconnected(). On disconnect the request's cancel event is set;
+every provider call checks it before starting, so no new calls are made for
+the abandoned request. Calls already in flight are left to finish, which lets
+cacheable results (rendered images) still land in the cache.
+"""
+
+import asyncio
+import os
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+
+from metrics import CANCELLATIONS, CANCELLED_CALLS
+
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+# Cancel event of the request being served, None outside one
+current_cancel_event: ContextVar[Optional[threading.Event]] = ContextVar("current_cancel_event", default=None)
+
+
+class RequestCancelled(Exception):
+    """Raised in place of a provider call for a request that was cancelled"""
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before the response was ready"""
+
+
+def is_cancelled() -> bool:
+    event = current_cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check_cancelled(operation: str) -> None:
+    """Call before starting a provider call; raises if the request was cancelled"""
+    if is_cancelled():
+        CANCELLED_CALLS.labels(operation).inc()
+        raise RequestCancelled(f"{operation} skipped: request cancelled")
+
+
+class SubtaskCancelEvent(threading.Event):
+    """
+    Cancel event of one piece of a request's work (a speculative task): set
+    on its own when the work is no longer wanted, and also reads as set once
+    the request itself is cancelled
+    """
+
+    def __init__(self, parent: Optional[threading.Event] = None) -> None:
+        super().__init__()
+        self._parent = parent
+
+    def is_set(self) -> bool:
+        return super().is_set() or (self._parent is not None and self._parent.is_set())
+
+
+def run_cancellable(cancel_event: threading.Event, function: Callable[..., Any], *args: Any) -> Any:
+    """Run function with cancel_event as the current cancel event; use inside a copied context"""
+    current_cancel_event.set(cancel_event)
+    return function(*args)
+
+
+def _discard_result(future: "asyncio.Future[Any]") -> None:
+    # The abandoned pipeline ends with RequestCancelled (or its own error);
+    # retrieve it so asyncio does not report an unretrieved exception
+    if not future.cancelled():
+        future.exception()
+
+
+async def run_until_disconnected(request: Request, endpoint: str, function: Callable[[], Any]) -> Any:
+    """
+    Run a blocking pipeline in a worker thread with its own cancel event.
+    Raises ClientDisconnected as soon as the client goes away; the thread
+    stops at its next provider call.
+    """
+    cancel_event = threading.Event()
+    token = current_cancel_event.set(cancel_event)
+    try:
+        # to_thread copies the current context, cancel event included
+        task = asyncio.ensure_future(asyncio.to_thread(function))
+    finally:
+        current_cancel_event.reset(token)
+
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            cancel_event.set()
+            CANCELLATIONS.labels(endpoint).inc()
+            task.add_done_callback(_discard_result)
+            raise ClientDisconnected()
@@ -0,0 +1,98 @@
+"""
+Request deadline budget for the content workflow
+The endpoint turns the client's deadline (or REQUEST_DEADLINE_SECONDS) into an
+absolute wall-clock time that travels in ContentGenerationState. Nodes check
+it before each stage and run their provider calls inside deadline_scope(), so
+every call is given only what is left of the budget. A stage that no longer
+fits is degraded on purpose (template copy, prompts without images) and the
+part is listed in the response's "degraded" field.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))
+MAX_REQUEST_DEADLINE_SECONDS = float(os.getenv("MAX_REQUEST_DEADLINE_SECONDS", "300"))
+# Remaining budget below which a call is not started at all
+MIN_TEXT_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_TEXT_CALL_SECONDS", "3"))
+MIN_IMAGE_CALL_SECONDS = float(os.getenv("DEADLINE_MIN_IMAGE_CALL_SECONDS", "10"))
+
+# Parts of the response that can be degraded
+DEGRADED_IDEAS = "ideas"
+DEGRADED_POSTS = "posts"
+DEGRADED_VISUAL_PROMPTS = "visual_prompts"
+DEGRADED_IMAGES = "images"
+
+T = TypeVar("T")
+
+# Absolute deadline (time.time()) of the request being served, None outside one
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+
+def request_deadline(requested_seconds: Optional[float] = None) -> float:
+    """Absolute deadline for a new request, capped at MAX_REQUEST_DEADLINE_SECONDS"""
+    seconds = REQUEST_DEADLINE_SECONDS if not requested_seconds or requested_seconds <= 0 else requested_seconds
+    return time.time() + min(seconds, MAX_REQUEST_DEADLINE_SECONDS)
+
+
+def remaining_seconds(deadline: Optional[float] = None) -> Optional[float]:
+    """Budget left before the given (or current) deadline; None when unbounded"""
+    if deadline is None:
+        deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.time())
+
+
+def has_budget(seconds: float, deadline: Optional[float] = None) -> bool:
+    """Whether a call expected to need at least `seconds` should still start"""
+    remaining = remaining_seconds(deadline)
+    return remaining is None or remaining >= seconds
+
+
+def deadline_exceeded(deadline: Optional[float] = None) -> bool:
+    remaining = remaining_seconds(deadline)
+    return remaining is not None and remaining <= 0
+
+
+def call_timeout(cap: Optional[float] = None) -> Optional[float]:
+    """Timeout for a provider call: the remaining budget, optionally capped"""
+    remaining = remaining_seconds()
+    if remaining is None:
+        return cap
+    return remaining if cap is None else min(remaining, cap)
+
+
+def llm_timeout_kwargs() -> Dict[str, Any]:
+    """Keyword arguments that bound an llm.invoke() call by the remaining budget"""
+    timeout = call_timeout()
+    return {} if timeout is None else {"timeout": timeout}
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]) -> Iterator[None]:
+    """Make the state's deadline the one seen by provider calls in this block"""
+    token = current_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def run_within_budget(call: Callable[[], T], fallback: Callable[[], T], min_seconds: float) -> Tuple[T, bool]:
+    """
+    Run call() if at least min_seconds of budget are left, otherwise return
+    fallback(). A call that fails because the budget ran out while it was
+    in flight also falls back. Returns (value, degraded).
+    """
+    if has_budget(min_seconds):
+        try:
+            return call(), False
+        except Exception:
+            if has_budget(min_seconds):
+                raise
+    return fallback(), True
+
@@ -0,0 +1,175 @@
+"""
+Near-duplicate idea detection with MinHash and LSH
+Each idea (title plus description) is reduced to the set of its word
+unigrams and bigrams, and that set to a MinHash signature of
+IDEA_DEDUP_PERMUTATIONS values. Signatures are split into bands; ideas that
+share any band land in the same bucket and become candidates, and a
+candidate is a duplicate when the signatures agree on at least
+IDEA_DEDUP_THRESHOLD of their positions (the estimated Jaccard similarity).
+A lookup hashes a few dozen shingles and touches one bucket per band, so it
+stays well under a millisecond however many ideas an account has.
+
+There is one index per account, bounded to IDEA_DEDUP_MAX_PER_ACCOUNT ideas
+with the oldest forgotten first.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+IDEA_DEDUP_PERMUTATIONS = int(os.getenv("IDEA_DEDUP_PERMUTATIONS", "64"))
+IDEA_DEDUP_BANDS = int(os.getenv("IDEA_DEDUP_BANDS", "16"))
+IDEA_DEDUP_THRESHOLD = float(os.getenv("IDEA_DEDUP_THRESHOLD", "0.5"))
+IDEA_DEDUP_MAX_PER_ACCOUNT = int(os.getenv("IDEA_DEDUP_MAX_PER_ACCOUNT", "5000"))
+
+_PRIME = (1 << 31) - 1
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def idea_shingles(idea: Dict[str, str]) -> np.ndarray:
+    """Hashed word unigrams and bigrams of an idea's title and description"""
+    text = unicodedata.normalize("NFKD", f"{idea.get('title', '')} {idea.get('description', '')}".lower())
+    words = _TOKEN_RE.findall("".join(char for char in text if not unicodedata.combining(char)))
+    shingles = set(words) | {f"{first} {second}" for first, second in zip(words, words[1:])}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) % _PRIME for shingle in shingles), dtype=np.uint64)
+
+
+class MinHasher:
+    """Universal hashes (a*x + b) mod p; the signature is each one's minimum over the shingles"""
+
+    def __init__(self, permutations: int = IDEA_DEDUP_PERMUTATIONS, seed: int = 42) -> None:
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=(permutations, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=(permutations, 1), dtype=np.uint64)
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        if shingles.size == 0:
+            return np.full(len(self._a), _PRIME, dtype=np.uint64)
+        # a, b, x < 2**31, so a*x + b fits in 64 bits
+        return ((self._a * shingles[None, :] + self._b) % _PRIME).min(axis=1)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(first == second)) / len(first)
+
+
+class LSHIndex:
+    """Banded LSH buckets over signatures, forgetting the oldest beyond max_entries"""
+
+    def __init__(self, bands: int, max_entries: int) -> None:
+        self.bands = bands
+        self.max_entries = max_entries
+        self._buckets: List[Dict[bytes, set]] = [{} for _ in range(bands)]
+        self._entries: Dict[int, Tuple[str, np.ndarray]] = {}
+        self._order: deque = deque()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in np.array_split(signature, self.bands)]
+
+    def add(self, title: str, signature: np.ndarray) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (title, signature)
+        self._order.append(entry_id)
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(key, set()).add(entry_id)
+        while len(self._order) > self.max_entries:
+            self._remove(self._order.popleft())
+
+    def _remove(self, entry_id: int) -> None:
+        _, signature = self._entries.pop(entry_id)
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            bucket = buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del buckets[key]
+
+    def best_match(self, signature: np.ndarray) -> Optional[Tuple[str, float]]:
+        """(title, similarity) of the most similar indexed idea sharing a band, if any"""
+        candidates = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(key, ()))
+        best = None
+        for entry_id in candidates:
+            title, stored = self._entries[entry_id]
+            score = similarity(signature, stored)
+            if best is None or score > best[1]:
+                best = (title, score)
+        return best
+
+
+class IdeaDeduplicator:
+    """Per-account LSH indexes of the ideas already produced"""
+
+    def __init__(
+        self,
+        permutations: int = IDEA_DEDUP_PERMUTATIONS,
+        bands: int = IDEA_DEDUP_BANDS,
+        threshold: float = IDEA_DEDUP_THRESHOLD,
+        max_per_account: int = IDEA_DEDUP_MAX_PER_ACCOUNT
+    ) -> None:
+        self.hasher = MinHasher(permutations)
+        self.bands = bands
+        self.threshold = threshold
+        self.max_per_account = max_per_account
+        self._indexes: Dict[str, LSHIndex] = {}
+        self._lock = threading.Lock()
+
+    def signature(self, idea: Dict[str, str]) -> np.ndarray:
+        return self.hasher.signature(idea_shingles(idea))
+
+    def _index(self, account: str) -> LSHIndex:
+        # Caller holds the lock
+        index = self._indexes.get(account)
+        if index is None:
+            index = self._indexes[account] = LSHIndex(self.bands, self.max_per_account)
+        return index
+
+    def find_duplicates(self, account: str, ideas: Sequence[Dict[str, str]]) -> Dict[int, str]:
+        """
+        Positions of ideas that repeat one already seen for the account, or an
+        earlier idea of the same list, mapped to the title they repeat
+        """
+        signatures = [self.signature(idea) for idea in ideas]
+        duplicates: Dict[int, str] = {}
+        with self._lock:
+            index = self._indexes.get(account)
+            for position, signature in enumerate(signatures):
+                match = index.best_match(signature) if index is not None else None
+                if match is not None and match[1] >= self.threshold:
+                    duplicates[position] = match[0]
+                    continue
+                for earlier in range(position):
+                    if earlier not in duplicates and similarity(signature, signatures[earlier]) >= self.threshold:
+                        duplicates[position] = ideas[earlier]["title"]
+                        break
+        return duplicates
+
+    def add(self, account: str, ideas: Iterable[Dict[str, str]]) -> None:
+        """Remember ideas as produced for the account"""
+        entries = [(idea["title"], self.signature(idea)) for idea in ideas]
+        with self._lock:
+            index = self._index(account)
+            for title, signature in entries:
+                index.add(title, signature)
+
+    def size(self, account: str) -> int:
+        with self._lock:
+            index = self._indexes.get(account)
+            return len(index) if index is not None else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
@@ -0,0 +1,136 @@
+"""
+Content-addressed on-disk image cache
+Provider renders are kept as PNG files named after their image cache key
+(model, normalized prompt and output settings), so they outlive the process
+and its in-memory cache and are shared by every worker process on the host.
+
+An SQLite index in the same directory records each file's size and last use;
+once the files add up to more than IMAGE_DISK_CACHE_MAX_BYTES the least
+recently used ones are deleted. Files are written to a temporary name and
+moved into place with os.replace, so readers never see a partial image, and
+index updates run in IMMEDIATE transactions, which serializes writers across
+processes. An empty IMAGE_DISK_CACHE_DIR or a zero byte cap disables it.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+IMAGE_DISK_CACHE_DIR = os.getenv("IMAGE_DISK_CACHE_DIR", "image_cache")
+IMAGE_DISK_CACHE_MAX_BYTES = int(os.getenv("IMAGE_DISK_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+_EVICTION_BATCH = 32
+
+
+class DiskImageCache:
+    """PNG files by key plus an SQLite index of their sizes and last use"""
+
+    def __init__(
+        self,
+        directory: str = IMAGE_DISK_CACHE_DIR,
+        max_bytes: int = IMAGE_DISK_CACHE_MAX_BYTES,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if not self.enabled:
+            return
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "index.db"), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS images_last_access ON images (last_access)")
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM images WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as image_file:
+                data = image_file.read()
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the read
+            with self._lock:
+                self._conn.execute("DELETE FROM images WHERE key = ?", (key,))
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE images SET last_access = ? WHERE key = ?", (self._clock(), key))
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store an image, then evict least recently used ones beyond the byte cap"""
+        if self._conn is None or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as image_file:
+                image_file.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO images (key, size, last_access) VALUES (?, ?, ?)",
+                    (key, len(data), self._clock())
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        # Caller holds the lock and the write transaction
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+        while total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM images ORDER BY last_access LIMIT ?", (_EVICTION_BATCH,)
+            ).fetchall()
+            for key, size in rows:
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                self._conn.execute("DELETE FROM images WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        if self._conn is None:
+            return {"enabled": False}
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+        return {"enabled": True, "entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+
+
+disk_image_cache = DiskImageCache()
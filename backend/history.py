@@ -0,0 +1,233 @@
+"""
+Generation history
+Every successful generation is kept in a local SQLite database: its input,
+context summary, ideas, posts and visual prompt references (prompt ids, not
+the image bytes, which can be rendered again from the image cache or the
+provider). Payloads are stored zlib-compressed; an FTS5 index over the input,
+titles, hooks, bodies and hashtags backs the search endpoint and the lookup
+of exact or near-exact earlier inputs before the models are called again.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
+
+from cache import cache_key
+
+HISTORY_DB = os.getenv("HISTORY_DB", "history.db")
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "10000"))
+# Token-set (Jaccard) similarity from which an earlier input counts as a match
+HISTORY_MATCH_THRESHOLD = float(os.getenv("HISTORY_MATCH_THRESHOLD", "0.9"))
+
+_TOKEN_RE = re.compile(r"\w+")
+_MATCH_CANDIDATES = 50
+_MATCH_QUERY_TOKENS = 64
+
+
+def normalize_input(text: str) -> str:
+    """Lowercased words only, so spacing, punctuation and case do not matter"""
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def _fts_phrase(token: str) -> str:
+    # Quoted, so user text is never parsed as FTS5 query syntax
+    return '"' + token.replace('"', '""') + '"'
+
+
+def _similarity(a: str, b: str) -> float:
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    if not tokens_a and not tokens_b:
+        return 1.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+class HistoryStore:
+    """Compressed generation records plus their full-text index"""
+
+    def __init__(
+        self,
+        path: str = HISTORY_DB,
+        max_entries: int = HISTORY_MAX_ENTRIES,
+        match_threshold: float = HISTORY_MATCH_THRESHOLD,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        self.max_entries = max_entries
+        self.match_threshold = match_threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS generations (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    input_type TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    payload BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS generations_fingerprint ON generations (fingerprint);
+                CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(
+                    input, titles, hooks, bodies, hashtags,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                );
+                """
+            )
+
+    @staticmethod
+    def fingerprint(input_type: str, input_text: str) -> str:
+        return cache_key(input_type, normalize_input(input_text))
+
+    def record(self, input_type: str, input_text: str, state: Dict[str, Any]) -> int:
+        """Store one finished generation; returns its history id"""
+        entry = {
+            "input_type": input_type,
+            "input": input_text,
+            "context_summary": state["context"],
+            "ideas": state["ideas"],
+            "posts": state["posts"],
+            "visual_prompts": [
+                {"description": visual["description"], "prompt_id": visual.get("prompt_id")}
+                for visual in state["visual_prompts"]
+            ],
+            "context_id": state.get("context_id"),
+            "session_id": state.get("session_id"),
+            "brand": state.get("brand"),
+            "n_ideas": state.get("n_ideas", len(state["ideas"])),
+            "draft": bool(state.get("draft")),
+        }
+        posts = state["posts"]
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO generations (created_at, input_type, fingerprint, payload) VALUES (?, ?, ?, ?)",
+                (self._clock(), input_type, self.fingerprint(input_type, input_text),
+                 zlib.compress(orjson.dumps(entry)))
+            )
+            entry_id = cursor.lastrowid
+            self._conn.execute(
+                "INSERT INTO generations_fts (rowid, input, titles, hooks, bodies, hashtags) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry_id,
+                    normalize_input(input_text),
+                    "\n".join(idea["title"] for idea in state["ideas"]),
+                    "\n".join(post["hook"] for post in posts),
+                    "\n".join(post["body"] for post in posts),
+                    " ".join(tag for post in posts for tag in post["hashtags"]),
+                )
+            )
+            self._prune()
+        return entry_id
+
+    def _prune(self) -> None:
+        # Caller holds the lock and the transaction
+        cutoff = self._conn.execute(
+            "SELECT id FROM generations ORDER BY id DESC LIMIT 1 OFFSET ?", (self.max_entries,)
+        ).fetchone()
+        if cutoff is not None:
+            self._conn.execute("DELETE FROM generations WHERE id <= ?", cutoff)
+            self._conn.execute("DELETE FROM generations_fts WHERE rowid <= ?", cutoff)
+
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, payload FROM generations WHERE id = ?", (entry_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"id": entry_id, "created_at": row[0], **orjson.loads(zlib.decompress(row[1]))}
+
+    def recent_ideas(self, entries: int) -> List[Tuple[Optional[str], Dict[str, str]]]:
+        """(brand, idea) pairs of the latest entries, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM generations ORDER BY id DESC LIMIT ?", (entries,)
+            ).fetchall()
+        ideas = []
+        for (payload,) in reversed(rows):
+            entry = orjson.loads(zlib.decompress(payload))
+            ideas.extend((entry.get("brand"), idea) for idea in entry["ideas"])
+        return ideas
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Entries containing every word of query, best matches first"""
+        tokens = _TOKEN_RE.findall(query.lower())
+        if not tokens:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT g.id, g.created_at, g.input_type, f.titles,
+                    snippet(generations_fts, -1, '[', ']', '…', 12)
+                FROM generations_fts f JOIN generations g ON g.id = f.rowid
+                WHERE generations_fts MATCH ?
+                ORDER BY bm25(generations_fts) LIMIT ?
+                """,
+                (" ".join(_fts_phrase(token) for token in tokens), limit)
+            ).fetchall()
+        return [
+            {"id": row[0], "created_at": row[1], "input_type": row[2], "titles": row[3].split("\n"), "snippet": row[4]}
+            for row in rows
+        ]
+
+    def find_matches(
+        self,
+        input_type: str,
+        input_text: str,
+        limit: int = 5,
+        brand: Optional[str] = None,
+        n_ideas: Optional[int] = None,
+        draft: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Earlier generations of brand for the same input: exact matches (same
+        normalized text) first, then near-exact ones above the similarity
+        threshold, newest first within each group. Generations of other
+        brands never match; n_ideas and draft, when given, must match too.
+        """
+        def fits(payload: bytes) -> bool:
+            entry = orjson.loads(zlib.decompress(payload))
+            return (
+                entry.get("brand") == brand
+                and (n_ideas is None or entry.get("n_ideas", len(entry["ideas"])) == n_ideas)
+                and (draft is None or entry.get("draft", False) == draft)
+            )
+
+        normalized = normalize_input(input_text)
+        with self._lock:
+            exact = self._conn.execute(
+                "SELECT id, created_at, payload FROM generations WHERE fingerprint = ? ORDER BY id DESC LIMIT ?",
+                (cache_key(input_type, normalized), _MATCH_CANDIDATES)
+            ).fetchall()
+            tokens = list(dict.fromkeys(normalized.split()))[:_MATCH_QUERY_TOKENS]
+            candidates = []
+            if tokens:
+                candidates = self._conn.execute(
+                    """
+                    SELECT g.id, g.created_at, f.input, g.payload
+                    FROM generations_fts f JOIN generations g ON g.id = f.rowid
+                    WHERE generations_fts MATCH ? AND g.input_type = ?
+                    ORDER BY bm25(generations_fts) LIMIT ?
+                    """,
+                    ("input : (" + " OR ".join(_fts_phrase(token) for token in tokens) + ")",
+                     input_type, _MATCH_CANDIDATES)
+                ).fetchall()
+        matches = [
+            {"id": entry_id, "created_at": created_at, "similarity": 1.0, "exact": True}
+            for entry_id, created_at, payload in exact if fits(payload)
+        ][:limit]
+        seen = {entry_id for entry_id, _, _ in exact}
+        near = []
+        for entry_id, created_at, stored_input, payload in candidates:
+            similarity = _similarity(normalized, stored_input)
+            if entry_id not in seen and similarity >= self.match_threshold and fits(payload):
+                near.append({"id": entry_id, "created_at": created_at, "similarity": round(similarity, 3), "exact": False})
+        near.sort(key=lambda match: (-match["similarity"], -match["id"]))
+        return (matches + near)[:limit]
+
+history_store = HistoryStore()
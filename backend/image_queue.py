@@ -0,0 +1,316 @@
+"""
+Durable queue of image rendering jobs
+With IMAGE_RENDERING=queue the API does not call the image provider itself:
+it adds a job to an SQLite queue (IMAGE_QUEUE_DB) and waits for one of the
+image workers (image_worker.py), which can run as any number of separate
+processes on the same host or on nodes that mount the same file, to render
+it. The worker writes the PNG into the job row and into the image caches, and
+the waiting request reads it from there.
+
+Jobs carry the tenant and priority of the request that queued them, and
+workers claim them with the fair scheduler's policy: deficit round robin
+across (tenant, priority) flows, interactive ones weighted
+SCHEDULER_INTERACTIVE_WEIGHT against 1 for batch. The round robin state is
+kept in the queue file, so it holds across every worker process. Jobs for a
+prompt already queued or being rendered are merged into the existing job. A worker leases a job for IMAGE_QUEUE_LEASE_SECONDS; if it dies
+the lease runs out and another worker takes the job, up to
+IMAGE_QUEUE_MAX_ATTEMPTS times. Only the worker holding the current lease can
+finish a job: a result from one whose lease was taken over is dropped.
+Finished jobs are deleted after IMAGE_QUEUE_RETENTION_SECONDS.
+
+estimated_wait() turns the backlog into the delay a new render should expect,
+for admission control, given the IMAGE_QUEUE_WORKER_SLOTS renders the workers
+run at once in total.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from scheduler import (
+    EXPECTED_IMAGE_CALL_SECONDS,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    SCHEDULER_INTERACTIVE_WEIGHT,
+    current_priority,
+    current_tenant,
+)
+
+# "inline": the API process calls the image provider; "queue": image workers do
+IMAGE_RENDERING = os.getenv("IMAGE_RENDERING", "inline")
+RENDER_INLINE = "inline"
+RENDER_QUEUE = "queue"
+
+IMAGE_QUEUE_DB = os.getenv("IMAGE_QUEUE_DB", "image_queue.db")
+IMAGE_QUEUE_LEASE_SECONDS = float(os.getenv("IMAGE_QUEUE_LEASE_SECONDS", "120"))
+IMAGE_QUEUE_MAX_ATTEMPTS = int(os.getenv("IMAGE_QUEUE_MAX_ATTEMPTS", "3"))
+IMAGE_QUEUE_RETENTION_SECONDS = float(os.getenv("IMAGE_QUEUE_RETENTION_SECONDS", "3600"))
+IMAGE_QUEUE_POLL_SECONDS = float(os.getenv("IMAGE_QUEUE_POLL_SECONDS", "0.1"))
+# Renders all the workers run at once (workers x IMAGE_WORKER_CONCURRENCY)
+IMAGE_QUEUE_WORKER_SLOTS = int(os.getenv("IMAGE_QUEUE_WORKER_SLOTS", "4"))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"  # with the PNG, or without one when the provider could not render it
+STATUS_FAILED = "failed"  # attempts exhausted
+
+_COLUMNS = (
+    "id, key, prompt, refresh, tenant, priority, status, result, error, attempts, worker, leased_until, "
+    "created_at, finished_at"
+)
+
+
+class ImageJobQueue:
+    """Image jobs in an SQLite file shared by the API and the workers"""
+
+    def __init__(
+        self,
+        path: str = IMAGE_QUEUE_DB,
+        lease_seconds: float = IMAGE_QUEUE_LEASE_SECONDS,
+        max_attempts: int = IMAGE_QUEUE_MAX_ATTEMPTS,
+        retention_seconds: float = IMAGE_QUEUE_RETENTION_SECONDS,
+        worker_slots: int = IMAGE_QUEUE_WORKER_SLOTS,
+        expected_call_seconds: float = EXPECTED_IMAGE_CALL_SECONDS,
+        interactive_weight: int = SCHEDULER_INTERACTIVE_WEIGHT,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.worker_slots = max(1, worker_slots)
+        self.expected_call_seconds = expected_call_seconds
+        self.weights = {PRIORITY_INTERACTIVE: max(1, interactive_weight), PRIORITY_BATCH: 1}
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    refresh INTEGER NOT NULL,
+                    tenant TEXT NOT NULL DEFAULT 'anonymous',
+                    priority TEXT NOT NULL DEFAULT 'interactive',
+                    status TEXT NOT NULL,
+                    result BLOB,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    leased_until REAL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )
+                """
+            )
+            # Queue files from before jobs carried their tenant and priority
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, default in (("tenant", "anonymous"), ("priority", PRIORITY_INTERACTIVE)):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT NOT NULL DEFAULT '{default}'")
+            # Round robin state of the flows with queued jobs, served in turn order
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS flows (
+                    tenant TEXT NOT NULL,
+                    priority TEXT NOT NULL,
+                    deficit INTEGER NOT NULL DEFAULT 0,
+                    turn INTEGER NOT NULL,
+                    PRIMARY KEY (tenant, priority)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_flow ON jobs (tenant, priority, status, created_at)")
+
+    def _transaction(self, work: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(
+        self,
+        key: str,
+        prompt: str,
+        refresh: bool = False,
+        tenant: Optional[str] = None,
+        priority: Optional[str] = None
+    ) -> str:
+        """
+        Id of the job rendering key: a pending one for the same key, or a new
+        one for tenant and priority (those of the current request by default)
+        """
+        tenant = tenant or current_tenant.get()
+        priority = priority or current_priority.get()
+
+        def add() -> str:
+            if not refresh:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                    (key, STATUS_QUEUED, STATUS_RUNNING)
+                ).fetchone()
+                if row is not None:
+                    return row[0]
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, key, prompt, refresh, tenant, priority, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, prompt, int(refresh), tenant, priority, STATUS_QUEUED, self._clock())
+            )
+            # A flow without queued jobs joins the round robin at the back
+            self._conn.execute(
+                "INSERT OR IGNORE INTO flows (tenant, priority, turn) "
+                "VALUES (?, ?, (SELECT COALESCE(MAX(turn), 0) + 1 FROM flows))",
+                (tenant, priority)
+            )
+            return job_id
+        return self._transaction(add)
+
+    def _next_fair_job(self) -> Optional[str]:
+        # Caller holds the transaction. One deficit round robin step, as in
+        # FairScheduler._next_waiter: the flow at the front gets its weight at
+        # the start of its turn, one job per claim, and goes to the back once
+        # its turn is used up or leaves the ring once it has no queued jobs
+        flows = self._conn.execute("SELECT tenant, priority, deficit FROM flows ORDER BY turn").fetchall()
+        for tenant, priority, deficit in flows:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE tenant = ? AND priority = ? AND status = ? ORDER BY created_at LIMIT 2",
+                (tenant, priority, STATUS_QUEUED)
+            ).fetchall()
+            if not rows:
+                self._conn.execute("DELETE FROM flows WHERE tenant = ? AND priority = ?", (tenant, priority))
+                continue
+            if deficit < 1:
+                deficit += self.weights.get(priority, 1)
+            deficit -= 1
+            if len(rows) == 1:
+                self._conn.execute("DELETE FROM flows WHERE tenant = ? AND priority = ?", (tenant, priority))
+            elif deficit < 1:
+                self._conn.execute(
+                    "UPDATE flows SET deficit = ?, turn = (SELECT MAX(turn) + 1 FROM flows) "
+                    "WHERE tenant = ? AND priority = ?",
+                    (deficit, tenant, priority)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE flows SET deficit = ? WHERE tenant = ? AND priority = ?", (deficit, tenant, priority)
+                )
+            return rows[0][0]
+        # Jobs queued before the queue kept flows
+        row = self._conn.execute(
+            "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (STATUS_QUEUED,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Lease a job whose worker's lease ran out, which already had its turn,
+        else the next queued job in fair order
+        """
+        def take() -> Optional[str]:
+            now = self._clock()
+            # Jobs abandoned by a dead worker after their last attempt are given up
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status = ? AND leased_until < ? AND attempts >= ?",
+                (STATUS_FAILED, "Worker lease expired", now, STATUS_RUNNING, now, self.max_attempts)
+            )
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND leased_until < ? ORDER BY created_at LIMIT 1",
+                (STATUS_RUNNING, now)
+            ).fetchone()
+            job_id = row[0] if row is not None else self._next_fair_job()
+            if job_id is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, leased_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (STATUS_RUNNING, worker, now + self.lease_seconds, job_id)
+            )
+            return job_id
+        job_id = self._transaction(take)
+        return self.get(job_id) if job_id is not None else None
+
+    def complete(self, job_id: str, worker: str, result: Optional[bytes], error: Optional[str] = None) -> bool:
+        """
+        Finish a job leased by worker; result None means the provider gave no
+        image (the API uses a placeholder). False, with nothing written, when
+        the job is no longer that worker's: its lease ran out and the job was
+        claimed again or given up.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, leased_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (STATUS_DONE, result, error, self._clock(), job_id, worker, STATUS_RUNNING)
+            ).rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS.split(", "), row))
+        job["refresh"] = bool(job["refresh"])
+        return job
+
+    def wait(
+        self,
+        job_id: str,
+        timeout: Optional[float] = None,
+        should_stop: Callable[[], bool] = lambda: False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        The job once it is finished, or None if timeout passes or should_stop()
+        turns true first (the job carries on and its image still lands in the cache)
+        """
+        limit = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in (STATUS_DONE, STATUS_FAILED):
+                return job
+            if should_stop() or (limit is not None and time.monotonic() >= limit):
+                return None
+            time.sleep(IMAGE_QUEUE_POLL_SECONDS)
+
+    def purge(self) -> int:
+        """Delete jobs finished more than retention_seconds ago"""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (STATUS_DONE, STATUS_FAILED, self._clock() - self.retention_seconds)
+            ).rowcount
+
+    def estimated_wait(self) -> float:
+        """
+        Delay a render queued now should expect: the jobs ahead of it beyond
+        the workers' free slots, served worker_slots at a time, as in
+        FairScheduler.estimated_wait
+        """
+        with self._lock:
+            ahead = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (STATUS_QUEUED, STATUS_RUNNING)
+            ).fetchone()[0]
+        if ahead < self.worker_slots:
+            return 0.0
+        return (ahead - self.worker_slots + 1) * self.expected_call_seconds / self.worker_slots
+
+    def stats(self) -> Dict[str, int]:
+        """Jobs per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED)}
+        counts.update(dict(rows))
+        return counts
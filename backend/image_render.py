@@ -0,0 +1,168 @@
+"""
+Image provider render path
+Everything a render needs, shared by the API (inline rendering) and the image
+workers (image_worker.py): the image model settings, the GenAI clients and
+their key pool, the circuit breaker and the memory, disk and shared image
+caches. It does not load the FastAPI app, so a worker needs only the image
+keys and opens none of the API's session, history or knowledge databases.
+"""
+
+import io
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+from dotenv import load_dotenv
+from google import genai as new_genai
+from google.genai import types
+
+from cache import cache_key, image_cache
+from deadline import call_timeout
+from disk_cache import disk_image_cache
+from key_pool import KeyPool, parse_keys
+from metrics import observe_call, record_image_bytes
+from resilience import CircuitBreaker
+from scheduler import image_scheduler
+from shared_cache import NAMESPACE_IMAGES, shared_cache
+
+# Load environment variables
+load_dotenv()
+
+# GEMINI_IMAGE_API_KEYS lists several keys to pool their quotas; the
+# single-key variable is used when it is unset
+GEMINI_IMAGE_API_KEYS = parse_keys(os.getenv("GEMINI_IMAGE_API_KEYS"), os.getenv("GEMINI_IMAGE_API_KEY"))
+
+if not GEMINI_IMAGE_API_KEYS:
+    raise ValueError("GEMINI_IMAGE_API_KEY environment variable is required")
+
+GEMINI_IMAGE_API_KEY = GEMINI_IMAGE_API_KEYS[0]
+
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+# Output settings of every image call; part of the image cache key with the model
+IMAGE_RESPONSE_MODALITIES = ["TEXT", "IMAGE"]
+IMAGE_OUTPUT_FORMAT = "png"  # non-PNG renders are re-encoded
+
+# Initialize GenAI client for Imagen
+client = new_genai.Client(api_key=GEMINI_IMAGE_API_KEY)
+
+# Each call leases the least-loaded image key; with one key the pool only
+# keeps the usage counts and the calls go through client above
+image_key_pool = KeyPool("image", GEMINI_IMAGE_API_KEYS, lambda key: new_genai.Client(api_key=key))
+
+@contextmanager
+def image_client():
+    """
+    GenAI client for one image call, on the least-loaded image key. The caller
+    holds an image_scheduler slot, taken outside the breaker's call timing.
+    """
+    with image_key_pool.lease() as pooled:
+        yield client if len(image_key_pool) == 1 else pooled.client
+
+# Trips on provider errors or slow calls so an image outage degrades straight
+# to placeholders instead of waiting on every failing call
+image_breaker = CircuitBreaker(
+    "image_generation",
+    failure_rate_threshold=float(os.getenv("IMAGE_BREAKER_FAILURE_RATE", "0.5")),
+    slow_call_seconds=float(os.getenv("IMAGE_BREAKER_SLOW_CALL_SECONDS", "20")),
+    window_size=int(os.getenv("IMAGE_BREAKER_WINDOW", "20")),
+    min_calls=int(os.getenv("IMAGE_BREAKER_MIN_CALLS", "5")),
+    open_seconds=float(os.getenv("IMAGE_BREAKER_OPEN_SECONDS", "30")),
+)
+
+def request_provider_image(prompt: str) -> Optional[bytes]:
+    """Ask the image model for a picture; PNG bytes, or None if it only sent text"""
+    timeout = call_timeout()
+    # Try to generate image using the correct Imagen API syntax
+    with observe_call("image_provider_call", IMAGE_MODEL), image_client() as provider:
+        response = provider.models.generate_content(
+            model=IMAGE_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+              response_modalities=IMAGE_RESPONSE_MODALITIES,
+              http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout is not None else None
+            )
+        )
+
+    for part in response.candidates[0].content.parts:
+      if part.text is not None:
+        print(part.text)
+      elif part.inline_data is not None:
+        image_data = part.inline_data.data
+        if part.inline_data.mime_type != "image/png":
+            # PNG payloads are passed through as-is; anything else is
+            # re-encoded and the decoded image released right away
+            with Image.open(BytesIO(image_data)) as generated_image, io.BytesIO() as buffer:
+                generated_image.save(buffer, format='PNG')
+                image_data = buffer.getvalue()
+        return image_data
+    return None
+
+def visual_prompt_id(prompt: str) -> str:
+    """
+    Stable id of a visual prompt, shared with the image cache keys: model,
+    output settings and the prompt with its whitespace normalized
+    """
+    return cache_key(IMAGE_MODEL, ",".join(IMAGE_RESPONSE_MODALITIES), IMAGE_OUTPUT_FORMAT, " ".join(prompt.split()))
+
+def cached_image(key: str) -> Optional[bytes]:
+    """
+    Provider render from the in-memory cache, else from disk, else from the
+    shared cache when it spans processes (kept in memory again either way)
+    """
+    image_data = image_cache.get(key)
+    if image_data is None:
+        try:
+            image_data = disk_image_cache.get(key)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Disk image cache read failed: {str(e)}")
+        if image_data is None and shared_cache.shared:
+            image_data = shared_cache.get(NAMESPACE_IMAGES, key)
+        if image_data is not None:
+            image_cache.set(key, image_data)
+    return image_data
+
+def store_image(key: str, image_data: bytes) -> None:
+    """Keep a provider render in memory, on disk and in the shared cache; the last two are best effort"""
+    image_cache.set(key, image_data)
+    try:
+        disk_image_cache.put(key, image_data)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Disk image cache write failed: {str(e)}")
+    if shared_cache.shared:
+        shared_cache.set(NAMESPACE_IMAGES, key, image_data)
+
+def render_with_provider(prompt: str, key: str) -> Optional[bytes]:
+    """
+    Provider render of a prompt under the image breaker, kept in the caches.
+    None when the provider gave no image or its circuit is open.
+    """
+    # An open circuit degrades to the placeholder at once, without queueing
+    # behind in-flight renders for a slot that would not be used
+    if image_breaker.rejects():
+        print("Image provider circuit is open, using placeholder image...")
+        return None
+    # Queued behind other requests' image calls before the breaker times the call
+    with image_scheduler.slot():
+        if not image_breaker.allow_request():
+            print("Image provider circuit is open, using placeholder image...")
+            return None
+        started = time.monotonic()
+        image_data = None
+        try:
+            image_data = request_provider_image(prompt)
+        except Exception as img_error:
+            print(f"Imagen API error: {str(img_error)}")
+
+        if image_data:
+            image_breaker.record_success(time.monotonic() - started)
+            print(f"✅ Imagen API generated image successfully: {len(image_data)} bytes")
+            record_image_bytes("provider", len(image_data))
+            store_image(key, image_data)
+            return image_data
+        image_breaker.record_failure(time.monotonic() - started)
+        print("Falling back to placeholder image...")
+        return None
@@ -0,0 +1,98 @@
+"""
+Image rendering worker
+Takes jobs from the image queue (IMAGE_QUEUE_DB) and renders them with the
+image provider through the same path the API uses inline (image_render):
+circuit breaker, API key pool and the memory, disk and shared image caches.
+Provider calls and PNG re-encoding happen here instead of in the API process,
+and workers are scaled independently of it; they load neither the FastAPI app
+nor its databases and only need the image keys:
+
+    IMAGE_RENDERING=queue uvicorn main:app      # API, enqueues and waits
+    python image_worker.py                      # any number, on any node sharing the queue file
+
+Each process runs IMAGE_WORKER_CONCURRENCY jobs at a time and stops cleanly
+on SIGINT / SIGTERM; a job it was rendering when killed is picked up again by
+another worker once its lease runs out. A render gets a deadline
+IMAGE_WORKER_LEASE_MARGIN_SECONDS before its lease ends, so a slow provider
+call times out instead of outliving the lease and being rendered (and billed)
+a second time by another worker.
+"""
+
+import os
+import signal
+import socket
+import threading
+from typing import Any, Dict, Optional
+
+import image_render
+from deadline import deadline_scope
+from image_queue import ImageJobQueue
+from scheduler import current_priority, current_tenant
+
+IMAGE_WORKER_CONCURRENCY = int(os.getenv("IMAGE_WORKER_CONCURRENCY", "4"))
+IMAGE_WORKER_IDLE_SECONDS = float(os.getenv("IMAGE_WORKER_IDLE_SECONDS", "0.5"))
+# Time left on the lease when the render's provider calls are cut off
+IMAGE_WORKER_LEASE_MARGIN_SECONDS = float(os.getenv("IMAGE_WORKER_LEASE_MARGIN_SECONDS", "10"))
+# How often finished jobs past their retention are deleted
+PURGE_INTERVAL_SECONDS = 300
+
+
+def process_job(queue: ImageJobQueue, job: Dict[str, Any]) -> None:
+    """Render one job leased by job["worker"] and record its image (or why there is none)"""
+    # The worker's own image slots are shared out like the API's, by the job's request
+    tenant_token = current_tenant.set(job["tenant"])
+    priority_token = current_priority.set(job["priority"])
+    try:
+        # Another worker may have rendered the same prompt meanwhile
+        image_data = None if job["refresh"] else image_render.cached_image(job["key"])
+        if image_data is None:
+            with deadline_scope(job["leased_until"] - IMAGE_WORKER_LEASE_MARGIN_SECONDS):
+                image_data = image_render.render_with_provider(job["prompt"], job["key"])
+        error = None if image_data else "The image provider gave no image"
+    except Exception as e:
+        print(f"Image job {job['id']} failed: {str(e)}")
+        image_data, error = None, str(e)
+    finally:
+        current_tenant.reset(tenant_token)
+        current_priority.reset(priority_token)
+    if not queue.complete(job["id"], job["worker"], image_data, error):
+        print(f"Image job {job['id']} was taken over by another worker, dropping this result")
+
+
+def work(queue: ImageJobQueue, worker_id: str, stop: threading.Event) -> None:
+    """Claim and render jobs until stop is set"""
+    while not stop.is_set():
+        job = queue.claim(worker_id)
+        if job is None:
+            stop.wait(IMAGE_WORKER_IDLE_SECONDS)
+            continue
+        process_job(queue, job)
+
+
+def run_worker(
+    queue: Optional[ImageJobQueue] = None,
+    concurrency: int = IMAGE_WORKER_CONCURRENCY,
+    stop: Optional[threading.Event] = None
+) -> None:
+    """Serve the queue with concurrency threads until stop is set"""
+    queue = queue or ImageJobQueue()
+    stop = stop or threading.Event()
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    threads = [
+        threading.Thread(target=work, args=(queue, f"{name}-{index}", stop), name=f"cm-image-worker-{index}", daemon=True)
+        for index in range(max(1, concurrency))
+    ]
+    for thread in threads:
+        thread.start()
+    while not stop.wait(PURGE_INTERVAL_SECONDS):
+        queue.purge()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stop_event.set())
+    print(f"Image worker {os.getpid()} serving {IMAGE_WORKER_CONCURRENCY} jobs at a time")
+    run_worker(stop=stop_event)
@@ -0,0 +1,179 @@
+"""
+Pools of provider API keys
+Each provider role (text, image) can be configured with several keys
+(GEMINI_TEXT_API_KEYS, GEMINI_IMAGE_API_KEYS, comma separated) so the
+deployment's throughput is the sum of their quotas instead of one key's.
+The pool keeps one client per key, created on first use, and leases the
+least-loaded key for each call: fewest calls in flight, then fewest
+throttles, then the one idle the longest.
+
+A key answered with a 429 leaves the rotation for KEY_COOLDOWN_SECONDS,
+doubled for each consecutive 429 up to KEY_COOLDOWN_MAX_SECONDS. When every
+key is cooling down the one that comes back first is used rather than
+failing the call. Keys are reported by a label (position and a hash prefix),
+never by their value. A pool of one key still counts usage and throttles but
+creates no client; callers keep using their module-level one.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from metrics import KEY_POOL_CALLS, KEY_POOL_COOLDOWNS, KEY_POOL_IN_FLIGHT
+
+KEY_COOLDOWN_SECONDS = float(os.getenv("KEY_COOLDOWN_SECONDS", "60"))
+KEY_COOLDOWN_MAX_SECONDS = float(os.getenv("KEY_COOLDOWN_MAX_SECONDS", "900"))
+
+OUTCOME_OK = "ok"
+OUTCOME_THROTTLED = "throttled"
+OUTCOME_ERROR = "error"
+
+
+def parse_keys(value: Optional[str], single: Optional[str] = None) -> List[str]:
+    """Distinct keys of a comma-separated list, or the single key when the list is unset"""
+    keys = [key.strip() for key in (value or "").split(",") if key.strip()]
+    if not keys and single:
+        keys = [single]
+    return list(dict.fromkeys(keys))
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """Whether a provider error is a 429 / quota exhausted answer"""
+    for attribute in ("code", "status_code"):
+        if getattr(exc, attribute, None) == 429:
+            return True
+    message = str(exc)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "Resource has been exhausted" in message
+
+
+class PooledKey:
+    """One key of a pool with its client and usage counters"""
+
+    def __init__(self, role: str, index: int, key: str) -> None:
+        self.key = key
+        self.label = f"{role}-{index}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:6]}"
+        self.client: Any = None
+        self.in_flight = 0
+        self.calls = 0
+        self.throttles = 0
+        self.errors = 0
+        self.consecutive_throttles = 0
+        self.cooling_until = 0.0
+        self.last_used = 0.0
+
+
+class KeyPool:
+    """Least-loaded leasing of a role's keys with a cooldown after 429s"""
+
+    def __init__(
+        self,
+        role: str,
+        keys: List[str],
+        client_factory: Callable[[str], Any],
+        cooldown_seconds: float = KEY_COOLDOWN_SECONDS,
+        max_cooldown_seconds: float = KEY_COOLDOWN_MAX_SECONDS,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        if not keys:
+            raise ValueError(f"The {role} key pool needs at least one key")
+        self.role = role
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self._client_factory = client_factory
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = [PooledKey(role, index, key) for index, key in enumerate(keys)]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _pick(self) -> PooledKey:
+        # Caller holds the lock
+        now = self._clock()
+        available = [entry for entry in self._keys if entry.cooling_until <= now]
+        if not available:
+            return min(self._keys, key=lambda entry: entry.cooling_until)
+        return min(available, key=lambda entry: (entry.in_flight, entry.throttles, entry.last_used))
+
+    @contextmanager
+    def lease(self) -> Iterator[PooledKey]:
+        """
+        The key for one provider call. Its in-flight count covers the body of
+        the with block; a 429 raised from it puts the key in cooldown.
+        """
+        with self._lock:
+            entry = self._pick()
+            entry.in_flight += 1
+            entry.calls += 1
+            entry.last_used = self._clock()
+            if entry.client is None and len(self._keys) > 1:
+                entry.client = self._client_factory(entry.key)
+        KEY_POOL_IN_FLIGHT.labels(self.role, entry.label).inc()
+        try:
+            yield entry
+        except BaseException as e:
+            if is_throttle_error(e):
+                self._throttled(entry)
+            else:
+                with self._lock:
+                    entry.errors += 1
+                KEY_POOL_CALLS.labels(self.role, entry.label, OUTCOME_ERROR).inc()
+            raise
+        else:
+            with self._lock:
+                entry.consecutive_throttles = 0
+            KEY_POOL_CALLS.labels(self.role, entry.label, OUTCOME_OK).inc()
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+            KEY_POOL_IN_FLIGHT.labels(self.role, entry.label).dec()
+
+    def _throttled(self, entry: PooledKey) -> None:
+        with self._lock:
+            entry.throttles += 1
+            entry.consecutive_throttles += 1
+            cooldown = min(
+                self.max_cooldown_seconds,
+                self.cooldown_seconds * 2 ** (entry.consecutive_throttles - 1)
+            )
+            entry.cooling_until = self._clock() + cooldown
+        KEY_POOL_CALLS.labels(self.role, entry.label, OUTCOME_THROTTLED).inc()
+        KEY_POOL_COOLDOWNS.labels(self.role, entry.label).inc()
+        print(f"API key {entry.label} throttled, out of rotation for {cooldown:.0f}s")
+
+    def available(self) -> int:
+        """Keys currently in rotation"""
+        now = self._clock()
+        with self._lock:
+            return sum(1 for entry in self._keys if entry.cooling_until <= now)
+
+    def reset(self) -> None:
+        """Every key back in rotation with zeroed counters (clients are kept)"""
+        with self._lock:
+            for entry in self._keys:
+                entry.calls = entry.throttles = entry.errors = entry.consecutive_throttles = 0
+                entry.cooling_until = entry.last_used = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-key usage and throttling for health and quota planning"""
+        now = self._clock()
+        with self._lock:
+            keys = []
+            for entry in self._keys:
+                key: Dict[str, Any] = {
+                    "key": entry.label,
+                    "in_flight": entry.in_flight,
+                    "calls": entry.calls,
+                    "throttles": entry.throttles,
+                    "errors": entry.errors,
+                }
+                if entry.cooling_until > now:
+                    key["cooldown_remaining_s"] = round(entry.cooling_until - now, 1)
+                keys.append(key)
+        return {
+            "keys": keys,
+            "available": sum(1 for key in keys if "cooldown_remaining_s" not in key),
+        }
@@ -0,0 +1,348 @@
+"""
+Local brand knowledge base for retrieval-augmented idea generation
+Brand documents, past posts and fetched pages are split into overlapping
+word chunks and embedded on the CPU with hashed TF-IDF: tokens are hashed
+(with a hash-derived sign, so collisions cancel out instead of piling up)
+into KNOWLEDGE_DIMENSIONS buckets of sublinear term frequency. Stored chunk
+vectors are unit-length term frequencies; IDF weights, kept as per-bucket
+document frequencies, are applied on the query side only, so adding or
+deleting documents never requires re-embedding the rest.
+
+Vectors live in preallocated float32 NumPy matrices, one per brand, that grow
+by doubling. They are stored dimension-major, so a search reads only the
+dimensions its query uses (queries set a fraction of the hashed buckets): one
+matrix product over the searched brand's matrix (batched for several
+queries) followed by argpartition for the top k. The product runs outside
+the lock, on a snapshot of the matrices. Text and vectors are persisted in
+SQLite and loaded back into the matrices at startup.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+KNOWLEDGE_DB = os.getenv("KNOWLEDGE_DB", "knowledge.db")
+KNOWLEDGE_DIMENSIONS = int(os.getenv("KNOWLEDGE_DIMENSIONS", "256"))
+KNOWLEDGE_CHUNK_WORDS = int(os.getenv("KNOWLEDGE_CHUNK_WORDS", "120"))
+KNOWLEDGE_CHUNK_OVERLAP = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP", "20"))
+# Chunks added to the ideas context, and the cosine score they must reach
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "3"))
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", "0.15"))
+
+DEFAULT_BRAND = "default"
+SOURCES = ("document", "post", "page")
+
+_TOKEN_RE = re.compile(r"\w+")
+_DELETED = -1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words without accents; single characters are dropped"""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    return [token for token in _TOKEN_RE.findall(folded) if len(token) > 1]
+
+
+def chunk_text(text: str, words: int = KNOWLEDGE_CHUNK_WORDS, overlap: int = KNOWLEDGE_CHUNK_OVERLAP) -> List[str]:
+    """Windows of `words` words, consecutive windows sharing `overlap` of them"""
+    tokens = text.split()
+    if not tokens:
+        return []
+    step = max(1, words - overlap)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(" ".join(tokens[start:start + words]))
+        if start + words >= len(tokens):
+            break
+    return chunks
+
+
+class HashedTfidf:
+    """Stateless hashed term-frequency embedder; IDF is supplied at query time"""
+
+    def __init__(self, dimensions: int = KNOWLEDGE_DIMENSIONS) -> None:
+        self.dimensions = dimensions
+
+    def term_frequencies(self, texts: Sequence[str]) -> np.ndarray:
+        """Signed sublinear term frequencies, one row per text, not normalized"""
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[int, float] = {}
+            for token in tokenize(text):
+                digest = zlib.crc32(token.encode("utf-8"))
+                bucket = digest % self.dimensions
+                counts[bucket] = counts.get(bucket, 0.0) + (1.0 if digest & 0x80000000 else -1.0)
+            for bucket, count in counts.items():
+                if count:
+                    matrix[row, bucket] = math.copysign(1.0 + math.log(abs(count)), count)
+        return matrix
+
+    def embed(self, texts: Sequence[str], idf: Optional[np.ndarray] = None) -> np.ndarray:
+        """Unit-length rows; weighted by idf first when given (queries)"""
+        matrix = self.term_frequencies(texts)
+        if idf is not None:
+            matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+class _Segment:
+    """One brand's vectors, dimension-major (one contiguous row per dimension)"""
+
+    def __init__(self, dimensions: int, capacity: int) -> None:
+        self.size = 0
+        self.vectors = np.zeros((dimensions, capacity), dtype=np.float32)
+        self.ids = np.full(capacity, _DELETED, dtype=np.int64)
+
+    def reserve(self, extra: int) -> None:
+        capacity = len(self.ids)
+        if self.size + extra <= capacity:
+            return
+        while capacity < self.size + extra:
+            capacity *= 2
+        # New arrays: snapshots taken before the growth keep reading the old ones
+        vectors = np.zeros((len(self.vectors), capacity), dtype=np.float32)
+        vectors[:, :self.size] = self.vectors[:, :self.size]
+        ids = np.full(capacity, _DELETED, dtype=np.int64)
+        ids[:self.size] = self.ids[:self.size]
+        self.vectors, self.ids = vectors, ids
+
+
+class VectorIndex:
+    """
+    Unit vectors in growable per-brand segments with cosine top-k search.
+    Segments are stored dimension-major, so a query only reads the
+    dimensions it uses: hashed TF-IDF queries set a fraction of the buckets,
+    and scoring reads just those rows instead of the whole matrix.
+    """
+
+    def __init__(self, dimensions: int, capacity: int = 1024) -> None:
+        self.dimensions = dimensions
+        self.size = 0
+        self._capacity = capacity
+        self._segments: Dict[int, _Segment] = {}
+        self._rows: Dict[int, Tuple[int, int]] = {}
+        self.live = 0
+        self.document_frequency = np.zeros(dimensions, dtype=np.float64)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray, brand_code: int) -> None:
+        segment = self._segments.get(brand_code)
+        if segment is None:
+            segment = self._segments[brand_code] = _Segment(self.dimensions, self._capacity)
+        segment.reserve(len(ids))
+        columns = slice(segment.size, segment.size + len(ids))
+        segment.vectors[:, columns] = vectors.T
+        segment.ids[columns] = ids
+        for offset, chunk_id in enumerate(ids):
+            self._rows[chunk_id] = (brand_code, segment.size + offset)
+        # Published last, so a concurrent snapshot never includes half-written columns
+        segment.size += len(ids)
+        self.size += len(ids)
+        self.live += len(ids)
+        self.document_frequency += (vectors != 0).sum(axis=0)
+
+    def remove(self, ids: Sequence[int]) -> None:
+        for chunk_id in ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is None:
+                continue
+            segment = self._segments[row[0]]
+            self.document_frequency -= segment.vectors[:, row[1]] != 0
+            segment.vectors[:, row[1]] = 0.0
+            segment.ids[row[1]] = _DELETED
+            self.live -= 1
+
+    def idf(self) -> np.ndarray:
+        return (np.log((1.0 + self.live) / (1.0 + self.document_frequency)) + 1.0).astype(np.float32)
+
+    def snapshot(self, brand_code: Optional[int] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (vectors, ids) views of the segments a search reads; brand_code=None
+        takes every brand. Take it under the owner's lock and search it
+        outside: adds only write past the views and growth allocates new arrays.
+        """
+        codes = list(self._segments) if brand_code is None else [brand_code]
+        return [
+            (segment.vectors[:, :segment.size], segment.ids[:segment.size])
+            for segment in (self._segments.get(code) for code in codes)
+            if segment is not None and segment.size
+        ]
+
+    def search(self, queries: np.ndarray, k: int, brand_code: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """Top-k (chunk id, cosine) per query row, best first; brand_code=None searches every brand"""
+        return search_snapshot(self.snapshot(brand_code), queries, k)
+
+
+# Scoring only the dimensions a query uses copies those rows out of the
+# segment; past about a third of the dimensions the full product is faster
+SPARSE_QUERY_MAX_FRACTION = 1 / 3
+
+
+def search_snapshot(
+    segments: List[Tuple[np.ndarray, np.ndarray]],
+    queries: np.ndarray,
+    k: int
+) -> List[List[Tuple[int, float]]]:
+    """Top-k (chunk id, cosine) per query row over VectorIndex.snapshot() segments"""
+    if k <= 0 or not segments:
+        return [[] for _ in range(len(queries))]
+    used = np.flatnonzero(queries.any(axis=0))
+    sparse = len(used) <= len(queries[0]) * SPARSE_QUERY_MAX_FRACTION
+    candidate_ids, candidate_scores = [], []
+    for vectors, ids in segments:
+        scores = queries[:, used] @ vectors[used] if sparse else queries @ vectors
+        size = len(ids)
+        top_k = min(k, size)
+        top = np.argpartition(scores, size - top_k, axis=1)[:, size - top_k:]
+        candidate_ids.append(ids[top])
+        candidate_scores.append(np.take_along_axis(scores, top, axis=1))
+    chunk_ids = np.concatenate(candidate_ids, axis=1)
+    scores = np.concatenate(candidate_scores, axis=1)
+    results = []
+    for row in range(len(queries)):
+        ranked = np.argsort(-scores[row])[:k]
+        # Deleted chunks have zero vectors, so they never score above zero
+        results.append([
+            (int(chunk_ids[row, index]), float(scores[row, index]))
+            for index in ranked if scores[row, index] > 0 and chunk_ids[row, index] != _DELETED
+        ])
+    return results
+
+
+class KnowledgeBase:
+    """Chunks in SQLite, their vectors in a VectorIndex, guarded by one lock"""
+
+    def __init__(self, path: str = KNOWLEDGE_DB, dimensions: int = KNOWLEDGE_DIMENSIONS) -> None:
+        self.embedder = HashedTfidf(dimensions)
+        self.index = VectorIndex(dimensions)
+        self._brand_codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    brand TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    title TEXT,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    document_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id);
+                """
+            )
+            self._load()
+
+    def _brand_code(self, brand: str) -> int:
+        return self._brand_codes.setdefault(brand, len(self._brand_codes))
+
+    def _load(self) -> None:
+        # Caller holds the lock
+        rows = self._conn.execute(
+            "SELECT c.id, d.brand, c.vector FROM chunks c JOIN documents d ON d.id = c.document_id ORDER BY d.brand, c.id"
+        ).fetchall()
+        by_brand: Dict[str, List[Tuple[int, bytes]]] = {}
+        for chunk_id, brand, vector in rows:
+            by_brand.setdefault(brand, []).append((chunk_id, vector))
+        for brand, chunks in by_brand.items():
+            vectors = np.frombuffer(b"".join(vector for _, vector in chunks), dtype=np.float32)
+            self.index.add(
+                [chunk_id for chunk_id, _ in chunks],
+                vectors.reshape(len(chunks), self.index.dimensions),
+                self._brand_code(brand)
+            )
+
+    def add_document(self, text: str, brand: str = DEFAULT_BRAND, source: str = "document", title: Optional[str] = None) -> Dict[str, Any]:
+        """Chunk, embed and index one document; returns its id and chunk count"""
+        chunks = chunk_text(text)
+        vectors = self.embedder.embed(chunks)
+        with self._lock, self._conn:
+            document_id = self._conn.execute(
+                "INSERT INTO documents (brand, source, title, created_at) VALUES (?, ?, ?, ?)",
+                (brand, source, title, time.time())
+            ).lastrowid
+            chunk_ids = []
+            for position, (chunk, vector) in enumerate(zip(chunks, vectors)):
+                chunk_ids.append(self._conn.execute(
+                    "INSERT INTO chunks (document_id, position, text, vector) VALUES (?, ?, ?, ?)",
+                    (document_id, position, chunk, vector.tobytes())
+                ).lastrowid)
+            if chunk_ids:
+                self.index.add(chunk_ids, vectors, self._brand_code(brand))
+        return {"document_id": document_id, "chunks": len(chunk_ids)}
+
+    def delete_document(self, document_id: int) -> bool:
+        with self._lock, self._conn:
+            chunk_ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM chunks WHERE document_id = ?", (document_id,)
+            )]
+            deleted = self._conn.execute("DELETE FROM documents WHERE id = ?", (document_id,)).rowcount
+            self._conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            self.index.remove(chunk_ids)
+        return bool(deleted)
+
+    def search_many(self, queries: Sequence[str], k: int = KNOWLEDGE_TOP_K, brand: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        """Top-k chunks for each query in one batched matrix product"""
+        # Only the snapshot is taken under the lock; embedding and scoring run
+        # outside it, so concurrent searches and adds do not queue behind them
+        with self._lock:
+            if brand is not None and brand not in self._brand_codes:
+                return [[] for _ in queries]
+            idf = self.index.idf()
+            segments = self.index.snapshot(None if brand is None else self._brand_codes[brand])
+        ranked = search_snapshot(segments, self.embedder.embed(queries, idf), k)
+        chunk_ids = {chunk_id for hits in ranked for chunk_id, _ in hits}
+        if chunk_ids:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT c.id, c.document_id, c.text, d.brand, d.source, d.title "
+                    "FROM chunks c JOIN documents d ON d.id = c.document_id "
+                    f"WHERE c.id IN ({','.join('?' * len(chunk_ids))})",
+                    tuple(chunk_ids)
+                ).fetchall()
+        else:
+            rows = []
+        chunks = {
+            row[0]: {"chunk_id": row[0], "document_id": row[1], "text": row[2], "brand": row[3], "source": row[4], "title": row[5]}
+            for row in rows
+        }
+        # A chunk deleted while the search ran is left out
+        return [
+            [{**chunks[chunk_id], "score": round(score, 4)} for chunk_id, score in hits if chunk_id in chunks]
+            for hits in ranked
+        ]
+
+    def search(self, query: str, k: int = KNOWLEDGE_TOP_K, brand: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.search_many([query], k, brand)[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            return {"documents": documents, "chunks": self.index.live, "dimensions": self.index.dimensions}
+
+
+def enrich_context(context: str, hits: List[Dict[str, Any]], min_score: float = KNOWLEDGE_MIN_SCORE) -> str:
+    """The analyzed context followed by the retrieved brand knowledge that clears min_score"""
+    relevant = [hit["text"] for hit in hits if hit["score"] >= min_score]
+    if not relevant:
+        return context
+    return context + "\n\nConocimiento de la marca relevante:\n" + "\n".join(f"- {text}" for text in relevant)
+
+
+knowledge_base = KnowledgeBase()
@@ -4,24 +4,116 @@ Integrates Gemini AI with LangChain/LangGraph for content generation
 """
 
 import os
-from typing import Optional, List, Dict, Any, TypedDict
+import io
+import re
+import time
+import uuid
+import base64
+import binascii
+import hashlib
+import math
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Optional, List, Dict, Any, Callable, Tuple, TypedDict
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 import requests
 from bs4 import BeautifulSoup
 import json
+import sqlite3
+import orjson
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 
 import google.generativeai as genai
-from google import genai as new_genai
 from langchain.schema import HumanMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
 from dotenv import load_dotenv
-from google.genai import types
+
+from metrics import (
+    DUPLICATE_IDEAS,
+    METRICS_CONTENT_TYPE,
+    RATE_LIMITED,
+    REQUESTS_IN_FLIGHT,
+    SEMANTIC_CACHE_LOOKUPS,
+    SEMANTIC_CACHE_SIMILARITY,
+    RequestTimings,
+    current_input_type,
+    current_timings,
+    note_cache_hit,
+    observe_call,
+    observe_node,
+    record_image_bytes,
+    record_degradation,
+    record_first_post,
+    record_json_parse,
+    record_lazy_render,
+    render_latest,
+)
+from profiling import is_admin_token, profile_path, profile_request, should_profile
+from memory import MemoryTracker, memory_report
+from structured_output import PARSE_FAILED, PARSE_REPAIRED, IncrementalArrayParser, extract_json, response_schema
+from serialization import FastJSONResponse, content_response_payload, image_url_fragment, visual_prompts_payload
+from ratelimit import RateLimiter
+from deadline import (
+    DEGRADED_IDEAS,
+    DEGRADED_IMAGES,
+    DEGRADED_POSTS,
+    DEGRADED_VISUAL_PROMPTS,
+    MIN_IMAGE_CALL_SECONDS,
+    MIN_TEXT_CALL_SECONDS,
+    call_timeout,
+    current_deadline,
+    deadline_scope,
+    has_budget,
+    llm_timeout_kwargs,
+    request_deadline,
+    run_within_budget,
+)
+from cancellation import (
+    ClientDisconnected,
+    RequestCancelled,
+    SubtaskCancelEvent,
+    check_cancelled,
+    current_cancel_event,
+    is_cancelled,
+    run_cancellable,
+    run_until_disconnected
+)
+from cache import IMAGE_CACHE_TTL_SECONDS, cache_key, image_cache
+from sessions import session_store
+from history import history_store
+from knowledge import DEFAULT_BRAND, KNOWLEDGE_TOP_K, SOURCES, enrich_context, knowledge_base
+from dedup import IdeaDeduplicator
+from semantic_cache import semantic_cache
+from shared_cache import (
+    NAMESPACE_LLM,
+    NAMESPACE_PAGES,
+    NAMESPACE_VISION,
+    context_store,
+    prompt_store,
+    shared_cache,
+)
+from key_pool import KeyPool, parse_keys
+from scheduler import PRIORITY_BATCH, current_priority, current_tenant, image_scheduler, text_scheduler
+from admission import DOWNGRADE, REJECT, AdmissionController
+from image_queue import IMAGE_RENDERING, RENDER_QUEUE, ImageJobQueue
+from image_render import (
+    IMAGE_MODEL,
+    cached_image,
+    image_breaker,
+    image_key_pool,
+    render_with_provider,
+    visual_prompt_id,
+)
+from brand_profiles import PROFILE_INPUT_TYPES, brand_profile_store, profile_context
 
 # Load environment variables
 load_dotenv()
@@ -36,31 +128,97 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id", "X-Image-Source", "X-Session-Id", "X-History-Id"],
 )
 
-# Initialize Gemini APIs
-GEMINI_TEXT_API_KEY = os.getenv("GEMINI_TEXT_API_KEY")
-GEMINI_IMAGE_API_KEY = os.getenv("GEMINI_IMAGE_API_KEY")
+# Initialize Gemini APIs. GEMINI_TEXT_API_KEYS lists several keys to pool
+# their quotas; the single-key variable is used when it is unset (the image
+# keys are read by image_render)
+GEMINI_TEXT_API_KEYS = parse_keys(os.getenv("GEMINI_TEXT_API_KEYS"), os.getenv("GEMINI_TEXT_API_KEY"))
 
+if not GEMINI_TEXT_API_KEYS:
+    raise ValueError("GEMINI_TEXT_API_KEY environment variable is required")
 
+GEMINI_TEXT_API_KEY = GEMINI_TEXT_API_KEYS[0]
 
-if not GEMINI_TEXT_API_KEY:
-    raise ValueError("GEMINI_TEXT_API_KEY environment variable is required")
-if not GEMINI_IMAGE_API_KEY:
-    raise ValueError("GEMINI_IMAGE_API_KEY environment variable is required")
+TEXT_MODEL = "gemini-2.5-flash"
+
+def chat_model(api_key: str) -> ChatGoogleGenerativeAI:
+    """
+    Text model client on one key. A single attempt per call: langchain would
+    otherwise retry a 429 on the same throttled key with long backoff sleeps,
+    while the key pool and breaker are the ones that retry and rotate keys.
+    """
+    return ChatGoogleGenerativeAI(model=TEXT_MODEL, google_api_key=api_key, max_retries=1)
 
 # Configure text generation
 genai.configure(api_key=GEMINI_TEXT_API_KEY)
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GEMINI_TEXT_API_KEY)
+llm = chat_model(GEMINI_TEXT_API_KEY)
+
+# Each call leases the least-loaded text key; with one key the pool only
+# keeps the usage counts and the calls go through llm above
+text_key_pool = KeyPool("text", GEMINI_TEXT_API_KEYS, chat_model)
+
+@contextmanager
+def text_model():
+    """
+    Chat model for one text call, once the fair scheduler grants a text slot,
+    on the least-loaded text key. Enter it before observe_call, as
+    render_with_provider does, so queue wait stays out of the call latency.
+    """
+    with text_scheduler.slot(), text_key_pool.lease() as pooled:
+        yield llm if len(text_key_pool) == 1 else pooled.client
+
+INPUT_TYPES = ("text", "url", "image", "guided")
+# input_type of requests whose context is a stored brand profile (profile_id)
+PROFILE_INPUT = "profile"
+
+# Shared by every endpoint that calls the providers; disabled unless
+# RATE_LIMIT_PER_MINUTE is set
+rate_limiter = RateLimiter()
+
+# With IMAGE_RENDERING=queue, renders are handed to image_worker.py processes
+image_job_queue = ImageJobQueue() if IMAGE_RENDERING == RENDER_QUEUE else None
+
+# Turns new generations away, or drops their images, while the provider
+# queues (or the image job queue) are too long for them to finish in time
+admission_controller = AdmissionController(text_scheduler, image_scheduler, image_queue=image_job_queue)
+
+# Ideas already produced per account (brand), seeded from the latest history
+# entries; repeats are re-asked once before any copy or image work
+idea_deduplicator = IdeaDeduplicator()
+IDEA_DEDUP_SEED_ENTRIES = int(os.getenv("IDEA_DEDUP_SEED_ENTRIES", "2000"))
+IDEA_DEDUP_REASK_SPARE = int(os.getenv("IDEA_DEDUP_REASK_SPARE", "2"))
+for seeded_brand, seeded_idea in history_store.recent_ideas(IDEA_DEDUP_SEED_ENTRIES):
+    idea_deduplicator.add(seeded_brand or DEFAULT_BRAND, [seeded_idea])
+
+# Characters of a fetched page kept for the knowledge base (the URL context uses 2000)
+KNOWLEDGE_PAGE_MAX_CHARS = int(os.getenv("KNOWLEDGE_PAGE_MAX_CHARS", "50000"))
+
+# Stage endpoints: largest accepted batch, and how many of its items run at once
+STAGE_BATCH_MAX_ITEMS = int(os.getenv("STAGE_BATCH_MAX_ITEMS", "20"))
+STAGE_BATCH_CONCURRENCY = int(os.getenv("STAGE_BATCH_CONCURRENCY", "5"))
 
-# Initialize GenAI client for Imagen
-client = new_genai.Client(api_key=GEMINI_IMAGE_API_KEY)
+# Default for the low_memory form field: stream the JSON body and release
+# image buffers as soon as each one has been written
+LOW_MEMORY_RESPONSES = os.getenv("LOW_MEMORY_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+# Stream idea generation and start each idea's copy, visual prompt and image
+# as soon as the idea is complete, instead of after all five
+STREAM_IDEAS = os.getenv("STREAM_IDEAS", "false").lower() in ("1", "true", "yes")
+
+# Ideas per request: the default, and the server-side cap on n_ideas. Each idea
+# costs one copy, one visual prompt and one image, so cost scales with it.
+DEFAULT_IDEAS = 5
+MAX_IDEAS = int(os.getenv("MAX_IDEAS", "10"))
 
 # Pydantic models for request/response
 class ContentRequest(BaseModel):
-    input_type: str  # "text", "url", "guided"
+    input_type: str  # "text", "url", "image", "guided"
     content: Optional[str] = None
     guided_answers: Optional[Dict[str, str]] = None
+    image_base64: Optional[str] = None  # input_type "image"
+    brand: Optional[str] = None  # history matches are looked up for this brand only
 
 class ContentIdea(BaseModel):
     title: str
@@ -75,12 +233,87 @@ class PostContent(BaseModel):
 class VisualPrompt(BaseModel):
     description: str
     image_url: Optional[str] = None
+    prompt_id: Optional[str] = None  # render lazily with GET /api/images/{prompt_id}
+
+# Stage endpoint bodies: each stage on its own, for clients that compose the pipeline
+class IdeasRequest(BaseModel):
+    context: str
+    n_ideas: int = DEFAULT_IDEAS
+    exclude_titles: List[str] = []
+    brand: Optional[str] = None
+
+class IdeaRequest(BaseModel):
+    idea: ContentIdea
+    context: str
+
+class ImageRequest(BaseModel):
+    prompt: str
+
+class ContextBatchRequest(BaseModel):
+    items: List[ContentRequest]
+
+class IdeasBatchRequest(BaseModel):
+    items: List[IdeasRequest]
+
+class IdeaBatchRequest(BaseModel):
+    items: List[IdeaRequest]
+
+class ImageBatchRequest(BaseModel):
+    items: List[ImageRequest]
+
+class KnowledgeDocument(BaseModel):
+    text: Optional[str] = None
+    url: Optional[str] = None  # fetched and stored as a "page"
+    title: Optional[str] = None
+    brand: str = DEFAULT_BRAND
+    source: str = "document"  # "document", "post" or "page"
+
+class BrandProfileRequest(BaseModel):
+    input_type: str  # "text", "url" or "guided"
+    content: Optional[str] = None
+    guided_answers: Optional[Dict[str, str]] = None
+    brand: str = DEFAULT_BRAND
+    name: Optional[str] = None
+
+class BrandAnalysis(BaseModel):
+    summary: str
+    tone: str
+    audience: str
+    keywords: List[str]
+
+class StageTiming(BaseModel):
+    name: str
+    kind: str  # "node" or "call"
+    duration_ms: float
+    outcome: str  # "ok", "fallback", "error"
+
+class RequestTimingsSummary(BaseModel):
+    total_ms: float
+    first_post_ms: Optional[float] = None
+    stages: List[StageTiming]
+    llm_calls: int
+    cache_hits: int
+    fallbacks: int
 
 class ContentResponse(BaseModel):
     ideas: List[ContentIdea]
     posts: List[PostContent]
     visual_prompts: List[VisualPrompt]
     context_summary: str
+    context_id: Optional[str] = None  # continue with POST /api/more-ideas
+    session_id: Optional[str] = None  # regenerate parts with /api/sessions/{session_id}/...
+    history_id: Optional[int] = None  # stored entry, see /api/history/{history_id}
+    degraded: List[str] = []  # parts cut short by the request deadline
+    timings: Optional[RequestTimingsSummary] = None
+
+# Provider-side response schemas for the structured JSON calls
+@lru_cache(maxsize=None)
+def ideas_response_schema(n_ideas: int) -> Dict[str, Any]:
+    return response_schema(ContentIdea, array_length=n_ideas)
+
+IDEAS_RESPONSE_SCHEMA = ideas_response_schema(DEFAULT_IDEAS)
+COPY_RESPONSE_SCHEMA = response_schema(PostContent)
+BRAND_ANALYSIS_SCHEMA = response_schema(BrandAnalysis)
 
 # LangGraph State Definition
 class ContentGenerationState(TypedDict):
@@ -89,6 +322,14 @@ class ContentGenerationState(TypedDict):
     posts: List[Dict[str, Any]]
     visual_prompts: List[str]
     error: Optional[str]
+    deadline: Optional[float]  # absolute time.time() budget for the request
+    degraded: List[str]
+    draft: bool  # visual prompts only; images are rendered on demand
+    n_ideas: int
+    exclude_titles: List[str]  # ideas already produced for this context
+    context_id: Optional[str]
+    session_id: Optional[str]  # checkpoint thread of this run
+    brand: Optional[str]  # knowledge base namespace for the ideas context
 
 # Context Processing Functions
 def process_text_context(text: str) -> str:
@@ -109,152 +350,447 @@ def process_text_context(text: str) -> str:
     Responde con texto corrido, sin asteriscos, guiones, ni ningún tipo de formato markdown.
     """
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    key = cache_key(TEXT_MODEL, prompt)
+    cached = shared_cache.get_text(NAMESPACE_LLM, key)
+    if cached is not None:
+        note_cache_hit()
+        return cached
+    check_cancelled("process_text_context")
+    with text_model() as model, observe_call("process_text_context", TEXT_MODEL):
+        response = model.invoke([HumanMessage(content=prompt)], **llm_timeout_kwargs())
     # Clean markdown artifacts
     clean_content = response.content.strip()
     clean_content = clean_content.replace('*', '').replace('#', '').replace('-', '').replace('_', '')
     clean_content = ' '.join(clean_content.split())  # Remove extra whitespace
+    shared_cache.set_text(NAMESPACE_LLM, key, clean_content)
     return clean_content
 
+def fetch_page_text(url: str, max_chars: int = 2000) -> str:
+    """Visible text of a webpage, limited to its first max_chars characters"""
+    key = cache_key(url, str(max_chars))
+    cached = shared_cache.get_text(NAMESPACE_PAGES, key)
+    if cached is not None:
+        note_cache_hit()
+        return cached
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    }
+    with observe_call("fetch_url"):
+        response = requests.get(url, headers=headers, timeout=call_timeout(cap=10))
+    soup = BeautifulSoup(response.content, 'html.parser')
+    text = soup.get_text()[:max_chars]
+    shared_cache.set_text(NAMESPACE_PAGES, key, text)
+    return text
+
 def process_url_context(url: str) -> str:
     """Extract context from Instagram profile URL or webpage"""
-    try:
-        # Fetch webpage content
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract text content
-        text_content = soup.get_text()[:2000]  # Limit to first 2000 chars
-        
-        prompt = f"""
-        Analiza el contenido de esta página web y extrae información relevante para crear 
-        contenido similar para Instagram:
-        
-        URL: {url}
-        Contenido: {text_content}
-        
-        Proporciona un análisis en texto plano, sin formato markdown, del:
-        - Estilo de contenido
-        - Audiencia objetivo
-        - Temas principales
-        - Tono de comunicación
-        
-        Responde con texto corrido, sin asteriscos, guiones, ni ningún tipo de formato markdown.
-        """
-        
-        response = llm.invoke([HumanMessage(content=prompt)])
-        # Clean markdown artifacts
-        clean_content = response.content.strip()
-        clean_content = clean_content.replace('*', '').replace('#', '').replace('-', '').replace('_', '')
-        clean_content = ' '.join(clean_content.split())  # Remove extra whitespace
-        return clean_content
-        
-    except Exception as e:
-        return f"Error procesando URL: {str(e)}. Usando contexto genérico."
+    check_cancelled("process_url_context")
+    with observe_call("process_url_context", TEXT_MODEL, model_call=False) as obs:
+        try:
+            # Fetch webpage content
+            text_content = fetch_page_text(url)
+            
+            prompt = f"""
+            Analiza el contenido de esta página web y extrae información relevante para crear 
+            contenido similar para Instagram:
+            
+            URL: {url}
+            Contenido: {text_content}
+            
+            Proporciona un análisis en texto plano, sin formato markdown, del:
+            - Estilo de contenido
+            - Audiencia objetivo
+            - Temas principales
+            - Tono de comunicación
+            
+            Responde con texto corrido, sin asteriscos, guiones, ni ningún tipo de formato markdown.
+            """
+            
+            key = cache_key(TEXT_MODEL, prompt)
+            cached = shared_cache.get_text(NAMESPACE_LLM, key)
+            if cached is not None:
+                note_cache_hit()
+                return cached
+            check_cancelled("process_url_context")
+            with text_model() as model, observe_call("url_context_call", TEXT_MODEL):
+                response = model.invoke([HumanMessage(content=prompt)], **llm_timeout_kwargs())
+            # Clean markdown artifacts
+            clean_content = response.content.strip()
+            clean_content = clean_content.replace('*', '').replace('#', '').replace('-', '').replace('_', '')
+            clean_content = ' '.join(clean_content.split())  # Remove extra whitespace
+            shared_cache.set_text(NAMESPACE_LLM, key, clean_content)
+            return clean_content
+            
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            obs.fallback()
+            return f"Error procesando URL: {str(e)}. Usando contexto genérico."
 
 def process_image_context(image_data: bytes) -> str:
     """Process uploaded image to extract context using Gemini Vision"""
-    try:
-        # Initialize Gemini Vision model with correct API key
-        genai.configure(api_key=GEMINI_TEXT_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Convert bytes to PIL Image
-        image = Image.open(BytesIO(image_data))
+    key = cache_key(TEXT_MODEL, hashlib.sha256(image_data).hexdigest())
+    cached = shared_cache.get_text(NAMESPACE_VISION, key)
+    if cached is not None:
+        note_cache_hit()
+        return cached
+    check_cancelled("process_image_context")
+    with observe_call("process_image_context", TEXT_MODEL, model_call=False) as obs:
+        try:
+            # Decoded only to reject files that are not images before the call
+            with Image.open(BytesIO(image_data)) as image:
+                mime_type = Image.MIME.get(image.format, "image/png")
         
-        prompt = """
-        Analiza esta imagen y describe detalladamente lo que ves para crear contenido de Instagram relacionado.
-        Proporciona un análisis en texto plano, sin formato markdown, que incluya:
-        - Descripción visual detallada
-        - Posible audiencia objetivo
-        - Temas o conceptos que la imagen sugiere
-        - Emociones que transmite
-        - Ideas de contenido relacionado
+            prompt = """
+            Analiza esta imagen y describe detalladamente lo que ves para crear contenido de Instagram relacionado.
+            Proporciona un análisis en texto plano, sin formato markdown, que incluya:
+            - Descripción visual detallada
+            - Posible audiencia objetivo
+            - Temas o conceptos que la imagen sugiere
+            - Emociones que transmite
+            - Ideas de contenido relacionado
         
-        Responde con texto corrido, sin asteriscos, guiones, ni ningún tipo de formato markdown.
-        """
+            Responde con texto corrido, sin asteriscos, guiones, ni ningún tipo de formato markdown.
+            """
+            message = HumanMessage(content=[
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": f"data:{mime_type};base64,{base64.b64encode(image_data).decode('ascii')}"},
+            ])
         
-        response = model.generate_content([prompt, image])
-        # Clean markdown artifacts
-        clean_content = response.text.strip()
-        clean_content = clean_content.replace('*', '').replace('#', '').replace('-', '').replace('_', '')
-        clean_content = ' '.join(clean_content.split())  # Remove extra whitespace
-        return clean_content
+            check_cancelled("process_image_context")
+            with text_model() as model, observe_call("image_context_call", TEXT_MODEL):
+                response = model.invoke([message], **llm_timeout_kwargs())
+            # Clean markdown artifacts
+            clean_content = response.content.strip()
+            clean_content = clean_content.replace('*', '').replace('#', '').replace('-', '').replace('_', '')
+            clean_content = ' '.join(clean_content.split())  # Remove extra whitespace
+            shared_cache.set_text(NAMESPACE_VISION, key, clean_content)
+            return clean_content
         
-    except Exception as e:
-        return f"Error procesando imagen: {str(e)}. Usando descripción genérica."
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            obs.fallback()
+            return f"Error procesando imagen: {str(e)}. Usando descripción genérica."
+
+def process_input_context(
+    input_type: str,
+    content: Optional[str],
+    answers: Optional[Dict[str, str]],
+    image_data: Optional[bytes]
+) -> str:
+    """Dispatch to the context processor for input_type"""
+    if input_type == "text" and content:
+        return process_text_context(content)
+    elif input_type == "url" and content:
+        return process_url_context(content)
+    elif input_type == "image" and image_data:
+        return process_image_context(image_data)
+    elif input_type == "guided" and answers:
+        return process_guided_context(answers)
+    else:
+        raise HTTPException(status_code=400, detail="Invalid input type or missing content")
 
 def process_guided_context(answers: Dict[str, str]) -> str:
     """Process guided questionnaire answers to create context"""
-    niche = answers.get("niche", "general")
-    objective = answers.get("objective", "entretener")
-    tone = answers.get("tone", "amigable")
+    with observe_call("process_guided_context"):
+        niche = answers.get("niche", "general")
+        objective = answers.get("objective", "entretener")
+        tone = answers.get("tone", "amigable")
+    
+        context = f"""
+        Contexto del usuario:
+        - Nicho/Industria: {niche}
+        - Objetivo de la publicación: {objective}
+        - Tono de voz preferido: {tone}
+    
+        Crear contenido de Instagram optimizado para esta audiencia y objetivos específicos.
+        """
+    
+        return context
+
+def analyze_brand(input_type: str, source: Any) -> Dict[str, Any]:
+    """
+    Summary, tone, audience and keywords of a brand for its stored profile,
+    in one structured call. Raises ValueError when the answer is unusable
+    (and requests.RequestException when a URL cannot be fetched), so a
+    refresh never replaces a good profile with generic content.
+    """
+    if input_type == "url":
+        material = f"URL: {source}\nContenido: {fetch_page_text(source)}"
+    elif input_type == "guided":
+        material = process_guided_context(source)
+    else:
+        material = source
+    prompt = f"""
+    Analiza esta marca para crear contenido de Instagram de forma recurrente:
     
-    context = f"""
-    Contexto del usuario:
-    - Nicho/Industria: {niche}
-    - Objetivo de la publicación: {objective}
-    - Tono de voz preferido: {tone}
+    {material}
     
-    Crear contenido de Instagram optimizado para esta audiencia y objetivos específicos.
+    Responde SOLO con JSON válido, en texto plano sin formato markdown:
+    {{
+        "summary": "Resumen del contexto: temas principales, estilo y propuesta de la marca",
+        "tone": "Tono de comunicación",
+        "audience": "Audiencia objetivo",
+        "keywords": ["palabra clave 1", "palabra clave 2", "palabra clave 3"]
+    }}
     """
     
-    return context
+    check_cancelled("analyze_brand")
+    with text_model() as model, observe_call("analyze_brand", TEXT_MODEL) as obs:
+        response = model.invoke(
+            [HumanMessage(content=prompt)],
+            response_mime_type="application/json",
+            response_schema=BRAND_ANALYSIS_SCHEMA,
+            **llm_timeout_kwargs()
+        )
+        try:
+            analysis_json, parse_result = extract_json(response.content, dict)
+            analysis = BrandAnalysis(**analysis_json).model_dump()
+        except (ValueError, TypeError):
+            record_json_parse("analyze_brand", PARSE_FAILED)
+            obs.error()
+            raise ValueError("The brand analysis could not be parsed")
+        record_json_parse("analyze_brand", parse_result)
+        return analysis
 
 # Content Generation Functions
-def generate_ideas(context: str) -> List[Dict[str, str]]:
-    """Generate 5 Instagram post ideas based on context"""
-    prompt = f"""
-    Basándote en el siguiente contexto, genera exactamente 5 ideas creativas y atractivas para publicaciones de Instagram.
+def ideas_prompt(context: str, n_ideas: int = DEFAULT_IDEAS, exclude_titles: Optional[List[str]] = None) -> str:
+    """Prompt asking for n_ideas Instagram post ideas as a JSON array"""
+    examples = ",\n".join(
+        f'        {{"title": "Título de la idea {number}", "description": "Descripción breve de la idea {number}"}}'
+        for number in range(1, n_ideas + 1)
+    )
+    avoid = ""
+    if exclude_titles:
+        listed = "\n".join(f"    - {title}" for title in exclude_titles)
+        avoid = f"""
+    Ya se propusieron estas ideas; no las repitas ni propongas variaciones de ellas:
+{listed}
+    """
+    return f"""
+    Basándote en el siguiente contexto, genera exactamente {n_ideas} ideas creativas y atractivas para publicaciones de Instagram.
     
     Contexto: {context}
-    
+    {avoid}
     Para cada idea, proporciona:
     - Un título atractivo (máximo 8 palabras)
     - Una descripción breve (máximo 25 palabras)
     
     Responde SOLO con un JSON válido, sin texto adicional:
     [
-        {{"title": "Título de la idea 1", "description": "Descripción breve de la primera idea"}},
-        {{"title": "Título de la idea 2", "description": "Descripción breve de la segunda idea"}},
-        {{"title": "Título de la idea 3", "description": "Descripción breve de la tercera idea"}},
-        {{"title": "Título de la idea 4", "description": "Descripción breve de la cuarta idea"}},
-        {{"title": "Título de la idea 5", "description": "Descripción breve de la quinta idea"}}
+{examples}
     ]
     """
+
+def _title_key(title: str) -> str:
+    return " ".join(title.lower().split())
+
+def _new_ideas(items: List[Any], seen_titles: set) -> List[Dict[str, str]]:
+    """Valid ideas whose titles were not produced before; seen_titles is updated"""
+    ideas = []
+    for idea in _valid_items(items, ContentIdea):
+        key = _title_key(idea["title"])
+        if key in seen_titles:
+            continue
+        seen_titles.add(key)
+        ideas.append(idea)
+    return ideas
+
+def ideas_from_response(
+    text: str,
+    context: str,
+    n_ideas: int = DEFAULT_IDEAS,
+    exclude_titles: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, str]], str]:
+    """
+    Validated new ideas from a model response, completed with template ideas
+    when the output was truncated, partially invalid or repeated earlier
+    titles. Returns (ideas, parse result); raises ValueError when nothing
+    usable was written.
+    """
+    ideas_json, parse_result = extract_json(text, list)
+    seen_titles = {_title_key(title) for title in exclude_titles or []}
+    ideas = _new_ideas(ideas_json, seen_titles)[:n_ideas]
+    if not ideas:
+        raise ValueError("No se generaron ideas válidas")
+    if len(ideas) < n_ideas:
+        # Truncated or partially invalid output: keep what the model
+        # wrote and complete the set with template ideas
+        parse_result = PARSE_REPAIRED
+        ideas += fallback_ideas(
+            context, n_ideas - len(ideas), (exclude_titles or []) + [idea["title"] for idea in ideas]
+        )
+    return ideas, parse_result
+
+def generate_ideas(
+    context: str,
+    n_ideas: int = DEFAULT_IDEAS,
+    exclude_titles: Optional[List[str]] = None
+) -> List[Dict[str, str]]:
+    """Generate n_ideas Instagram post ideas based on context, avoiding exclude_titles"""
+    check_cancelled("generate_ideas")
+    with text_model() as model, observe_call("generate_ideas", TEXT_MODEL) as obs:
+        response = model.invoke(
+            [HumanMessage(content=ideas_prompt(context, n_ideas, exclude_titles))],
+            response_mime_type="application/json",
+            response_schema=ideas_response_schema(n_ideas),
+            **llm_timeout_kwargs()
+        )
+    
+        try:
+            ideas, parse_result = ideas_from_response(response.content, context, n_ideas, exclude_titles)
+            record_json_parse("generate_ideas", parse_result)
+            return ideas
+        except (ValueError, TypeError):
+            record_json_parse("generate_ideas", PARSE_FAILED)
+            obs.fallback()
+            return fallback_ideas(context, n_ideas, exclude_titles)
+
+def stream_ideas(
+    context: str,
+    on_idea: Callable[[int, Dict[str, str]], None],
+    n_ideas: int = DEFAULT_IDEAS,
+    exclude_titles: Optional[List[str]] = None
+) -> List[Dict[str, str]]:
+    """
+    Generate the ideas from a token stream, calling on_idea(index, idea) as
+    soon as each idea object is complete so downstream work can start early.
+    Returns the final list, parsed from the whole response exactly as
+    generate_ideas does; callers reconcile it with the ideas already released.
+    """
+    check_cancelled("generate_ideas")
+    parser = IncrementalArrayParser()
+    seen_titles = {_title_key(title) for title in exclude_titles or []}
+    chunks = []
+    released = 0
+    with text_model() as model, observe_call("generate_ideas", TEXT_MODEL) as obs:
+        try:
+            for chunk in model.stream(
+                [HumanMessage(content=ideas_prompt(context, n_ideas, exclude_titles))],
+                response_mime_type="application/json",
+                response_schema=ideas_response_schema(n_ideas),
+                **llm_timeout_kwargs()
+            ):
+                chunks.append(chunk.content)
+                for idea in _new_ideas(parser.feed(chunk.content), seen_titles):
+                    if released < n_ideas:
+                        on_idea(released, idea)
+                        released += 1
+        except Exception:
+            if not released:
+                raise
+            # The stream broke off after some ideas; the truncated text is
+            # repaired below and the missing ideas completed from templates
+            print("Idea stream interrupted, keeping the ideas received so far")
+    
+        try:
+            ideas, parse_result = ideas_from_response("".join(chunks), context, n_ideas, exclude_titles)
+            record_json_parse("generate_ideas", parse_result)
+            return ideas
+        except (ValueError, TypeError):
+            record_json_parse("generate_ideas", PARSE_FAILED)
+            obs.fallback()
+            return fallback_ideas(context, n_ideas, exclude_titles)
+
+def _valid_items(items: List[Any], model) -> List[Dict[str, Any]]:
+    """Keep the list entries that validate against a pydantic model"""
+    valid = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            valid.append(model(**item).model_dump())
+        except ValueError:
+            continue
+    return valid
+
+def knowledge_context(context: str, brand: Optional[str] = None) -> str:
+    """Context for generate_ideas, enriched with the brand's most relevant stored knowledge"""
+    if not knowledge_base.index.live:
+        return context
+    with observe_call("knowledge_search"):
+        hits = knowledge_base.search(context, KNOWLEDGE_TOP_K, brand or DEFAULT_BRAND)
+    return enrich_context(context, hits)
+
+def replace_duplicate_ideas(
+    ideas: List[Dict[str, str]],
+    context: str,
+    brand: Optional[str] = None,
+    exclude_titles: Optional[List[str]] = None
+) -> List[Dict[str, str]]:
+    """
+    Swap ideas that repeat earlier ones of the account (or each other) with a
+    single targeted re-ask, then remember the final list. The re-ask asks for
+    IDEA_DEDUP_REASK_SPARE extra candidates, since the account's past titles
+    cannot all be listed in the prompt; when no fresh candidate is left, or
+    the deadline has no room for the call, the original idea is kept.
+    """
+    account = brand or DEFAULT_BRAND
+    duplicates = idea_deduplicator.find_duplicates(account, ideas)
+    # The ideas that stay are remembered first, and each accepted replacement
+    # before the next is checked, so replacements do not repeat them or each other
+    idea_deduplicator.add(account, [idea for position, idea in enumerate(ideas) if position not in duplicates])
+    if duplicates:
+        avoid = list(exclude_titles or []) + [idea["title"] for idea in ideas] + list(duplicates.values())
+        replacements, _ = run_within_budget(
+            lambda: generate_ideas(context, idea_count(len(duplicates) + IDEA_DEDUP_REASK_SPARE), avoid),
+            lambda: [],
+            MIN_TEXT_CALL_SECONDS
+        )
+        avoided = {_title_key(title) for title in avoid}
+        candidates = iter([
+            replacement for replacement in replacements if _title_key(replacement["title"]) not in avoided
+        ])
+        ideas = list(ideas)
+        for position in sorted(duplicates):
+            replacement = next(
+                (candidate for candidate in candidates if not idea_deduplicator.find_duplicates(account, [candidate])),
+                None
+            )
+            if replacement is not None:
+                ideas[position] = replacement
+                DUPLICATE_IDEAS.labels("replaced").inc()
+            else:
+                DUPLICATE_IDEAS.labels("kept").inc()
+            idea_deduplicator.add(account, [ideas[position]])
+    return ideas
+
+def fallback_ideas(
+    context: str,
+    n_ideas: int = DEFAULT_IDEAS,
+    exclude_titles: Optional[List[str]] = None
+) -> List[Dict[str, str]]:
+    """Generic ideas derived from the context when the model output is unusable"""
+    # Extraer palabras clave del contexto
+    keywords = re.findall(r'\b\w+\b', context.lower())
+    main_topic = keywords[0] if keywords else "contenido"
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    templates = [
+        {"title": f"Guía completa de {main_topic}", "description": f"Todo lo que necesitas saber sobre {main_topic}"},
+        {"title": f"Tips esenciales de {main_topic}", "description": f"Consejos prácticos y útiles para {main_topic}"},
+        {"title": f"Secretos de {main_topic}", "description": f"Trucos poco conocidos sobre {main_topic}"},
+        {"title": f"Errores comunes en {main_topic}", "description": f"Qué evitar al hacer {main_topic}"},
+        {"title": f"Inspiración para {main_topic}", "description": f"Ideas creativas relacionadas con {main_topic}"},
+        {"title": f"Mitos sobre {main_topic}", "description": f"Lo que se cree de {main_topic} y no es cierto"},
+        {"title": f"Primeros pasos en {main_topic}", "description": f"Cómo empezar con {main_topic} desde cero"},
+        {"title": f"Preguntas frecuentes de {main_topic}", "description": f"Respuestas a las dudas más comunes sobre {main_topic}"},
+        {"title": f"Tendencias de {main_topic}", "description": f"Lo que está marcando el momento en {main_topic}"},
+        {"title": f"Antes y después con {main_topic}", "description": f"Resultados reales gracias a {main_topic}"}
+    ]
     
-    try:
-        # Limpiar la respuesta y extraer solo el JSON
-        content = response.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        elif content.startswith("```"):
-            content = content.replace("```", "").strip()
-        
-        ideas_json = json.loads(content)
-        if len(ideas_json) == 5 and all("title" in idea and "description" in idea for idea in ideas_json):
-            return ideas_json
-        else:
-            raise ValueError("No se generaron 5 ideas válidas")
-    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
-        # Fallback genérico basado en el contexto
-        import re
-        # Extraer palabras clave del contexto
-        keywords = re.findall(r'\b\w+\b', context.lower())
-        main_topic = keywords[0] if keywords else "contenido"
-        
-        return [
-            {"title": f"Guía completa de {main_topic}", "description": f"Todo lo que necesitas saber sobre {main_topic}"},
-            {"title": f"Tips esenciales de {main_topic}", "description": f"Consejos prácticos y útiles para {main_topic}"},
-            {"title": f"Secretos de {main_topic}", "description": f"Trucos poco conocidos sobre {main_topic}"},
-            {"title": f"Errores comunes en {main_topic}", "description": f"Qué evitar al hacer {main_topic}"},
-            {"title": f"Inspiración para {main_topic}", "description": f"Ideas creativas relacionadas con {main_topic}"}
+    seen_titles = {_title_key(title) for title in exclude_titles or []}
+    ideas = [idea for idea in templates if _title_key(idea["title"]) not in seen_titles]
+    part = 2
+    while len(ideas) < n_ideas:
+        # More ideas requested than templates left: continue as numbered parts
+        ideas += [
+            {"title": f"{idea['title']} (parte {part})", "description": idea["description"]}
+            for idea in templates
+            if _title_key(f"{idea['title']} (parte {part})") not in seen_titles
         ]
+        part += 1
+    return ideas[:n_ideas]
 
 def generate_copy(idea: Dict[str, str], context: str) -> Dict[str, Any]:
     """Generate Instagram copy for a specific idea"""
@@ -280,32 +816,39 @@ def generate_copy(idea: Dict[str, str], context: str) -> Dict[str, Any]:
     }}
     """
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    check_cancelled("generate_copy")
+    with text_model() as model, observe_call("generate_copy", TEXT_MODEL) as obs:
+        response = model.invoke(
+            [HumanMessage(content=prompt)],
+            response_mime_type="application/json",
+            response_schema=COPY_RESPONSE_SCHEMA,
+            **llm_timeout_kwargs()
+        )
     
-    try:
-        content = response.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        elif content.startswith("```"):
-            content = content.replace("```", "").strip()
-        
-        copy_json = json.loads(content)
-        return copy_json
-    except (json.JSONDecodeError, KeyError, TypeError):
-        # Fallback genérico basado en la idea
-        import re
-        # Determinar hashtags relevantes basados en el contexto
-        keywords = re.findall(r'\b\w+\b', context.lower())
-        topic_tags = [f"#{word.capitalize()}" for word in keywords[:3] if len(word) > 3]
-        generic_tags = ["#Instagram", "#Contenido", "#Tips"]
-        hashtags = topic_tags + generic_tags
-        
-        return {
-            "hook": f"✨ ¿Sabías todo esto sobre {idea['title']}?",
-            "body": f"{idea['description']}. En este post te comparto información valiosa que te va a ayudar a entender mejor este tema. Es perfecto para aplicar en tu día a día.",
-            "cta": "¿Qué opinas? ¡Cuéntame en los comentarios!",
-            "hashtags": hashtags[:5]  # Máximo 5 hashtags
-        }
+        try:
+            copy_json, parse_result = extract_json(response.content, dict)
+            copy = PostContent(**copy_json).model_dump()
+            record_json_parse("generate_copy", parse_result)
+            return copy
+        except (ValueError, TypeError):
+            record_json_parse("generate_copy", PARSE_FAILED)
+            obs.fallback()
+            return fallback_copy(idea, context)
+
+def fallback_copy(idea: Dict[str, str], context: str) -> Dict[str, Any]:
+    """Generic copy built from the idea when the model output is unusable"""
+    # Determinar hashtags relevantes basados en el contexto
+    keywords = re.findall(r'\b\w+\b', context.lower())
+    topic_tags = [f"#{word.capitalize()}" for word in keywords[:3] if len(word) > 3]
+    generic_tags = ["#Instagram", "#Contenido", "#Tips"]
+    hashtags = topic_tags + generic_tags
+    
+    return {
+        "hook": f"✨ ¿Sabías todo esto sobre {idea['title']}?",
+        "body": f"{idea['description']}. En este post te comparto información valiosa que te va a ayudar a entender mejor este tema. Es perfecto para aplicar en tu día a día.",
+        "cta": "¿Qué opinas? ¡Cuéntame en los comentarios!",
+        "hashtags": hashtags[:5]  # Máximo 5 hashtags
+    }
 
 def generate_visual_prompt(idea: Dict[str, str], context: str) -> str:
     """Generate visual description for image generation"""
@@ -326,91 +869,156 @@ def generate_visual_prompt(idea: Dict[str, str], context: str) -> str:
     Responde con un prompt de máximo 80 palabras en inglés, optimizado para generación de imágenes.
     """
     
-    response = llm.invoke([HumanMessage(content=prompt)])
+    check_cancelled("generate_visual_prompt")
+    with text_model() as model, observe_call("generate_visual_prompt", TEXT_MODEL):
+        response = model.invoke([HumanMessage(content=prompt)], **llm_timeout_kwargs())
     return response.content.strip()
 
-def generate_image_with_imagen(prompt: str) -> Optional[str]:
-    """Generate image using Google's Imagen API"""
+def fallback_visual_prompt(idea: Dict[str, str]) -> str:
+    """Template image prompt used when there is no budget left to write one"""
+    return (
+        f"Instagram post image for \"{idea['title']}\": {idea['description']}. "
+        "Clean composition, natural lighting, vibrant colors, square format."
+    )
+
+def render_placeholder_image(prompt: str) -> bytes:
+    """Render the gradient placeholder used when the image provider is unavailable"""
+    # Create a more attractive placeholder image
+    img = Image.new('RGB', (512, 512), color='#667eea')
+    draw = ImageDraw.Draw(img)
+    
+    # Add a gradient-like effect
+    for y in range(512):
+        color_val = int(102 + (126 * y / 512))  # Gradient from #667eea to #764ba2
+        draw.rectangle([0, y, 512, y+1], fill=(102, color_val, 234))
+    
+    # Add text with better formatting
     try:
-        print(f"Generating image with prompt: {prompt}")
-        
-        # Try to generate image using the correct Imagen API syntax
-        try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-preview-image-generation",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                  response_modalities=['TEXT', 'IMAGE']
-                )
-            )
+        font = ImageFont.load_default()
+    except Exception:
+        font = None
+    
+    # Split text into lines
+    lines = [
+        "🎨 AI Generated Image",
+        "",
+        "Prompt:",
+        prompt[:40] + "..." if len(prompt) > 40 else prompt,
+        "",
+        "📸 Placeholder Image",
+        "Real image generation in progress..."
+    ]
+    
+    y_offset = 150
+    for line in lines:
+        if font:
+            draw.text((30, y_offset), line, fill='white', font=font)
+        else:
+            draw.text((30, y_offset), line, fill='white')
+        y_offset += 25
+    
+    # Convert to bytes
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
 
-            for part in response.candidates[0].content.parts:
-              if part.text is not None:
-                print(part.text)
-              elif part.inline_data is not None:
-                import io
-                buffer = io.BytesIO()
-                generated_image = Image.open(BytesIO((part.inline_data.data)))
-                generated_image.save(buffer, format='PNG')
-                image_data = buffer.getvalue()
-                generated_image.save("generated_image.png")
-                print(f"✅ Imagen API generated image successfully: {len(image_data)} bytes")
-                return image_data
-                
-        except Exception as img_error:
-            print(f"Imagen API error: {str(img_error)}")
-            print("Falling back to placeholder image...")
-        
-        # Fallback: Generate a placeholder image for testing
-        
-        # Create a more attractive placeholder image
-        img = Image.new('RGB', (512, 512), color='#667eea')
-        draw = ImageDraw.Draw(img)
-        
-        # Add a gradient-like effect
-        for y in range(512):
-            color_val = int(102 + (126 * y / 512))  # Gradient from #667eea to #764ba2
-            draw.rectangle([0, y, 512, y+1], fill=(102, color_val, 234))
-        
-        # Add text with better formatting
+def render_in_worker(prompt: str, key: str, refresh: bool) -> Optional[bytes]:
+    """
+    Hand the render to the image workers and wait for it, within the request
+    deadline. None when the workers gave no image or it did not arrive in time.
+    """
+    job_id = image_job_queue.enqueue(key, prompt, refresh)
+    job = image_job_queue.wait(job_id, timeout=call_timeout(), should_stop=is_cancelled)
+    # A request cancelled while waiting stops here; the job still completes
+    # and its image is kept in the cache
+    check_cancelled("generate_image")
+    if job is None or job["result"] is None:
+        print(f"Image job {job_id} gave no image: {job['error'] if job else 'timed out'}")
+        return None
+    image_cache.set(key, job["result"])
+    return job["result"]
+
+def generate_image_with_imagen(prompt: str, refresh: bool = False) -> Optional[bytes]:
+    """Generate image using Google's Imagen API (refresh=True skips the cached render)"""
+    key = visual_prompt_id(prompt)
+    cached = None if refresh else cached_image(key)
+    if cached is not None:
+        note_cache_hit()
+        return cached
+    # Not started for a cancelled request; a render already in flight when
+    # the client left still completes below and is kept in the cache
+    check_cancelled("generate_image")
+    with observe_call("generate_image", IMAGE_MODEL, model_call=False) as obs:
         try:
-            font = ImageFont.load_default()
-        except Exception:
-            font = None
-        
-        # Split text into lines
-        lines = [
-            "🎨 AI Generated Image",
-            "",
-            "Prompt:",
-            prompt[:40] + "..." if len(prompt) > 40 else prompt,
-            "",
-            "📸 Placeholder Image",
-            "Real image generation in progress..."
-        ]
-        
-        y_offset = 150
-        for line in lines:
-            if font:
-                draw.text((30, y_offset), line, fill='white', font=font)
+            print(f"Generating image with prompt: {prompt}")
+            
+            if IMAGE_RENDERING == RENDER_QUEUE:
+                image_data = render_in_worker(prompt, key, refresh)
             else:
-                draw.text((30, y_offset), line, fill='white')
-            y_offset += 25
-        
-        # Convert to bytes
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_data = buffer.getvalue()
-        
-        print(f"📸 Fallback placeholder generated: {len(img_data)} bytes")
-        return img_data
-        
-    except Exception as e:
-        print(f"Error in image generation: {str(e)}")
-        return None
+                image_data = render_with_provider(prompt, key)
+            if image_data:
+                return image_data
+            
+            # Fallback: Generate a placeholder image for testing
+            obs.fallback()
+            img_data = render_placeholder_image(prompt)
+            
+            print(f"📸 Fallback placeholder generated: {len(img_data)} bytes")
+            record_image_bytes("placeholder", len(img_data))
+            return img_data
+            
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            obs.error()
+            print(f"Error in image generation: {str(e)}")
+            return None
+
+# Checkpointed visual prompts record where their image came from, not its bytes
+IMAGE_SOURCE_PROVIDER = "provider"
+IMAGE_SOURCE_PLACEHOLDER = "placeholder"
+
+# Images rendered for the request being served, by prompt id, until its response takes them
+current_images: ContextVar[Optional[Dict[str, bytes]]] = ContextVar("current_images", default=None)
+
+def visual_entry(prompt: str, prompt_id: str, image_data: Optional[bytes]) -> Dict[str, Any]:
+    """
+    Visual prompt as kept in the workflow state and its checkpoints. The image
+    bytes stay in memory with the request (current_images); the state only
+    records their source so they can be rebuilt later.
+    """
+    image_source = None
+    if image_data:
+        images = current_images.get()
+        if images is not None:
+            images[prompt_id] = image_data
+        image_source = IMAGE_SOURCE_PROVIDER if image_cache.get(prompt_id) is not None else IMAGE_SOURCE_PLACEHOLDER
+    return {"description": prompt, "prompt_id": prompt_id, "image_source": image_source}
+
+def with_images(visual_prompts: List[Any]) -> List[Any]:
+    """
+    Visual prompts with their image bytes, for a response: the ones this
+    request rendered, else provider renders from the image caches (rendered
+    again when evicted) and placeholders drawn again. Bytes handed over are
+    dropped from current_images, so the response is their only holder.
+    """
+    images = current_images.get() or {}
+    complete = []
+    for visual in visual_prompts:
+        if not isinstance(visual, dict):
+            complete.append(visual)
+            continue
+        # Sessions checkpointed before image sources were recorded still hold the bytes
+        image_data = images.pop(visual.get("prompt_id"), None) or visual.get("image_data")
+        if image_data is None and visual.get("image_source") == IMAGE_SOURCE_PROVIDER:
+            image_data = generate_image_with_imagen(visual["description"])
+        elif image_data is None and visual.get("image_source") == IMAGE_SOURCE_PLACEHOLDER:
+            image_data = render_placeholder_image(visual["description"])
+        complete.append({**visual, "image_data": image_data})
+    return complete
 
 # LangGraph Workflow Definition
-def create_content_workflow():
+def create_content_workflow(streamed: bool = STREAM_IDEAS, checkpointer=None):
     """Create LangGraph workflow for content generation"""
     
     def process_context_node(state: ContentGenerationState) -> ContentGenerationState:
@@ -421,20 +1029,77 @@ def create_content_workflow():
         except Exception as e:
             return {**state, "error": f"Error processing context: {str(e)}"}
     
+    def degrade(state: ContentGenerationState, part: str) -> ContentGenerationState:
+        """State with part listed as degraded (counted once per request)"""
+        degraded = state.get("degraded") or []
+        if part in degraded:
+            return state
+        record_degradation(part)
+        return {**state, "degraded": degraded + [part]}
+    
     def generate_ideas_node(state: ContentGenerationState) -> ContentGenerationState:
         """Node to generate content ideas"""
         try:
-            ideas = generate_ideas(state["context"])
+            n_ideas = state.get("n_ideas") or DEFAULT_IDEAS
+            exclude_titles = state.get("exclude_titles") or []
+            ideas_context = knowledge_context(state["context"], state.get("brand"))
+            ideas, degraded = run_within_budget(
+                lambda: generate_ideas(ideas_context, n_ideas, exclude_titles),
+                lambda: fallback_ideas(state["context"], n_ideas, exclude_titles),
+                MIN_TEXT_CALL_SECONDS
+            )
+            if degraded:
+                state = degrade(state, DEGRADED_IDEAS)
+            else:
+                ideas = replace_duplicate_ideas(ideas, ideas_context, state.get("brand"), exclude_titles)
             return {**state, "ideas": ideas}
         except Exception as e:
             return {**state, "error": f"Error generating ideas: {str(e)}"}
     
+    def post_for_idea(idea: Dict[str, str], context: str) -> Tuple[Dict[str, Any], List[str]]:
+        """Copy for one idea and the parts degraded to produce it"""
+        copy, degraded = run_within_budget(
+            lambda: generate_copy(idea, context),
+            lambda: fallback_copy(idea, context),
+            MIN_TEXT_CALL_SECONDS
+        )
+        return copy, [DEGRADED_POSTS] if degraded else []
+    
+    def visual_for_idea(idea: Dict[str, str], context: str, draft: bool) -> Tuple[Dict[str, Any], List[str]]:
+        """Visual prompt (and image unless draft) for one idea and the parts degraded"""
+        parts = []
+        prompt, degraded = run_within_budget(
+            lambda: generate_visual_prompt(idea, context),
+            lambda: fallback_visual_prompt(idea),
+            MIN_TEXT_CALL_SECONDS
+        )
+        if degraded:
+            parts.append(DEGRADED_VISUAL_PROMPTS)
+        prompt_id = visual_prompt_id(prompt)
+        prompt_store.set(prompt_id, prompt)
+        
+        if draft:
+            # Rendered later, only for the prompts the user looks at
+            image_data = None
+        elif has_budget(MIN_IMAGE_CALL_SECONDS):
+            # Generate actual image
+            image_data = generate_image_with_imagen(prompt)
+        else:
+            # Visual prompt only; image rendering is skipped
+            image_data = None
+            parts.append(DEGRADED_IMAGES)
+        
+        return visual_entry(prompt, prompt_id, image_data), parts
+    
     def generate_posts_node(state: ContentGenerationState) -> ContentGenerationState:
         """Node to generate post copies"""
         try:
             posts = []
             for idea in state["ideas"]:
-                copy = generate_copy(idea, state["context"])
+                copy, parts = post_for_idea(idea, state["context"])
+                record_first_post("sequential")
+                for part in parts:
+                    state = degrade(state, part)
                 posts.append(copy)
             return {**state, "posts": posts}
         except Exception as e:
@@ -445,39 +1110,210 @@ def create_content_workflow():
         try:
             visual_prompts = []
             for idea in state["ideas"]:
-                prompt = generate_visual_prompt(idea, state["context"])
-                # Generate actual image
-                image_data = generate_image_with_imagen(prompt)
-                
-                visual_data = {
-                    "description": prompt,
-                    "image_data": image_data
-                }
+                visual_data, parts = visual_for_idea(idea, state["context"], state.get("draft"))
+                for part in parts:
+                    state = degrade(state, part)
                 visual_prompts.append(visual_data)
             return {**state, "visual_prompts": visual_prompts}
         except Exception as e:
             return {**state, "error": f"Error generating visual prompts: {str(e)}"}
     
+    def content_for_idea(idea: Dict[str, str], context: str, draft: bool):
+        """Post and visual for one idea, run on a worker as soon as the idea streams in"""
+        copy, post_parts = post_for_idea(idea, context)
+        record_first_post("streamed")
+        visual_data, visual_parts = visual_for_idea(idea, context, draft)
+        return copy, visual_data, post_parts + visual_parts
+    
+    def generate_streamed_node(state: ContentGenerationState) -> ContentGenerationState:
+        """Node to stream ideas and generate each idea's post and visuals speculatively"""
+        try:
+            context = state["context"]
+            draft = state.get("draft")
+            n_ideas = state.get("n_ideas") or DEFAULT_IDEAS
+            exclude_titles = state.get("exclude_titles") or []
+            speculative = {}
+            cancel_events = []
+            executor = ThreadPoolExecutor(max_workers=n_ideas, thread_name_prefix="cm-idea")
+            
+            def start(idea: Dict[str, str]):
+                # Each task gets its own copy of the request context (timings,
+                # deadline) and its own cancel event, which also follows the request's
+                cancel_event = SubtaskCancelEvent(current_cancel_event.get())
+                cancel_events.append(cancel_event)
+                future = executor.submit(
+                    copy_context().run, run_cancellable, cancel_event, content_for_idea, idea, context, draft
+                )
+                return future, cancel_event
+            
+            def on_idea(index: int, idea: Dict[str, str]):
+                # Repeats wait for the re-ask instead of starting work
+                if not idea_deduplicator.find_duplicates(account, [idea]):
+                    speculative[index] = (idea, start(idea))
+            
+            try:
+                account = state.get("brand") or DEFAULT_BRAND
+                ideas_context = knowledge_context(context, state.get("brand"))
+                ideas, degraded = run_within_budget(
+                    lambda: stream_ideas(ideas_context, on_idea, n_ideas, exclude_titles),
+                    lambda: fallback_ideas(context, n_ideas, exclude_titles),
+                    MIN_TEXT_CALL_SECONDS
+                )
+                if degraded:
+                    state = degrade(state, DEGRADED_IDEAS)
+                else:
+                    ideas = replace_duplicate_ideas(ideas, ideas_context, state.get("brand"), exclude_titles)
+                
+                # Reconcile: keep speculative work only where the final list
+                # has the same idea; cancel the rest (it stops before its next
+                # provider call) and start what is missing
+                futures = []
+                for index, idea in enumerate(ideas):
+                    started = speculative.pop(index, None)
+                    if started is not None and started[0] == idea:
+                        futures.append(started[1][0])
+                        continue
+                    if started is not None:
+                        started[1][1].set()
+                    futures.append(start(idea)[0])
+                for _, (_, cancel_event) in speculative.values():
+                    cancel_event.set()
+                
+                posts, visual_prompts = [], []
+                for future in futures:
+                    copy, visual_data, parts = future.result()
+                    for part in parts:
+                        state = degrade(state, part)
+                    posts.append(copy)
+                    visual_prompts.append(visual_data)
+            finally:
+                # Discarded tasks are not waited for; on errors nothing more is started
+                for cancel_event in cancel_events:
+                    cancel_event.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+            return {**state, "ideas": ideas, "posts": posts, "visual_prompts": visual_prompts}
+        except Exception as e:
+            return {**state, "error": f"Error generating content: {str(e)}"}
+    
+    def timed(name: str, model: str, node):
+        """
+        Record node latency; a node that sets a new error counts as outcome=error.
+        Provider calls inside the node are bounded by the state's deadline.
+        """
+        def timed_node(state: ContentGenerationState) -> ContentGenerationState:
+            # A cancelled request stops at the next node boundary
+            check_cancelled(name)
+            with observe_node(name, model) as obs, deadline_scope(state.get("deadline")):
+                result = node(state)
+                if result.get("error") and not state.get("error"):
+                    obs.error()
+                return result
+        return timed_node
+    
     # Create workflow graph
     workflow = StateGraph(ContentGenerationState)
     
     # Add nodes
-    workflow.add_node("process_context", process_context_node)
-    workflow.add_node("generate_ideas", generate_ideas_node)
-    workflow.add_node("generate_posts", generate_posts_node)
-    workflow.add_node("generate_visuals", generate_visuals_node)
+    workflow.add_node("process_context", timed("process_context", "none", process_context_node))
+    workflow.set_entry_point("process_context")
+    
+    if streamed:
+        # Ideas, posts and visuals overlap inside a single node
+        workflow.add_node("generate_streamed", timed("generate_streamed", TEXT_MODEL, generate_streamed_node))
+        workflow.add_edge("process_context", "generate_streamed")
+        workflow.add_edge("generate_streamed", END)
+        return workflow.compile(checkpointer=checkpointer)
+    
+    workflow.add_node("generate_ideas", timed("generate_ideas", TEXT_MODEL, generate_ideas_node))
+    workflow.add_node("generate_posts", timed("generate_posts", TEXT_MODEL, generate_posts_node))
+    workflow.add_node("generate_visuals", timed("generate_visuals", IMAGE_MODEL, generate_visuals_node))
     
     # Define edges
-    workflow.set_entry_point("process_context")
     workflow.add_edge("process_context", "generate_ideas")
     workflow.add_edge("generate_ideas", "generate_posts")
     workflow.add_edge("generate_posts", "generate_visuals")
     workflow.add_edge("generate_visuals", END)
     
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
+
+# Initialize workflow; every run is checkpointed under its session id
+content_workflow = create_content_workflow(checkpointer=session_store.checkpointer)
+
+# Sequential stages in order, with the state field each one completes
+WORKFLOW_STAGES = (
+    ("process_context", "context"),
+    ("generate_ideas", "ideas"),
+    ("generate_posts", "posts"),
+    ("generate_visuals", "visual_prompts"),
+)
 
-# Initialize workflow
-content_workflow = create_content_workflow()
+# Node whose completion marks a finished run
+WORKFLOW_FINAL_NODE = "generate_visuals" if "generate_visuals" in content_workflow.nodes else "generate_streamed"
+
+def resume_point(state: Dict[str, Any]) -> str:
+    """Last stage of a failed run whose output is complete; the run resumes after it"""
+    if "generate_ideas" not in content_workflow.nodes:
+        # Streamed graph: ideas, posts and visuals are a single node
+        return "process_context"
+    resume_after = "process_context"
+    for node, field in WORKFLOW_STAGES[1:]:
+        produced = state.get(field) or []
+        if not produced or (field != "ideas" and len(produced) != len(state.get("ideas") or [])):
+            break
+        resume_after = node
+    return resume_after
+
+# Streaming response writer for low-memory mode
+BASE64_CHUNK_BYTES = 3 * 16 * 1024  # multiple of 3 so chunks encode without padding
+
+def stream_content_response(final_state: Dict[str, Any], context: str, timings: RequestTimings, memory_tracker: MemoryTracker):
+    """
+    Write a ContentResponse-shaped JSON body piece by piece.
+    Each image is base64-encoded in small chunks straight from its PNG bytes
+    and the bytes are released as soon as they are written, so the full
+    base64 strings and the serialized body never exist in memory at once.
+    """
+    try:
+        yield b"".join((
+            b'{"ideas":', orjson.dumps(final_state["ideas"]),
+            b',"posts":', orjson.dumps(final_state["posts"]),
+            b',"visual_prompts":['
+        ))
+        
+        visual_prompts = final_state["visual_prompts"]
+        for index in range(len(visual_prompts)):
+            visual_data = visual_prompts[index]
+            visual_prompts[index] = None  # drop the state's reference to the image bytes
+            if not isinstance(visual_data, dict):
+                visual_data = {"description": visual_data}
+            yield b"".join((
+                b"," if index else b"",
+                b'{"description":', orjson.dumps(visual_data.get("description", "")),
+                b',"prompt_id":', orjson.dumps(visual_data.get("prompt_id")),
+                b',"image_url":'
+            ))
+            image_data = visual_data.pop("image_data", None)
+            if image_data:
+                view = memoryview(image_data)
+                yield b'"data:image/png;base64,'
+                for offset in range(0, len(view), BASE64_CHUNK_BYTES):
+                    yield base64.b64encode(view[offset:offset + BASE64_CHUNK_BYTES])
+                yield b'"}'
+                view.release()
+            else:
+                yield b'null}'
+            del image_data, visual_data
+        
+        yield b"".join((
+            b'],"context_summary":', orjson.dumps(context),
+            b',"context_id":', orjson.dumps(final_state.get("context_id")),
+            b',"session_id":', orjson.dumps(final_state.get("session_id")),
+            b',"history_id":', orjson.dumps(final_state.get("history_id")),
+            b',"degraded":', orjson.dumps(final_state.get("degraded") or []),
+            b',"timings":', orjson.dumps(timings.as_dict()), b"}"
+        ))
+    finally:
+        memory_tracker.stop()
 
 # API Endpoints
 @app.get("/")
@@ -485,75 +1321,914 @@ async def root():
     """Health check endpoint"""
     return {"message": "CM Assistant MVP API is running"}
 
+@app.get("/api/health")
+async def health():
+    """Detailed health including provider circuit breakers and API key pools"""
+    breakers = {image_breaker.name: image_breaker.snapshot()}
+    if shared_cache.breaker is not None:
+        breakers[shared_cache.breaker.name] = shared_cache.breaker.snapshot()
+    key_pools = {pool.role: pool.snapshot() for pool in (text_key_pool, image_key_pool)}
+    degraded = (
+        any(breaker["state"] != "closed" for breaker in breakers.values())
+        or any(not pool["available"] for pool in key_pools.values())
+    )
+    return {"status": "degraded" if degraded else "ok", "circuit_breakers": breakers, "key_pools": key_pools}
+
+@app.get("/api/cache")
+def cache_stats():
+    """Shared cache backend and per-namespace TTL, hits, misses, sets, errors and size"""
+    return shared_cache.stats()
+
+@app.get("/api/scheduler")
+def scheduler_stats():
+    """
+    Provider slots in use, queued calls and per-tenant queue wait of the text
+    and image pools, plus the image worker jobs by status when they are used
+    """
+    stats = {scheduler.name: scheduler.snapshot() for scheduler in (text_scheduler, image_scheduler)}
+    if image_job_queue is not None:
+        stats["image_jobs"] = image_job_queue.stats()
+    return stats
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics in text exposition format"""
+    return Response(content=render_latest(), media_type=METRICS_CONTENT_TYPE)
+
+def enforce_rate_limit(request: Request, endpoint: str, cost: int = 1) -> None:
+    """
+    429 with Retry-After once the client's bucket is empty. The client is also
+    the tenant its provider calls are queued under by the fair scheduler.
+    """
+    client_key = request.client.host if request.client else "unknown"
+    current_tenant.set(client_key)
+    retry_after = rate_limiter.acquire(client_key, cost)
+    if retry_after:
+        RATE_LIMITED.labels(endpoint).inc()
+        raise HTTPException(
+            status_code=429,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def history_input_text(
+    input_type: str,
+    content: Optional[str],
+    answers: Optional[Dict[str, str]],
+    image_data: Optional[bytes]
+) -> str:
+    """Text that identifies an input in the generation history"""
+    if input_type == "image":
+        return "image " + hashlib.sha256(image_data or b"").hexdigest()
+    if input_type == "guided":
+        return json.dumps(answers or {}, sort_keys=True, ensure_ascii=False)
+    return content or ""
+
+def record_history(input_type: str, input_text: str, final_state: Dict[str, Any]) -> Optional[int]:
+    """Save a finished generation; history is best effort and never fails the request"""
+    try:
+        return history_store.record(input_type, input_text, final_state)
+    except sqlite3.Error as e:
+        print(f"Could not record generation history: {str(e)}")
+        return None
+
+def history_response(entry: Dict[str, Any], timings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    ContentResponse payload for a stored generation. Its prompts and context
+    are registered again, so images render with GET /api/images/{prompt_id}
+    and POST /api/more-ideas continues from it.
+    """
+    for visual in entry["visual_prompts"]:
+        if visual.get("prompt_id"):
+            prompt_store.set(visual["prompt_id"], visual["description"])
+    if entry.get("context_id"):
+        context_store.set(entry["context_id"], {
+            "context": entry["context_summary"],
+            "titles": [idea["title"] for idea in entry["ideas"]],
+            "brand": entry.get("brand")
+        })
+    session_id = entry.get("session_id")
+    state = {
+        **entry,
+        "session_id": session_id if session_id and session_store.exists(session_id) else None,
+        "history_id": entry["id"],
+    }
+    return content_response_payload(state, entry["context_summary"], timings)
+
+def cached_generation(state: Dict[str, Any], fresh_images: bool) -> Optional[Tuple[Dict[str, Any], float]]:
+    """
+    Final state built from a semantic cache entry for a near-identical
+    context and its similarity, or None on a miss. The cached ideas, posts and visual prompts are
+    reused; images come from the image cache (rendered again when evicted, or
+    always with fresh_images) unless the request is a draft.
+    """
+    n_ideas = state["n_ideas"]
+    cached, similarity = semantic_cache.lookup(
+        state.get("brand") or DEFAULT_BRAND, state["context"],
+        accept=lambda value: len(value["ideas"]) >= n_ideas
+    )
+    outcome = "hit" if cached is not None else "miss"
+    SEMANTIC_CACHE_LOOKUPS.labels(outcome).inc()
+    if similarity is not None:
+        SEMANTIC_CACHE_SIMILARITY.labels(outcome).observe(similarity)
+    if cached is None:
+        return None
+    
+    degraded = []
+    visual_prompts = []
+    for visual in cached["visual_prompts"][:n_ideas]:
+        prompt_store.set(visual["prompt_id"], visual["description"])
+        if state.get("draft"):
+            image_data = None
+        elif has_budget(MIN_IMAGE_CALL_SECONDS):
+            image_data = generate_image_with_imagen(visual["description"], refresh=fresh_images)
+        else:
+            image_data = None
+            if DEGRADED_IMAGES not in degraded:
+                record_degradation(DEGRADED_IMAGES)
+                degraded.append(DEGRADED_IMAGES)
+        visual_prompts.append(visual_entry(visual["description"], visual["prompt_id"], image_data))
+    return {
+        **state,
+        "ideas": cached["ideas"][:n_ideas],
+        "posts": cached["posts"][:n_ideas],
+        "visual_prompts": visual_prompts,
+        "degraded": degraded,
+    }, similarity
+
+def cache_generation(final_state: Dict[str, Any]) -> None:
+    """Keep a complete, undegraded generation for near-identical contexts"""
+    if final_state.get("error") or final_state.get("degraded"):
+        return
+    semantic_cache.store(final_state.get("brand") or DEFAULT_BRAND, final_state["context"], {
+        "ideas": final_state["ideas"],
+        "posts": final_state["posts"],
+        "visual_prompts": [
+            {"description": visual["description"],
+             "prompt_id": visual.get("prompt_id") or visual_prompt_id(visual["description"])}
+            for visual in final_state["visual_prompts"]
+        ],
+    })
+
+def idea_count(n_ideas: int) -> int:
+    """Requested number of ideas within [1, MAX_IDEAS]"""
+    return max(1, min(n_ideas, MAX_IDEAS))
+
+async def run_generation(
+    request: Request,
+    endpoint: str,
+    build_context: Callable[[], str],
+    *,
+    n_ideas: int,
+    draft: bool,
+    low_memory: bool,
+    deadline_seconds: Optional[float],
+    context_id: Optional[str] = None,
+    exclude_titles: Optional[List[str]] = None,
+    history_input: Optional[Tuple[str, str]] = None,
+    brand: Optional[str] = None,
+    fresh_images: bool = False,
+    semantic_reuse: bool = True,
+    shed_images: bool = False
+):
+    """
+    Shared body of the generation endpoints: per-request timings, deadline,
+    profiling and memory tracking, the pipeline run off the event loop with
+    disconnect detection, and the JSON (or streamed) response.
+    build_context runs on the worker thread and returns the analyzed context;
+    successful runs are saved to the history under history_input
+    ((input type, input text)). With semantic_reuse, new generations (not
+    continuations) that name a brand are answered from the semantic cache
+    when a near-identical context was generated before for that brand;
+    requests without a brand never share generations. shed_images runs it as a
+    draft with the images listed as degraded (admission control under load).
+    """
+    timings = RequestTimings()
+    current_timings.set(timings)
+    deadline = request_deadline(deadline_seconds)
+    current_deadline.set(deadline)
+    request_id = uuid.uuid4().hex
+    session_id = uuid.uuid4().hex
+    profiled = should_profile(request.headers, request.query_params)
+    response_headers = {"X-Profile-Id": request_id} if profiled else {}
+    response_headers["X-Session-Id"] = session_id
+    memory_tracker = MemoryTracker(request_id, current_input_type.get(), "low_memory" if low_memory else "standard")
+    memory_tracker.start()
+    streaming = False
+    with REQUESTS_IN_FLIGHT.labels(endpoint).track_inprogress(), \
+            profile_request(request_id, profiled):
+        try:
+            def run_pipeline():
+                current_images.set({})
+                context = build_context()
+            
+                # Initialize workflow state
+                initial_state: ContentGenerationState = {
+                    "context": context,
+                    "ideas": [],
+                    "posts": [],
+                    "visual_prompts": [],
+                    "error": None,
+                    "deadline": deadline,
+                    "degraded": [DEGRADED_IMAGES] if shed_images else [],
+                    "draft": draft or shed_images,
+                    "n_ideas": idea_count(n_ideas),
+                    "exclude_titles": list(exclude_titles or []),
+                    "context_id": context_id or uuid.uuid4().hex,
+                    "session_id": session_id,
+                    "brand": brand
+                }
+            
+                # Continuations must produce new ideas, so they skip the cache
+                reusable = semantic_reuse and brand is not None and not exclude_titles
+                cached = cached_generation(initial_state, fresh_images) if reusable else None
+                
+                # Run workflow; a failed run stays checkpointed so it can be resumed
+                session_store.register(session_id)
+                try:
+                    if cached is not None:
+                        # Checkpointed as a finished run, so the session endpoints work on it
+                        final_state, similarity = cached
+                        content_workflow.update_state(
+                            session_store.config(session_id), final_state, as_node=WORKFLOW_FINAL_NODE
+                        )
+                        final_state = {**final_state, "semantic_similarity": similarity}
+                    else:
+                        final_state = content_workflow.invoke(initial_state, session_store.config(session_id))
+                        if reusable:
+                            cache_generation(final_state)
+                finally:
+                    session_store.save(session_id)
+                if final_state.get("error"):
+                    return final_state, context
+                if history_input:
+                    final_state = {**final_state, "history_id": record_history(*history_input, final_state)}
+                return {**final_state, "visual_prompts": with_images(final_state["visual_prompts"])}, context
+            
+            # Off the event loop, so a client that goes away cancels the
+            # remaining provider calls instead of waiting for all of them
+            final_state, context = await run_until_disconnected(request, endpoint, run_pipeline)
+        
+            if final_state.get("error"):
+                raise HTTPException(status_code=500, detail=final_state["error"])
+            
+            if final_state.get("history_id"):
+                response_headers["X-History-Id"] = str(final_state["history_id"])
+            if final_state.get("semantic_similarity") is not None:
+                response_headers["X-Semantic-Cache-Similarity"] = f"{final_state['semantic_similarity']:.3f}"
+            if final_state.get("context_id"):
+                context_store.set(final_state["context_id"], {
+                    "context": context,
+                    "titles": list(exclude_titles or []) + [idea["title"] for idea in final_state["ideas"]],
+                    "brand": brand
+                })
+        
+            response_headers["Server-Timing"] = timings.server_timing_header()
+            if low_memory:
+                # The body is written by the generator, which also closes the
+                # memory measurement once the last image has been sent
+                streaming = True
+                return StreamingResponse(
+                    stream_content_response(final_state, context, timings, memory_tracker),
+                    media_type="application/json",
+                    headers=response_headers
+                )
+        
+            # Ideas and posts were validated by the stages that produced them,
+            # so the response is encoded directly instead of going through
+            # ContentResponse and response_model validation a second time
+            return FastJSONResponse(
+                content_response_payload(final_state, context, timings.as_dict()),
+                headers=response_headers
+            )
+        
+        except ClientDisconnected:
+            # Nobody is listening; 499 is the conventional "client closed request"
+            return Response(status_code=499)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error generating content: {str(e)}",
+                headers={"X-Session-Id": session_id}
+            )
+        finally:
+            if not streaming:
+                memory_tracker.stop()
+
 @app.post("/api/generate-content", response_model=ContentResponse)
 async def generate_content(
+    request: Request,
     input_type: str = Form(...),
     content: Optional[str] = Form(None),
     guided_answers: Optional[str] = Form(None),
-    image: Optional[UploadFile] = File(None)
+    image: Optional[UploadFile] = File(None),
+    low_memory: bool = Form(LOW_MEMORY_RESPONSES),
+    deadline_seconds: Optional[float] = Form(None),
+    draft: bool = Form(False),
+    n_ideas: int = Form(DEFAULT_IDEAS),
+    reuse_history: bool = Form(False),
+    brand: Optional[str] = Form(None),
+    fresh_images: bool = Form(False),
+    profile_id: Optional[str] = Form(None)
 ):
     """
-    Main endpoint to generate Instagram content based on different input types
+    Main endpoint to generate Instagram content based on different input types.
+    With reuse_history, an exact or near-exact earlier generation for the same
+    input is returned from the history instead of calling the models. When the
+    semantic cache answers instead, fresh_images renders new images for the
+    reused prompts.
+    input_type "profile" with a profile_id uses a stored brand profile as the
+    context: no page fetch or context analysis, the pipeline starts with the
+    ideas. Those requests always ask for new content, so they skip the
+    semantic cache, and so do guided ones: their contexts are a fixed
+    template that differs only in the answers, too little for the similarity
+    to tell niches apart.
+    While the provider queues are long, new requests run without images or,
+    past the rejection threshold, get a 503 with Retry-After.
     """
+    profile = None
+    if input_type == PROFILE_INPUT:
+        profile = brand_profile_store.get(profile_id) if profile_id else None
+        if profile is None:
+            raise HTTPException(status_code=404, detail="Unknown brand profile")
+        if brand_profile_store.is_stale(profile):
+            refresh_profile_in_background(profile)
+    current_input_type.set(input_type if input_type in INPUT_TYPES + (PROFILE_INPUT,) else "invalid")
+    image_data = await image.read() if input_type == "image" and image else None
     try:
-        # Process context based on input type
-        if input_type == "text" and content:
-            context = process_text_context(content)
-        elif input_type == "url" and content:
-            context = process_url_context(content)
-        elif input_type == "image" and image:
-            image_data = await image.read()
-            context = process_image_context(image_data)
-        elif input_type == "guided" and guided_answers:
-            answers = json.loads(guided_answers)
-            context = process_guided_context(answers)
+        parsed_answers = json.loads(guided_answers) if input_type == "guided" and guided_answers else None
+    except ValueError:
+        parsed_answers = None  # reported by build_context
+    if profile is not None:
+        history_text = f"profile {profile['id']}"
+    else:
+        history_text = history_input_text(input_type, content, parsed_answers, image_data)
+    
+    brand = brand or (profile["brand"] if profile is not None else None)
+    if reuse_history and (input_type in INPUT_TYPES or profile is not None):
+        # Only this brand's generations of the same size and mode are reused
+        matches = history_store.find_matches(
+            input_type, history_text, limit=1, brand=brand, n_ideas=idea_count(n_ideas), draft=draft
+        )
+        entry = history_store.get(matches[0]["id"]) if matches else None
+        if entry is not None:
+            return FastJSONResponse(history_response(entry), headers={"X-History-Id": str(entry["id"])})
+    
+    enforce_rate_limit(request, "/api/generate-content")
+    admission = admission_controller.decide(with_images=not draft)
+    if admission.action == REJECT:
+        raise HTTPException(
+            status_code=503,
+            detail="Server overloaded, retry later",
+            headers={"Retry-After": str(admission.retry_after)}
+        )
+    if admission.action == DOWNGRADE:
+        record_degradation(DEGRADED_IMAGES)
+    
+    def build_context() -> str:
+        if profile is not None:
+            return profile_context(profile)
+        answers = json.loads(guided_answers) if input_type == "guided" and guided_answers else None
+        return process_input_context(input_type, content, answers, image_data)
+    
+    return await run_generation(
+        request, "/api/generate-content", build_context,
+        n_ideas=n_ideas, draft=draft, low_memory=low_memory, deadline_seconds=deadline_seconds,
+        history_input=(input_type, history_text),
+        brand=brand,
+        fresh_images=fresh_images, semantic_reuse=profile is None and input_type != "guided",
+        shed_images=admission.action == DOWNGRADE
+    )
+
+@app.post("/api/more-ideas", response_model=ContentResponse)
+async def more_ideas(
+    request: Request,
+    context_id: str = Form(...),
+    n_ideas: int = Form(DEFAULT_IDEAS),
+    low_memory: bool = Form(LOW_MEMORY_RESPONSES),
+    deadline_seconds: Optional[float] = Form(None),
+    draft: bool = Form(False)
+):
+    """
+    Continue a previous generation with new ideas. Reuses its analyzed context
+    instead of processing the input again, and asks for ideas different from
+    the ones already produced, under the same brand (deduplication and
+    knowledge retrieval).
+    """
+    stored = context_store.get(context_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired context id")
+    enforce_rate_limit(request, "/api/more-ideas")
+    current_input_type.set("more_ideas")
+    
+    return await run_generation(
+        request, "/api/more-ideas", lambda: stored["context"],
+        n_ideas=n_ideas, draft=draft, low_memory=low_memory, deadline_seconds=deadline_seconds,
+        context_id=context_id, exclude_titles=stored["titles"],
+        history_input=("more_ideas", stored["context"]),
+        brand=stored.get("brand")
+    )
+
+@app.get("/api/history/search")
+async def search_history(q: str, limit: int = 20):
+    """Earlier generations whose input, titles, hooks, bodies or hashtags contain every word of q"""
+    return {"results": history_store.search(q, max(1, min(limit, 100)))}
+
+@app.post("/api/history/match")
+async def match_history(body: ContentRequest):
+    """
+    Exact or near-exact earlier generations of body.brand for an input, to
+    offer before paying for a new one. Reuse one with GET /api/history/{history_id}.
+    """
+    if body.input_type not in INPUT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid input type")
+    image_data = None
+    if body.input_type == "image" and body.image_base64:
+        try:
+            image_data = base64.b64decode(body.image_base64, validate=True)
+        except binascii.Error:
+            raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+    text = history_input_text(body.input_type, body.content, body.guided_answers, image_data)
+    return {"matches": history_store.find_matches(body.input_type, text, brand=body.brand)}
+
+@app.get("/api/history/{history_id}", response_model=ContentResponse)
+async def get_history(history_id: int):
+    """A stored generation in the ContentResponse shape, with images renderable on demand"""
+    entry = history_store.get(history_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown history id")
+    return FastJSONResponse(history_response(entry), headers={"X-History-Id": str(history_id)})
+
+@app.post("/api/knowledge/documents")
+async def add_knowledge_document(request: Request, document: KnowledgeDocument):
+    """
+    Store a brand document, past post or webpage (given by url) in the
+    knowledge base. Its chunks enrich the ideas context of later requests
+    for the same brand.
+    """
+    if document.source not in SOURCES:
+        raise HTTPException(status_code=400, detail=f"source must be one of {', '.join(SOURCES)}")
+    if not document.text and not document.url:
+        raise HTTPException(status_code=400, detail="Provide text or url")
+    
+    def ingest():
+        if document.url:
+            try:
+                text = fetch_page_text(document.url, KNOWLEDGE_PAGE_MAX_CHARS)
+            except requests.RequestException as e:
+                raise HTTPException(status_code=502, detail=f"Could not fetch {document.url}: {str(e)}")
+            source, title = "page", document.title or document.url
         else:
-            raise HTTPException(status_code=400, detail="Invalid input type or missing content")
-        
-        # Initialize workflow state
-        initial_state: ContentGenerationState = {
-            "context": context,
-            "ideas": [],
-            "posts": [],
-            "visual_prompts": [],
-            "error": None
-        }
-        
-        # Run workflow
-        final_state = content_workflow.invoke(initial_state)
-        
-        if final_state.get("error"):
-            raise HTTPException(status_code=500, detail=final_state["error"])
-        
-        # Format response
-        visual_prompts_formatted = []
-        for visual_data in final_state["visual_prompts"]:
-            if isinstance(visual_data, dict):
-                # Convert image data to base64 URL if available
-                image_url = None
-                if visual_data.get("image_data"):
-                    import base64
-                    image_url = f"data:image/png;base64,{base64.b64encode(visual_data['image_data']).decode()}"
-                
-                visual_prompts_formatted.append(VisualPrompt(
-                    description=visual_data.get("description", ""),
-                    image_url=image_url
-                ))
-            else:
-                # Fallback for old format
-                visual_prompts_formatted.append(VisualPrompt(description=visual_data))
-        
-        response = ContentResponse(
-            ideas=[ContentIdea(**idea) for idea in final_state["ideas"]],
-            posts=[PostContent(**post) for post in final_state["posts"]],
-            visual_prompts=visual_prompts_formatted,
-            context_summary=context
+            text, source, title = document.text, document.source, document.title
+        return knowledge_base.add_document(" ".join(text.split()), document.brand, source, title)
+    
+    try:
+        return await run_until_disconnected(request, "/api/knowledge/documents", ingest)
+    except ClientDisconnected:
+        return Response(status_code=499)
+
+@app.delete("/api/knowledge/documents/{document_id}")
+async def delete_knowledge_document(document_id: int):
+    if not knowledge_base.delete_document(document_id):
+        raise HTTPException(status_code=404, detail="Unknown document id")
+    return {"deleted": document_id}
+
+@app.get("/api/knowledge/search")
+async def search_knowledge(q: str, k: int = KNOWLEDGE_TOP_K, brand: Optional[str] = None):
+    """Most similar stored chunks for q, optionally within one brand"""
+    return {"results": knowledge_base.search(q, max(1, min(k, 50)), brand)}
+
+@app.get("/api/knowledge")
+async def knowledge_stats():
+    return knowledge_base.stats()
+
+def profile_source(body: BrandProfileRequest) -> Any:
+    """The input a profile is analyzed from (and refreshed from later), or 400"""
+    if body.input_type not in PROFILE_INPUT_TYPES:
+        raise HTTPException(status_code=400, detail=f"input_type must be one of {', '.join(PROFILE_INPUT_TYPES)}")
+    source = body.guided_answers if body.input_type == "guided" else body.content
+    if not source:
+        raise HTTPException(status_code=400, detail="Invalid input type or missing content")
+    return source
+
+def analyze_profile_source(input_type: str, source: Any) -> Dict[str, Any]:
+    """analyze_brand for an endpoint: failures become 502 instead of a generic profile"""
+    try:
+        return analyze_brand(input_type, source)
+    except requests.RequestException as e:
+        raise HTTPException(status_code=502, detail=f"Could not fetch {source}: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+# Stale profiles being re-analyzed in the background, by profile id
+profile_refreshes: Dict[str, threading.Thread] = {}
+profile_refreshes_lock = threading.Lock()
+
+def refresh_profile_in_background(profile: Dict[str, Any]) -> None:
+    """Re-analyze a stale profile without delaying the request that uses it"""
+    def refresh():
+        current_priority.set(PRIORITY_BATCH)
+        try:
+            brand_profile_store.update_analysis(profile["id"], analyze_brand(profile["input_type"], profile["source"]))
+        except Exception as e:
+            # The current analysis stays in place; the next request retries
+            print(f"Could not refresh brand profile {profile['id']}: {str(e)}")
+        finally:
+            with profile_refreshes_lock:
+                profile_refreshes.pop(profile["id"], None)
+    
+    with profile_refreshes_lock:
+        if profile["id"] in profile_refreshes:
+            return
+        thread = threading.Thread(target=refresh, name="cm-profile-refresh", daemon=True)
+        profile_refreshes[profile["id"]] = thread
+    thread.start()
+
+@app.post("/api/brand-profiles")
+async def create_brand_profile(request: Request, body: BrandProfileRequest):
+    """
+    Analyze a brand once (its text, site or Instagram URL, or guided answers)
+    and store the result. Generation requests with input_type=profile and the
+    returned id reuse it instead of analyzing the input again.
+    """
+    source = profile_source(body)
+    enforce_rate_limit(request, "/api/brand-profiles")
+    
+    def create():
+        analysis = analyze_profile_source(body.input_type, source)
+        return brand_profile_store.create(body.brand, body.input_type, source, analysis, body.name)
+    
+    try:
+        return await run_until_disconnected(request, "/api/brand-profiles", create)
+    except ClientDisconnected:
+        return Response(status_code=499)
+
+@app.get("/api/brand-profiles")
+async def list_brand_profiles(brand: Optional[str] = None):
+    return {"profiles": brand_profile_store.list_profiles(brand)}
+
+@app.get("/api/brand-profiles/{profile_id}")
+async def get_brand_profile(profile_id: str):
+    profile = brand_profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Unknown brand profile")
+    return profile
+
+@app.post("/api/brand-profiles/{profile_id}/refresh")
+async def refresh_brand_profile(request: Request, profile_id: str):
+    """Analyze the profile's input again now (re-fetching its URL) and store the result"""
+    profile = brand_profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Unknown brand profile")
+    enforce_rate_limit(request, "/api/brand-profiles/refresh")
+    
+    def refresh():
+        analysis = analyze_profile_source(profile["input_type"], profile["source"])
+        updated = brand_profile_store.update_analysis(profile_id, analysis)
+        if updated is None:
+            raise HTTPException(status_code=404, detail="Unknown brand profile")
+        return updated
+    
+    try:
+        return await run_until_disconnected(request, "/api/brand-profiles/refresh", refresh)
+    except ClientDisconnected:
+        return Response(status_code=499)
+
+@app.delete("/api/brand-profiles/{profile_id}")
+async def delete_brand_profile(profile_id: str):
+    if not brand_profile_store.delete(profile_id):
+        raise HTTPException(status_code=404, detail="Unknown brand profile")
+    return {"deleted": profile_id}
+
+def load_session(session_id: str) -> Dict[str, Any]:
+    """Latest checkpointed state of a live session, or 404"""
+    if not session_store.exists(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    state = content_workflow.get_state(session_store.config(session_id)).values
+    if not state:
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return state
+
+def session_item(state: Dict[str, Any], field: str, index: int) -> Any:
+    items = state.get(field) or []
+    if not 0 <= index < len(items) or index >= len(state.get("ideas") or []):
+        raise HTTPException(status_code=404, detail=f"No {field} entry at index {index}")
+    return items[index]
+
+async def update_session(
+    request: Request,
+    endpoint: str,
+    session_id: str,
+    field: str,
+    index: int,
+    regenerate: Callable[[Dict[str, Any], Any], Any]
+):
+    """
+    Replace one entry of a session's posts or visual prompts. regenerate(state,
+    current) runs on a worker thread within a fresh deadline; only the new
+    entry is written back to the checkpoint and returned.
+    """
+    state = load_session(session_id)
+    current = session_item(state, field, index)
+    enforce_rate_limit(request, endpoint)
+    timings = RequestTimings()
+    current_timings.set(timings)
+    current_deadline.set(request_deadline())
+    
+    def run_update():
+        current_images.set({})
+        replacement = regenerate(state, current)
+        items = list(state[field])
+        items[index] = replacement
+        content_workflow.update_state(session_store.config(session_id), {field: items})
+        session_store.save(session_id)
+        return with_images([replacement])[0] if field == "visual_prompts" else replacement
+    
+    with REQUESTS_IN_FLIGHT.labels(endpoint).track_inprogress():
+        try:
+            replacement = await run_until_disconnected(request, endpoint, run_update)
+        except ClientDisconnected:
+            return Response(status_code=499)
+    
+    if field == "visual_prompts":
+        replacement = visual_prompts_payload([replacement])[0]
+    return FastJSONResponse(
+        {"session_id": session_id, "index": index, field: replacement, "timings": timings.as_dict()},
+        headers={"Server-Timing": timings.server_timing_header()}
+    )
+
+@app.get("/api/sessions/{session_id}", response_model=ContentResponse)
+async def get_session(request: Request, session_id: str):
+    """Current content of a session, including regenerated parts"""
+    state = load_session(session_id)
+    current_deadline.set(request_deadline())
+    try:
+        # Images come from the caches, or are rendered again when evicted
+        visual_prompts = await run_until_disconnected(
+            request, "/api/sessions", lambda: with_images(state["visual_prompts"])
         )
-        
-        return response
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating content: {str(e)}")
+    except ClientDisconnected:
+        return Response(status_code=499)
+    return FastJSONResponse(content_response_payload({**state, "visual_prompts": visual_prompts}, state["context"]))
+
+@app.post("/api/sessions/{session_id}/posts/{index}/regenerate")
+async def regenerate_post(request: Request, session_id: str, index: int):
+    """Write a new copy for one post, keeping everything else"""
+    def new_copy(state, current):
+        return generate_copy(state["ideas"][index], state["context"])
+    return await update_session(request, "/api/sessions/posts", session_id, "posts", index, new_copy)
+
+@app.post("/api/sessions/{session_id}/visual-prompts/{index}/regenerate")
+async def regenerate_visual_prompt(request: Request, session_id: str, index: int):
+    """Write a new visual prompt for one post and render its image (unless the session is a draft)"""
+    def new_visual(state, current):
+        prompt = generate_visual_prompt(state["ideas"][index], state["context"])
+        prompt_id = visual_prompt_id(prompt)
+        prompt_store.set(prompt_id, prompt)
+        image_data = None if state.get("draft") else generate_image_with_imagen(prompt)
+        return visual_entry(prompt, prompt_id, image_data)
+    return await update_session(request, "/api/sessions/visual-prompts", session_id, "visual_prompts", index, new_visual)
+
+@app.post("/api/sessions/{session_id}/images/{index}/regenerate")
+async def regenerate_image(request: Request, session_id: str, index: int):
+    """Render a fresh image for one post's existing visual prompt"""
+    def new_image(state, current):
+        image_data = generate_image_with_imagen(current["description"], refresh=True)
+        return {**current, **visual_entry(current["description"], current["prompt_id"], image_data)}
+    return await update_session(request, "/api/sessions/images", session_id, "visual_prompts", index, new_image)
+
+@app.post("/api/sessions/{session_id}/resume", response_model=ContentResponse)
+async def resume_session(request: Request, session_id: str, deadline_seconds: Optional[float] = Form(None)):
+    """Continue a failed run from its last completed stage"""
+    state = load_session(session_id)
+    if not state.get("error"):
+        raise HTTPException(status_code=409, detail="Session has no failed stage to resume")
+    enforce_rate_limit(request, "/api/sessions/resume")
+    current_input_type.set("resume")
+    timings = RequestTimings()
+    current_timings.set(timings)
+    deadline = request_deadline(deadline_seconds)
+    current_deadline.set(deadline)
+    config = session_store.config(session_id)
+    
+    def run_resume():
+        current_images.set({})
+        content_workflow.update_state(config, {"error": None, "deadline": deadline}, as_node=resume_point(state))
+        try:
+            final_state = content_workflow.invoke(None, config)
+        finally:
+            session_store.save(session_id)
+        if final_state.get("error"):
+            return final_state
+        return {**final_state, "visual_prompts": with_images(final_state["visual_prompts"])}
+    
+    with REQUESTS_IN_FLIGHT.labels("/api/sessions/resume").track_inprogress():
+        try:
+            final_state = await run_until_disconnected(request, "/api/sessions/resume", run_resume)
+        except ClientDisconnected:
+            return Response(status_code=499)
+    
+    headers = {"Server-Timing": timings.server_timing_header(), "X-Session-Id": session_id}
+    if final_state.get("error"):
+        raise HTTPException(status_code=500, detail=final_state["error"], headers=headers)
+    return FastJSONResponse(
+        content_response_payload(final_state, final_state["context"], timings.as_dict()),
+        headers=headers
+    )
+
+def run_batch(function: Callable[[Any], Dict[str, Any]], items: List[Any]) -> List[Dict[str, Any]]:
+    """Apply function to every item, STAGE_BATCH_CONCURRENCY at a time, keeping input order"""
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(len(items), STAGE_BATCH_CONCURRENCY)), thread_name_prefix="cm-stage"
+    ) as executor:
+        # Each item gets its own copy of the request context (timings, deadline, cancel event)
+        futures = [executor.submit(copy_context().run, function, item) for item in items]
+        return [future.result() for future in futures]
+
+async def run_stage(request: Request, endpoint: str, function: Callable[[Any], Dict[str, Any]], payload: Any):
+    """
+    Shared body of the stage endpoints. payload is one stage request, or a
+    batch whose items run concurrently; both are charged to the rate limit
+    per item and timed like a full generation.
+    """
+    items = getattr(payload, "items", None)
+    if items is not None and len(items) > STAGE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=422, detail=f"At most {STAGE_BATCH_MAX_ITEMS} items per batch")
+    enforce_rate_limit(request, endpoint, len(items) if items is not None else 1)
+    if items is not None:
+        # Batches yield provider slots to interactive requests
+        current_priority.set(PRIORITY_BATCH)
+    current_input_type.set("stage")
+    timings = RequestTimings()
+    current_timings.set(timings)
+    current_deadline.set(request_deadline())
+    
+    def run():
+        if items is None:
+            return function(payload)
+        return {"results": run_batch(function, items)}
+    
+    with REQUESTS_IN_FLIGHT.labels(endpoint).track_inprogress():
+        try:
+            result = await run_until_disconnected(request, endpoint, run)
+        except ClientDisconnected:
+            return Response(status_code=499)
+    
+    return FastJSONResponse(
+        {**result, "timings": timings.as_dict()},
+        headers={"Server-Timing": timings.server_timing_header()}
+    )
+
+def context_stage(item: ContentRequest) -> Dict[str, Any]:
+    image_data = None
+    if item.input_type == "image" and item.image_base64:
+        try:
+            image_data = base64.b64decode(item.image_base64, validate=True)
+        except binascii.Error:
+            raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+    return {"context": process_input_context(item.input_type, item.content, item.guided_answers, image_data)}
+
+def ideas_stage(item: IdeasRequest) -> Dict[str, Any]:
+    context = knowledge_context(item.context, item.brand)
+    ideas = generate_ideas(context, idea_count(item.n_ideas), item.exclude_titles)
+    return {"ideas": replace_duplicate_ideas(ideas, context, item.brand, item.exclude_titles)}
+
+def copy_stage(item: IdeaRequest) -> Dict[str, Any]:
+    return {"post": generate_copy(item.idea.model_dump(), item.context)}
+
+def visual_prompt_stage(item: IdeaRequest) -> Dict[str, Any]:
+    prompt = generate_visual_prompt(item.idea.model_dump(), item.context)
+    prompt_id = visual_prompt_id(prompt)
+    # Renderable later with GET /api/images/{prompt_id} or the image stage
+    prompt_store.set(prompt_id, prompt)
+    return {"visual_prompt": {"description": prompt, "prompt_id": prompt_id}}
+
+def image_stage(item: ImageRequest) -> Dict[str, Any]:
+    prompt_id = visual_prompt_id(item.prompt)
+    prompt_store.set(prompt_id, item.prompt)
+    cached = cached_image(prompt_id) is not None
+    image_data = generate_image_with_imagen(item.prompt)
+    if cached:
+        source = "cache"
+    else:
+        source = "provider" if image_cache.get(prompt_id) is not None else "placeholder"
+    return {"image": {"prompt_id": prompt_id, "image_url": image_url_fragment(image_data), "source": source}}
+
+def check_context_inputs(items: List[ContentRequest]) -> None:
+    # Reject a bad batch before any of its items reaches a provider
+    for index, item in enumerate(items):
+        if item.input_type not in INPUT_TYPES:
+            raise HTTPException(status_code=400, detail=f"Invalid input type in item {index}")
+
+@app.post("/api/stages/context")
+async def stage_context(request: Request, body: ContentRequest):
+    """Analyze one input into the context used by the other stages"""
+    check_context_inputs([body])
+    return await run_stage(request, "/api/stages/context", context_stage, body)
+
+@app.post("/api/stages/context/batch")
+async def stage_context_batch(request: Request, body: ContextBatchRequest):
+    check_context_inputs(body.items)
+    return await run_stage(request, "/api/stages/context", context_stage, body)
+
+@app.post("/api/stages/ideas")
+async def stage_ideas(request: Request, body: IdeasRequest):
+    """Ideas for an already analyzed context"""
+    return await run_stage(request, "/api/stages/ideas", ideas_stage, body)
+
+@app.post("/api/stages/ideas/batch")
+async def stage_ideas_batch(request: Request, body: IdeasBatchRequest):
+    return await run_stage(request, "/api/stages/ideas", ideas_stage, body)
+
+@app.post("/api/stages/copy")
+async def stage_copy(request: Request, body: IdeaRequest):
+    """Post copy (hook, body, CTA, hashtags) for one idea"""
+    return await run_stage(request, "/api/stages/copy", copy_stage, body)
+
+@app.post("/api/stages/copy/batch")
+async def stage_copy_batch(request: Request, body: IdeaBatchRequest):
+    return await run_stage(request, "/api/stages/copy", copy_stage, body)
+
+@app.post("/api/stages/visual-prompt")
+async def stage_visual_prompt(request: Request, body: IdeaRequest):
+    """Visual prompt for one idea, with the prompt id that renders it"""
+    return await run_stage(request, "/api/stages/visual-prompt", visual_prompt_stage, body)
+
+@app.post("/api/stages/visual-prompt/batch")
+async def stage_visual_prompt_batch(request: Request, body: IdeaBatchRequest):
+    return await run_stage(request, "/api/stages/visual-prompt", visual_prompt_stage, body)
+
+@app.post("/api/stages/image")
+async def stage_image(request: Request, body: ImageRequest):
+    """Image for a visual prompt, served from the image cache when already rendered"""
+    return await run_stage(request, "/api/stages/image", image_stage, body)
+
+@app.post("/api/stages/image/batch")
+async def stage_image_batch(request: Request, body: ImageBatchRequest):
+    return await run_stage(request, "/api/stages/image", image_stage, body)
+
+@app.get("/api/images/{prompt_id}")
+async def render_image(request: Request, prompt_id: str):
+    """
+    Render the image for one visual prompt of a draft response, e.g. when its
+    carousel slide becomes visible. Provider renders are cached, so repeated
+    requests for the same prompt id cost a single image call.
+    """
+    prompt = prompt_store.get(prompt_id)
+    if prompt is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired prompt id")
+    
+    cached = cached_image(prompt_id)
+    if cached is not None:
+        note_cache_hit()
+        record_lazy_render("cache")
+        image_data, source = cached, "cache"
+    else:
+        enforce_rate_limit(request, "/api/images")
+        current_deadline.set(request_deadline())
+        try:
+            image_data = await run_until_disconnected(
+                request, "/api/images", lambda: generate_image_with_imagen(prompt)
+            )
+        except ClientDisconnected:
+            return Response(status_code=499)
+        if not image_data:
+            raise HTTPException(status_code=502, detail="Image generation failed")
+        source = "provider" if image_cache.get(prompt_id) is not None else "placeholder"
+        record_lazy_render(source)
+    
+    # Placeholders stand in for a provider outage and must not stick in browser caches
+    cache_control = "no-store" if source == "placeholder" else f"private, max-age={IMAGE_CACHE_TTL_SECONDS:.0f}"
+    return Response(
+        content=image_data,
+        media_type="image/png",
+        headers={"Cache-Control": cache_control, "X-Image-Source": source}
+    )
+
+@app.get("/api/profiles/{request_id}")
+async def get_profile(
+    request_id: str,
+    x_profile_token: Optional[str] = Header(None),
+    profile_token: Optional[str] = None
+):
+    """Download the collapsed-stack profile of a sampled request"""
+    if not is_admin_token(x_profile_token or profile_token):
+        raise HTTPException(status_code=403, detail="Profiling requires the admin token")
+    path = profile_path(request_id)
+    if path is None or not path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=path.name)
+
+@app.get("/api/debug/memory")
+async def debug_memory(
+    top: int = 0,
+    x_profile_token: Optional[str] = Header(None),
+    profile_token: Optional[str] = None
+):
+    """Recent per-request memory peaks and current tracemalloc totals"""
+    if not is_admin_token(x_profile_token or profile_token):
+        raise HTTPException(status_code=403, detail="Memory diagnostics require the admin token")
+    return memory_report(top=top)
 
 @app.get("/api/guided-questions")
 async def get_guided_questions():
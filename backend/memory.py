@@ -0,0 +1,98 @@
+"""
+Per-request memory accounting based on tracemalloc
+tracemalloc only sees allocations made through Python's allocator and is
+process-wide, so with overlapping requests the reported peak is an upper
+bound for each of them. Tracking is off unless MEMORY_TRACKING is enabled
+because tracing every allocation slows the whole process down.
+"""
+
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Any, Dict, Optional
+
+from metrics import record_peak_memory
+
+MEMORY_TRACKING = os.getenv("MEMORY_TRACKING", "false").lower() in ("1", "true", "yes")
+MEMORY_HISTORY_SIZE = int(os.getenv("MEMORY_HISTORY_SIZE", "50"))
+
+_lock = threading.Lock()
+_active_requests = 0
+recent_requests: deque = deque(maxlen=MEMORY_HISTORY_SIZE)
+
+
+class MemoryTracker:
+    """Measures the traced memory peak between start() and stop()"""
+
+    def __init__(self, request_id: str, input_type: str, mode: str) -> None:
+        self.request_id = request_id
+        self.input_type = input_type
+        self.mode = mode
+        self.peak_bytes: Optional[int] = None
+        self._baseline: Optional[int] = None
+        self._started_at = 0.0
+
+    def start(self) -> None:
+        global _active_requests
+        if not MEMORY_TRACKING:
+            return
+        with _lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if _active_requests == 0:
+                # Nobody else is being measured, so the peak can start clean
+                tracemalloc.reset_peak()
+            _active_requests += 1
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        self._started_at = time.time()
+
+    def stop(self) -> Optional[int]:
+        """Finish the measurement; safe to call more than once"""
+        global _active_requests
+        if self._baseline is None or self.peak_bytes is not None:
+            return self.peak_bytes
+        with _lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            _active_requests -= 1
+        self.peak_bytes = max(0, peak - self._baseline)
+        record_peak_memory(self.input_type, self.mode, self.peak_bytes)
+        recent_requests.append({
+            "request_id": self.request_id,
+            "input_type": self.input_type,
+            "mode": self.mode,
+            "peak_bytes": self.peak_bytes,
+            "duration_s": round(time.time() - self._started_at, 3),
+            "finished_at": time.time(),
+        })
+        return self.peak_bytes
+
+
+def _max_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_report(top: int = 0) -> Dict[str, Any]:
+    """Snapshot for the debug endpoint; top > 0 adds the largest allocation sites"""
+    report: Dict[str, Any] = {
+        "tracking": MEMORY_TRACKING,
+        "max_rss_bytes": _max_rss_bytes(),
+        "recent_requests": list(recent_requests),
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced_current_bytes"] = current
+        report["traced_peak_bytes"] = peak
+        if top > 0:
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:top]
+            report["top_allocations"] = [
+                {"location": str(stat.traceback[0]), "size_bytes": stat.size, "count": stat.count}
+                for stat in statistics
+            ]
+    return report
@@ -0,0 +1,370 @@
+"""
+Prometheus instrumentation for the content generation pipeline
+Latency histograms per LangGraph node and per provider call, plus fallback,
+image byte and in-flight request counters exposed through /metrics.
+The same measurements feed a per-request RequestTimings breakdown that is
+returned to the client as a Server-Timing header and in ContentResponse.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# Input type of the request being served ("text", "url", "image", "guided").
+# Set once by the endpoint so every stage below it is tagged without threading
+# the value through each function signature.
+current_input_type: ContextVar[str] = ContextVar("current_input_type", default="unknown")
+
+OUTCOME_OK = "ok"
+OUTCOME_FALLBACK = "fallback"
+OUTCOME_ERROR = "error"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+NODE_LATENCY = Histogram(
+    "cm_workflow_node_duration_seconds",
+    "Latency of each LangGraph node in the content workflow",
+    ["node", "model", "outcome", "input_type"],
+    buckets=LATENCY_BUCKETS,
+)
+
+PROVIDER_LATENCY = Histogram(
+    "cm_provider_call_duration_seconds",
+    "Latency of context processors and provider calls",
+    ["operation", "model", "outcome", "input_type"],
+    buckets=LATENCY_BUCKETS,
+)
+
+FALLBACKS = Counter(
+    "cm_fallbacks_total",
+    "Times a stage returned generic fallback content instead of model output",
+    ["operation", "input_type"],
+)
+
+IMAGE_BYTES = Counter(
+    "cm_image_bytes_total",
+    "PNG bytes produced by image generation",
+    ["source"],
+)
+
+JSON_PARSE_RESULTS = Counter(
+    "cm_json_parse_total",
+    "Structured model responses by parse result (ok, repaired, failed)",
+    ["operation", "result"],
+)
+
+PEAK_MEMORY = Histogram(
+    "cm_request_peak_memory_bytes",
+    "Peak traced Python memory above the request's starting point (tracemalloc)",
+    ["input_type", "mode"],
+    buckets=tuple(2 ** power for power in range(20, 31)),  # 1 MiB .. 1 GiB
+)
+
+BREAKER_STATE = Gauge(
+    "cm_circuit_breaker_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["breaker"],
+)
+
+BREAKER_TRANSITIONS = Counter(
+    "cm_circuit_breaker_transitions_total",
+    "Circuit breaker state changes",
+    ["breaker", "state"],
+)
+
+BREAKER_SHORT_CIRCUITS = Counter(
+    "cm_circuit_breaker_short_circuits_total",
+    "Calls answered by the degraded path because the breaker was open",
+    ["breaker"],
+)
+
+DEGRADATIONS = Counter(
+    "cm_degraded_parts_total",
+    "Response parts degraded on purpose because the request deadline was running out",
+    ["part", "input_type"],
+)
+
+LAZY_RENDERS = Counter(
+    "cm_lazy_image_renders_total",
+    "Images rendered on demand for a draft prompt id, by source (cache, provider, placeholder)",
+    ["source"],
+)
+
+FIRST_POST_LATENCY = Histogram(
+    "cm_time_to_first_post_seconds",
+    "Time from request start until the first post copy is finished",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+
+CANCELLATIONS = Counter(
+    "cm_cancelled_requests_total",
+    "Requests abandoned because the client disconnected",
+    ["endpoint"],
+)
+
+CANCELLED_CALLS = Counter(
+    "cm_cancelled_provider_calls_total",
+    "Provider calls skipped because their request had been cancelled",
+    ["operation"],
+)
+
+DUPLICATE_IDEAS = Counter(
+    "cm_duplicate_ideas_total",
+    "Ideas that repeated earlier ones for the account, by outcome (replaced, kept)",
+    ["outcome"],
+)
+
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "cm_semantic_cache_lookups_total",
+    "Generations answered from (hit) or not found in (miss) the semantic context cache",
+    ["outcome"],
+)
+
+SEMANTIC_CACHE_SIMILARITY = Histogram(
+    "cm_semantic_cache_similarity",
+    "Similarity of the closest cached context at each semantic cache lookup",
+    ["outcome"],
+    buckets=(0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0),
+)
+
+SHARED_CACHE_REQUESTS = Counter(
+    "cm_shared_cache_requests_total",
+    "Shared cache operations by namespace and outcome (hits, misses, sets, errors)",
+    ["namespace", "outcome"],
+)
+
+KEY_POOL_CALLS = Counter(
+    "cm_api_key_calls_total",
+    "Provider calls per pooled API key, by outcome (ok, throttled, error)",
+    ["role", "key", "outcome"],
+)
+
+KEY_POOL_COOLDOWNS = Counter(
+    "cm_api_key_cooldowns_total",
+    "Times a pooled API key was taken out of rotation after a 429",
+    ["role", "key"],
+)
+
+KEY_POOL_IN_FLIGHT = Gauge(
+    "cm_api_key_in_flight",
+    "Provider calls currently running on each pooled API key",
+    ["role", "key"],
+)
+
+SCHEDULER_WAIT = Histogram(
+    "cm_scheduler_wait_seconds",
+    "Time provider calls spent queued for a slot of their pool, by priority",
+    ["pool", "priority"],
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+ADMISSION_DECISIONS = Counter(
+    "cm_admission_decisions_total",
+    "New generations admitted, downgraded to no images or rejected by admission control",
+    ["decision"],
+)
+
+ADMISSION_ESTIMATED_DELAY = Gauge(
+    "cm_admission_estimated_delay_seconds",
+    "Queue delay estimated for each provider pool at the latest admission decision",
+    ["pool"],
+)
+
+RATE_LIMITED = Counter(
+    "cm_rate_limited_requests_total",
+    "Requests rejected with 429 because the client's rate limit was exhausted",
+    ["endpoint"],
+)
+
+REQUESTS_IN_FLIGHT = Gauge(
+    "cm_requests_in_flight",
+    "Content generation requests currently being served",
+    ["endpoint"],
+)
+
+
+class RequestTimings:
+    """Per-request collector of stage and provider call durations"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.entries: List[Dict[str, Any]] = []
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self.fallbacks = 0
+        self.first_post_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, kind: str, start: float, duration: float, outcome: str, model_call: bool) -> None:
+        with self._lock:
+            self.entries.append({
+                "name": name,
+                "kind": kind,
+                "start": start,
+                "duration_ms": round(duration * 1000, 1),
+                "outcome": outcome,
+            })
+            if model_call:
+                self.llm_calls += 1
+            if outcome == OUTCOME_FALLBACK:
+                self.fallbacks += 1
+
+    def note_cache_hit(self) -> None:
+        with self._lock:
+            self.cache_hits += 1
+
+    def mark_first_post(self) -> Optional[float]:
+        """Seconds since the request started, the first time a post is finished"""
+        with self._lock:
+            if self.first_post_ms is not None:
+                return None
+            elapsed = time.perf_counter() - self.started
+            self.first_post_ms = round(elapsed * 1000, 1)
+            return elapsed
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def ordered_entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return sorted(self.entries, key=lambda entry: entry["start"])
+
+    def server_timing_header(self) -> str:
+        """Render entries as a Server-Timing header value (RFC 8673 syntax)"""
+        seen: Dict[str, int] = {}
+        metrics = []
+        for entry in self.ordered_entries():
+            # Repeated calls (one per idea) get a numeric suffix so devtools
+            # shows them as separate rows instead of collapsing them
+            name = f"{entry['kind']}.{entry['name']}"
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                name = f"{name}.{seen[name]}"
+            metrics.append(f'{name};dur={entry["duration_ms"]};desc="{entry["outcome"]}"')
+        metrics.append(f"total;dur={self.total_ms()}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": self.total_ms(),
+            "first_post_ms": self.first_post_ms,
+            "stages": [
+                {key: value for key, value in entry.items() if key != "start"}
+                for entry in self.ordered_entries()
+            ],
+            "llm_calls": self.llm_calls,
+            "cache_hits": self.cache_hits,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# Collector for the request being served; None outside of a request so the
+# helpers below cost nothing extra for background or test calls
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_timings", default=None)
+
+
+def note_cache_hit() -> None:
+    """Count a cache hit against the current request, if any"""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.note_cache_hit()
+
+
+class Observation:
+    """Mutable outcome holder yielded by the observe helpers"""
+
+    __slots__ = ("outcome",)
+
+    def __init__(self) -> None:
+        self.outcome = OUTCOME_OK
+
+    def fallback(self) -> None:
+        self.outcome = OUTCOME_FALLBACK
+
+    def error(self) -> None:
+        self.outcome = OUTCOME_ERROR
+
+
+@contextmanager
+def _observe(histogram: Histogram, kind: str, name: str, model: str, model_call: bool) -> Iterator[Observation]:
+    observation = Observation()
+    start = time.perf_counter()
+    try:
+        yield observation
+    except BaseException:
+        observation.error()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        input_type = current_input_type.get()
+        histogram.labels(name, model, observation.outcome, input_type).observe(elapsed)
+        if observation.outcome == OUTCOME_FALLBACK:
+            FALLBACKS.labels(name, input_type).inc()
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(name, kind, start, elapsed, observation.outcome, model_call)
+
+
+def observe_node(node: str, model: str = "none"):
+    """Time a LangGraph node; exceptions are recorded as outcome=error"""
+    return _observe(NODE_LATENCY, "node", node, model, model_call=False)
+
+
+def observe_call(operation: str, model: str = "none", model_call: Optional[bool] = None):
+    """
+    Time a provider call or context processor; call .fallback() on degraded output.
+    model_call defaults to True whenever a model is given; pass False for
+    wrappers around an inner observed call so it is not counted twice.
+    """
+    if model_call is None:
+        model_call = model != "none"
+    return _observe(PROVIDER_LATENCY, "call", operation, model, model_call)
+
+
+def record_first_post(mode: str) -> None:
+    """Observe time-to-first-post for the current request ("sequential" or "streamed")"""
+    timings = current_timings.get()
+    if timings is None:
+        return
+    elapsed = timings.mark_first_post()
+    if elapsed is not None:
+        FIRST_POST_LATENCY.labels(mode).observe(elapsed)
+
+
+def record_image_bytes(source: str, size: int) -> None:
+    IMAGE_BYTES.labels(source).inc(size)
+
+
+def record_lazy_render(source: str) -> None:
+    LAZY_RENDERS.labels(source).inc()
+
+
+def record_json_parse(operation: str, result: str) -> None:
+    JSON_PARSE_RESULTS.labels(operation, result).inc()
+
+
+def record_degradation(part: str) -> None:
+    DEGRADATIONS.labels(part, current_input_type.get()).inc()
+
+
+def record_peak_memory(input_type: str, mode: str, size: int) -> None:
+    PEAK_MEMORY.labels(input_type, mode).observe(size)
+
+
+def render_latest() -> bytes:
+    """Current metrics in Prometheus text exposition format"""
+    return generate_latest()
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,127 @@
+"""
+On-demand sampling profiler for single /api/generate-content requests
+Stacks are written in the collapsed format ("frame;frame;frame count") that
+both speedscope and flamegraph.pl import directly.
+
+Profiling is requested with the admin token, either as the X-Profile-Token
+header or the profile_token query parameter, or picked at random for one in
+PROFILE_SAMPLE_ONE_IN requests. When neither applies the only cost is the
+check in should_profile().
+"""
+
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Iterator, Mapping, Optional
+
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+PROFILE_SAMPLE_ONE_IN = int(os.getenv("PROFILE_SAMPLE_ONE_IN", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILES_DIR = Path(os.getenv("PROFILES_DIR", "profiles"))
+PROFILES_MAX_FILES = int(os.getenv("PROFILES_MAX_FILES", "200"))
+
+PROFILE_SUFFIX = ".collapsed"
+_REQUEST_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Leaf frames of threads that are parked rather than doing work; sampling them
+# would bury the request under idle executor and event loop stacks
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(PROFILING_ADMIN_TOKEN) and token == PROFILING_ADMIN_TOKEN
+
+
+def should_profile(headers: Mapping[str, str], query: Mapping[str, str]) -> bool:
+    """Decide whether this request is profiled (admin opt-in or 1-in-N sampling)"""
+    if PROFILING_ADMIN_TOKEN and (
+        is_admin_token(headers.get("x-profile-token")) or is_admin_token(query.get("profile_token"))
+    ):
+        return True
+    return PROFILE_SAMPLE_ONE_IN > 0 and random.randrange(PROFILE_SAMPLE_ONE_IN) == 0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # Semicolons separate frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+class SamplingProfiler:
+    """Wall-clock sampler over every Python thread except its own"""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_MS / 1000) -> None:
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cm-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                stack.reverse()
+                self.samples[";".join(stack)] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def profile_path(request_id: str) -> Optional[Path]:
+    """Location of a stored profile; None for ids that are not ours"""
+    if not _REQUEST_ID_RE.match(request_id):
+        return None
+    return PROFILES_DIR / f"{request_id}{PROFILE_SUFFIX}"
+
+
+def _prune_profiles() -> None:
+    profiles = sorted(PROFILES_DIR.glob(f"*{PROFILE_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+    for stale in profiles[:max(0, len(profiles) - PROFILES_MAX_FILES)]:
+        stale.unlink(missing_ok=True)
+
+
+@contextmanager
+def _profile(request_id: str) -> Iterator[SamplingProfiler]:
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+        profile_path(request_id).write_text(profiler.collapsed(), encoding="utf-8")
+        _prune_profiles()
+
+
+def profile_request(request_id: str, enabled: bool):
+    """Context manager that samples the enclosed block when enabled"""
+    return _profile(request_id) if enabled else nullcontext()
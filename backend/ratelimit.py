@@ -0,0 +1,68 @@
+"""
+Per-client rate limiting for the generation endpoints
+Each client address gets a token bucket refilled at RATE_LIMIT_PER_MINUTE
+tokens per minute, up to RATE_LIMIT_BURST. The full pipeline, the stage
+endpoints and the session regenerations all draw from the same bucket, and a
+batch draws one token per item, so splitting work into stage calls or
+batching it does not change a client's budget.
+RATE_LIMIT_PER_MINUTE=0 (the default) disables limiting.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+
+class RateLimiter:
+    """Token buckets keyed by client, with the least recently seen clients evicted"""
+
+    def __init__(
+        self,
+        per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        max_clients: int = RATE_LIMIT_MAX_CLIENTS,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str, cost: int = 1) -> float:
+        """
+        Take cost tokens from key's bucket. Returns 0 when allowed, otherwise
+        the seconds until the bucket holds enough tokens (nothing is taken).
+        A cost above the burst is charged as a full bucket.
+        """
+        if not self.enabled:
+            return 0.0
+        cost = min(cost, self.burst)
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
@@ -0,0 +1,135 @@
+"""
+Resilience primitives for provider calls
+CircuitBreaker keeps a rolling window of call results and opens when the
+error rate (slow calls count as errors) crosses a threshold. While open,
+callers go straight to their degraded path; after a cool-down the next call
+is let through as a probe and its result closes or re-opens the breaker.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+from metrics import BREAKER_SHORT_CIRCUITS, BREAKER_STATE, BREAKER_TRANSITIONS
+
+STATE_CLOSED = "closed"
+STATE_HALF_OPEN = "half_open"
+STATE_OPEN = "open"
+
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a rolling window of calls"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 20.0,
+        window_size: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._results: deque = deque(maxlen=window_size)  # True = failed or slow
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        BREAKER_STATE.labels(name).set(_STATE_VALUES[STATE_CLOSED])
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def _transition(self, state: str) -> None:
+        # Caller holds the lock
+        self._state = state
+        if state == STATE_OPEN:
+            self._opened_at = self._clock()
+        if state == STATE_CLOSED:
+            self._results.clear()
+        self._probes_in_flight = 0
+        BREAKER_STATE.labels(self.name).set(_STATE_VALUES[state])
+        BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+    def allow_request(self) -> bool:
+        """
+        Whether the protected call may run. Every allowed call must be
+        followed by record_success() or record_failure().
+        """
+        with self._lock:
+            if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.open_seconds:
+                self._transition(STATE_HALF_OPEN)
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+        BREAKER_SHORT_CIRCUITS.labels(self.name).inc()
+        return False
+
+    def rejects(self) -> bool:
+        """
+        Whether allow_request() would refuse now: open and cooling down, or
+        half-open with every probe in flight. Unlike allow_request() it never
+        starts a probe, so callers can check it before queueing for the call.
+        """
+        with self._lock:
+            cooling = self._state == STATE_OPEN and self._clock() - self._opened_at < self.open_seconds
+            probing = self._state == STATE_HALF_OPEN and self._probes_in_flight >= self.half_open_max_calls
+        if cooling or probing:
+            BREAKER_SHORT_CIRCUITS.labels(self.name).inc()
+        return cooling or probing
+
+    def record_success(self, duration: float) -> None:
+        if duration >= self.slow_call_seconds:
+            self.record_failure(duration)
+            return
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                self._transition(STATE_CLOSED)
+            else:
+                self._results.append(False)
+
+    def record_failure(self, duration: float) -> None:
+        with self._lock:
+            if self._state == STATE_HALF_OPEN:
+                self._transition(STATE_OPEN)
+                return
+            self._results.append(True)
+            if self._state == STATE_CLOSED and len(self._results) >= self.min_calls:
+                failure_rate = sum(self._results) / len(self._results)
+                if failure_rate >= self.failure_rate_threshold:
+                    self._transition(STATE_OPEN)
+
+    def reset(self) -> None:
+        """Back to closed with an empty window"""
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                self._transition(STATE_CLOSED)
+            self._results.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State summary for health and debug endpoints"""
+        with self._lock:
+            calls = len(self._results)
+            snapshot: Dict[str, Any] = {
+                "state": self._state,
+                "window_calls": calls,
+                "failure_rate": round(sum(self._results) / calls, 3) if calls else 0.0,
+            }
+            if self._state == STATE_OPEN:
+                snapshot["retry_in_s"] = round(max(0.0, self.open_seconds - (self._clock() - self._opened_at)), 1)
+            return snapshot
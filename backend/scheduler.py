@@ -0,0 +1,241 @@
+"""
+Fair-share scheduling of provider calls across requests
+Text and image calls each have a fixed number of slots
+(SCHEDULER_TEXT_SLOTS, SCHEDULER_IMAGE_SLOTS). When a pool is full, callers
+queue per tenant and priority, and freed slots go to the queues by deficit
+round robin: every queue in turn gets a quantum equal to its priority's
+weight, one slot per call. A request fanning out fifteen calls therefore
+takes turns with the requests that arrived after it instead of holding every
+slot until it is done, and interactive requests get SCHEDULER_INTERACTIVE_WEIGHT
+turns for each one of a batch job without starving it.
+
+The tenant is the client address the rate limiter uses; endpoints set it
+together with the priority in the request's context (current_tenant,
+current_priority), so worker threads started with copy_context() inherit
+them. A queued call gives up its place when its request is cancelled or its
+deadline runs out. 0 slots disables a pool.
+
+Each pool also keeps a moving average of how long calls hold a slot, which
+gives estimated_wait(): the queue delay a call arriving now should expect.
+Admission control uses it to turn work away before it piles up.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from cancellation import check_cancelled, is_cancelled
+from deadline import remaining_seconds
+from metrics import SCHEDULER_WAIT
+
+SCHEDULER_TEXT_SLOTS = int(os.getenv("SCHEDULER_TEXT_SLOTS", "16"))
+SCHEDULER_IMAGE_SLOTS = int(os.getenv("SCHEDULER_IMAGE_SLOTS", "8"))
+SCHEDULER_INTERACTIVE_WEIGHT = int(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "4"))
+SCHEDULER_MAX_TENANTS = int(os.getenv("SCHEDULER_MAX_TENANTS", "1000"))  # kept in the wait statistics
+# Slot hold time assumed until calls have been observed, per pool
+EXPECTED_TEXT_CALL_SECONDS = float(os.getenv("EXPECTED_TEXT_CALL_SECONDS", "5"))
+EXPECTED_IMAGE_CALL_SECONDS = float(os.getenv("EXPECTED_IMAGE_CALL_SECONDS", "15"))
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+# How often a queued call checks for cancellation
+_POLL_SECONDS = 0.25
+# Weight of the newest call in the hold time moving average
+_SERVICE_TIME_ALPHA = 0.2
+
+# Tenant and priority of the request being served
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default="anonymous")
+current_priority: ContextVar[str] = ContextVar("current_priority", default=PRIORITY_INTERACTIVE)
+
+
+class _Waiter:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.granted = False
+
+
+class FairScheduler:
+    """Slots of one provider pool handed out by weighted deficit round robin"""
+
+    def __init__(
+        self,
+        name: str,
+        slots: int,
+        expected_call_seconds: float = EXPECTED_TEXT_CALL_SECONDS,
+        interactive_weight: int = SCHEDULER_INTERACTIVE_WEIGHT,
+        max_tenants: int = SCHEDULER_MAX_TENANTS,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.name = name
+        self.slots = slots
+        self.weights = {PRIORITY_INTERACTIVE: max(1, interactive_weight), PRIORITY_BATCH: 1}
+        self.max_tenants = max_tenants
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._queues: Dict[Tuple[str, str], Deque[_Waiter]] = {}
+        self._ring: Deque[Tuple[str, str]] = deque()  # active queues, the one being served first
+        self._deficit: Dict[Tuple[str, str], int] = {}
+        self._waits: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._service_time = expected_call_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.slots > 0
+
+    def _next_waiter(self) -> _Waiter:
+        # Caller holds the lock and the ring is not empty
+        flow = self._ring[0]
+        if self._deficit[flow] < 1:
+            # Start of this queue's turn
+            self._deficit[flow] += self.weights.get(flow[1], 1)
+        waiter = self._queues[flow].popleft()
+        self._deficit[flow] -= 1
+        if not self._queues[flow]:
+            del self._queues[flow], self._deficit[flow]
+            self._ring.popleft()
+        elif self._deficit[flow] < 1:
+            self._ring.rotate(-1)
+        return waiter
+
+    def _dispatch(self) -> None:
+        # Caller holds the lock
+        while self._ring and self._in_use < self.slots:
+            waiter = self._next_waiter()
+            waiter.granted = True
+            self._in_use += 1
+            waiter.event.set()
+
+    def _withdraw(self, flow: Tuple[str, str], waiter: _Waiter) -> bool:
+        """Take a waiter out of its queue; False if it was granted a slot meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[flow]
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[flow], self._deficit[flow]
+                self._ring.remove(flow)
+            return True
+
+    def acquire(self, tenant: Optional[str] = None, priority: Optional[str] = None) -> float:
+        """
+        Wait for a slot; returns the seconds spent queued. Raises
+        RequestCancelled if the request is cancelled while queued and
+        TimeoutError if its deadline runs out first.
+        """
+        if not self.enabled:
+            return 0.0
+        tenant = tenant or current_tenant.get()
+        priority = priority or current_priority.get()
+        flow = (tenant, priority)
+        started = self._clock()
+        with self._lock:
+            if self._in_use < self.slots and not self._ring:
+                self._in_use += 1
+                waiter = None
+            else:
+                waiter = _Waiter()
+                if flow not in self._queues:
+                    self._queues[flow] = deque()
+                    self._deficit[flow] = 0
+                    self._ring.append(flow)
+                self._queues[flow].append(waiter)
+        waited = 0.0
+        if waiter is not None:
+            while not waiter.event.wait(_POLL_SECONDS):
+                remaining = remaining_seconds()
+                if (is_cancelled() or (remaining is not None and remaining <= 0)) and self._withdraw(flow, waiter):
+                    check_cancelled(f"{self.name}_slot")
+                    raise TimeoutError(f"Request deadline reached waiting for a {self.name} provider slot")
+            waited = self._clock() - started
+        self._record_wait(tenant, priority, waited)
+        return waited
+
+    def release(self, held: Optional[float] = None) -> None:
+        """Free a slot; held (seconds the call kept it) feeds the hold time average"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._in_use -= 1
+            if held is not None:
+                self._service_time += _SERVICE_TIME_ALPHA * (held - self._service_time)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one slot of the pool for the duration of the with block"""
+        self.acquire()
+        granted = self._clock()
+        try:
+            yield
+        finally:
+            self.release(self._clock() - granted)
+
+    def estimated_wait(self) -> float:
+        """
+        Queue delay expected by a call arriving now: the calls ahead of it
+        beyond the free slots, served slots at a time at the average hold time
+        """
+        with self._lock:
+            return self._estimated_wait()
+
+    def _estimated_wait(self) -> float:
+        # Caller holds the lock
+        if not self.enabled:
+            return 0.0
+        ahead = self._in_use + sum(len(queue) for queue in self._queues.values())
+        if ahead < self.slots:
+            return 0.0
+        return (ahead - self.slots + 1) * self._service_time / self.slots
+
+    def _record_wait(self, tenant: str, priority: str, waited: float) -> None:
+        SCHEDULER_WAIT.labels(self.name, priority).observe(waited)
+        with self._lock:
+            stats = self._waits.pop(tenant, None) or {"calls": 0, "total_wait_s": 0.0, "max_wait_s": 0.0}
+            stats["calls"] += 1
+            stats["total_wait_s"] += waited
+            stats["max_wait_s"] = max(stats["max_wait_s"], waited)
+            self._waits[tenant] = stats
+            while len(self._waits) > self.max_tenants:
+                self._waits.popitem(last=False)
+
+    def reset(self) -> None:
+        """Forget the wait statistics (queued calls and held slots are kept)"""
+        with self._lock:
+            self._waits.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Slots in use, queued calls and per-tenant queue wait"""
+        with self._lock:
+            queued: Dict[str, int] = {}
+            for (tenant, _), queue in self._queues.items():
+                queued[tenant] = queued.get(tenant, 0) + len(queue)
+            tenants = {
+                tenant: {
+                    "calls": int(stats["calls"]),
+                    "mean_wait_s": round(stats["total_wait_s"] / stats["calls"], 3),
+                    "max_wait_s": round(stats["max_wait_s"], 3),
+                    "queued": queued.get(tenant, 0),
+                }
+                for tenant, stats in self._waits.items()
+            }
+            for tenant, count in queued.items():
+                tenants.setdefault(tenant, {"calls": 0, "mean_wait_s": 0.0, "max_wait_s": 0.0, "queued": count})
+            return {
+                "slots": self.slots,
+                "in_use": self._in_use,
+                "queued": sum(queued.values()),
+                "mean_call_s": round(self._service_time, 3),
+                "estimated_wait_s": round(self._estimated_wait(), 3),
+                "tenants": tenants,
+            }
+
+
+text_scheduler = FairScheduler("text", SCHEDULER_TEXT_SLOTS, EXPECTED_TEXT_CALL_SECONDS)
+image_scheduler = FairScheduler("image", SCHEDULER_IMAGE_SLOTS, EXPECTED_IMAGE_CALL_SECONDS)
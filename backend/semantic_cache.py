@@ -0,0 +1,170 @@
+"""
+Semantic cache of generations by analyzed context
+Different phrasings of the same request ("recetas veganas fáciles", "recetas
+veganas sencillas para principiantes") produce nearly the same context, so
+the ideas and posts generated for one can be reused for the other. Each
+context is reduced to a 256-bit SimHash of its accent-folded words and word
+bigrams (weighted by frequency, bigrams at half weight); the similarity of
+two contexts is the share of fingerprint bits they agree on. Words that say
+nothing about the topic are left out: short and function words, and the
+headings the context analysis prompts make every summary repeat ("tema
+principal", "audiencia objetivo", "tono sugerido"...), which otherwise make
+unrelated contexts look alike. A lookup returns the closest entry of the same
+account at or above SEMANTIC_CACHE_THRESHOLD.
+
+The threshold was tuned on summaries in the format process_text_context
+produces: rephrasings of the same request score 0.67-0.83, other topics
+(including other requests of the same business) 0.50 on average and at most
+0.58, so 0.70 leaves about four standard deviations of chance agreement above
+the highest unrelated pair. Callers only use the cache for inputs that are
+free text and for requests that name their brand (see run_generation).
+
+Entries are evicted least recently used first once SEMANTIC_CACHE_MAX_ENTRIES
+is reached (0 disables the cache). Only the text output and prompt ids are
+kept; images are rendered again (or served from the image cache) on a hit.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from knowledge import tokenize
+
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.70"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+
+FINGERPRINT_BITS = 256
+_BIGRAM_WEIGHT = 0.5
+
+_FUNCTION_WORDS = frozenset("""
+    al del las los una uno unos unas con para por que sin sobre entre desde hasta pero como mas muy
+    sus son ser estar hay este esta estos estas ese esa eso cada todo toda todos todas tiene tienen
+""".split())
+# Headings the context analysis prompts ask every summary to cover
+_TEMPLATE_WORDS = frozenset("""
+    tema temas principal principales audiencia objetivo objetivos tono sugerido sugerida palabras
+    palabra clave claves importantes importante contenido contenidos instagram redes sociales
+    publicacion publicaciones estilo comunicacion contexto usuario crear resumen analisis
+""".split())
+
+
+def _feature_hash(feature: str) -> bytes:
+    return hashlib.blake2b(feature.encode("utf-8"), digest_size=FINGERPRINT_BITS // 8).digest()
+
+
+def simhash(text: str) -> int:
+    """256-bit SimHash of the text's topical words and their bigrams"""
+    words = [
+        word for word in tokenize(text)
+        if len(word) > 2 and word not in _FUNCTION_WORDS and word not in _TEMPLATE_WORDS
+    ]
+    features: Dict[str, float] = dict(Counter(words))
+    for first, second in zip(words, words[1:]):
+        bigram = f"{first} {second}"
+        features[bigram] = features.get(bigram, 0.0) + _BIGRAM_WEIGHT
+    if not features:
+        return 0
+    hashes = np.frombuffer(b"".join(_feature_hash(feature) for feature in features), dtype=np.uint8)
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    # Bit i of every hash as a column (bytes in order, then bits)
+    bits = np.unpackbits(hashes.reshape(len(features), -1), axis=1, bitorder="little")
+    votes = weights @ (2.0 * bits - 1.0)
+    return int.from_bytes(np.packbits(votes > 0, bitorder="little").tobytes(), "little")
+
+
+def fingerprint_similarity(first: int, second: int) -> float:
+    """Share of fingerprint bits two contexts agree on (1.0 identical, ~0.5 unrelated)"""
+    return 1.0 - (first ^ second).bit_count() / FINGERPRINT_BITS
+
+
+class SemanticCache:
+    """Thread-safe LRU of generations, looked up by context similarity within an account"""
+
+    def __init__(
+        self,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: float = SEMANTIC_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._clock = clock
+        # entry id -> (account, fingerprint, expires_at, value), least recently used first
+        self._entries: "OrderedDict[int, Tuple[str, int, float, Any]]" = OrderedDict()
+        self._accounts: Dict[str, Dict[int, int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(
+        self,
+        account: str,
+        context: str,
+        accept: Callable[[Any], bool] = lambda value: True
+    ) -> Tuple[Optional[Any], Optional[float]]:
+        """
+        (value, similarity) of the most similar live entry for the account
+        that accept() takes, if it reaches the threshold. Without a hit the
+        value is None and similarity is the best one seen (None when the
+        account has no entries), for reporting.
+        """
+        if not self.enabled:
+            return None, None
+        fingerprint = simhash(context)
+        now = self._clock()
+        with self._lock:
+            best_id, best = None, None
+            for entry_id, stored in list(self._accounts.get(account, {}).items()):
+                if self._entries[entry_id][2] <= now:
+                    self._remove(entry_id)
+                    continue
+                score = fingerprint_similarity(fingerprint, stored)
+                if (best is None or score > best) and accept(self._entries[entry_id][3]):
+                    best_id, best = entry_id, score
+            if best_id is None or best < self.threshold:
+                return None, best
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][3], best
+
+    def store(self, account: str, context: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        fingerprint = simhash(context)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (account, fingerprint, self._clock() + self.ttl, value)
+            self._accounts.setdefault(account, {})[entry_id] = fingerprint
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int) -> None:
+        # Caller holds the lock
+        account = self._entries.pop(entry_id)[0]
+        fingerprints = self._accounts[account]
+        del fingerprints[entry_id]
+        if not fingerprints:
+            del self._accounts[account]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._accounts.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,67 @@
+"""
+Fast JSON serialization for content responses
+Workflow output is validated once, when each stage produces it, so the
+response is assembled from plain dicts and encoded with orjson instead of
+being rebuilt through pydantic and re-validated by FastAPI's response_model.
+Images are embedded as pre-serialized orjson fragments so the base64 text is
+produced once, as bytes, and copied straight into the response body.
+"""
+
+import base64
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi import Response
+
+DATA_URL_PREFIX = b'"data:image/png;base64,'
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with orjson (understands orjson.Fragment)"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def image_url_fragment(image_data: Optional[bytes]) -> Optional[orjson.Fragment]:
+    """A PNG data URL as a ready-to-embed JSON string, or None without image"""
+    if not image_data:
+        return None
+    return orjson.Fragment(b"".join((DATA_URL_PREFIX, base64.b64encode(image_data), b'"')))
+
+
+def visual_prompts_payload(visual_prompts: List[Any]) -> List[Dict[str, Any]]:
+    """Workflow visual prompts in the VisualPrompt response shape"""
+    payload = []
+    for visual_data in visual_prompts:
+        if isinstance(visual_data, dict):
+            payload.append({
+                "description": visual_data.get("description", ""),
+                "image_url": image_url_fragment(visual_data.get("image_data")),
+                "prompt_id": visual_data.get("prompt_id"),
+            })
+        else:
+            # Fallback for old format
+            payload.append({"description": visual_data, "image_url": None})
+    return payload
+
+
+def content_response_payload(
+    final_state: Dict[str, Any],
+    context: str,
+    timings: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """ContentResponse-shaped dict built without re-validating workflow output"""
+    return {
+        "ideas": final_state["ideas"],
+        "posts": final_state["posts"],
+        "visual_prompts": visual_prompts_payload(final_state["visual_prompts"]),
+        "context_summary": context,
+        "context_id": final_state.get("context_id"),
+        "session_id": final_state.get("session_id"),
+        "history_id": final_state.get("history_id"),
+        "degraded": final_state.get("degraded") or [],
+        "timings": timings,
+    }
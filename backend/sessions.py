@@ -0,0 +1,117 @@
+"""
+Persistent workflow sessions
+Every content_workflow run is checkpointed under a session id in a local
+SQLite database (LangGraph's SqliteSaver), so a single post, visual prompt or
+image can be regenerated, or a failed stage resumed, from the stored state
+instead of re-running the whole pipeline. Images are not part of the checkpointed
+state, only where they came from; they are taken from the image caches (or
+rendered again) when a session is read.
+
+Retention is bounded: only the latest checkpoint of each session is kept,
+sessions expire SESSION_TTL_SECONDS after their last use, and the least
+recently used ones are evicted beyond SESSIONS_MAX_COUNT sessions or
+SESSIONS_MAX_BYTES of stored state.
+"""
+
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+SESSIONS_DB = os.getenv("SESSIONS_DB", "sessions.db")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "86400"))
+SESSIONS_MAX_COUNT = int(os.getenv("SESSIONS_MAX_COUNT", "500"))
+SESSIONS_MAX_BYTES = int(os.getenv("SESSIONS_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+class SessionStore:
+    """Session registry plus the LangGraph checkpointer that holds their state"""
+
+    def __init__(
+        self,
+        path: str = SESSIONS_DB,
+        ttl: float = SESSION_TTL_SECONDS,
+        max_count: int = SESSIONS_MAX_COUNT,
+        max_bytes: int = SESSIONS_MAX_BYTES,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        self.ttl = ttl
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self._clock = clock
+        # One connection shared by request threads; SqliteSaver serializes
+        # access with its lock and cursor() is used for our queries too
+        self.checkpointer = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+        with self.checkpointer.cursor() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def config(session_id: str) -> Dict[str, Any]:
+        """Runnable config that points the workflow at a session's checkpoints"""
+        return {"configurable": {"thread_id": session_id}}
+
+    def register(self, session_id: str) -> None:
+        """Create or refresh a session before the workflow writes to it"""
+        with self.checkpointer.cursor() as cur:
+            cur.execute(
+                "INSERT INTO sessions (session_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, self._clock())
+            )
+
+    def exists(self, session_id: str) -> bool:
+        with self.checkpointer.cursor(transaction=False) as cur:
+            row = cur.execute("SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None and row[0] > self._clock() - self.ttl
+
+    def save(self, session_id: str) -> None:
+        """After a run or an update: keep only the latest checkpoint and enforce the bounds"""
+        self.register(session_id)
+        with self.checkpointer.cursor() as cur:
+            for table in ("checkpoints", "writes"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id < "
+                    "(SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ?)",
+                    (session_id, session_id)
+                )
+        self.prune()
+
+    def delete(self, session_id: str) -> None:
+        self.checkpointer.delete_thread(session_id)
+        with self.checkpointer.cursor() as cur:
+            cur.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def sizes(self) -> List[List[Any]]:
+        """[session_id, updated_at, stored bytes], least recently used first"""
+        with self.checkpointer.cursor(transaction=False) as cur:
+            rows = cur.execute(
+                """
+                SELECT s.session_id, s.updated_at,
+                    COALESCE((SELECT SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints c
+                              WHERE c.thread_id = s.session_id), 0)
+                  + COALESCE((SELECT SUM(LENGTH(value)) FROM writes w
+                              WHERE w.thread_id = s.session_id), 0)
+                FROM sessions s ORDER BY s.updated_at
+                """
+            ).fetchall()
+        return [list(row) for row in rows]
+
+    def prune(self) -> None:
+        """Drop expired sessions, then the oldest ones over the count or byte limits"""
+        sessions = self.sizes()
+        expired_before = self._clock() - self.ttl
+        total_bytes = sum(size for _, _, size in sessions)
+        remaining = len(sessions)
+        for session_id, updated_at, size in sessions:
+            if updated_at > expired_before and remaining <= self.max_count and total_bytes <= self.max_bytes:
+                break
+            self.delete(session_id)
+            remaining -= 1
+            total_bytes -= size
+
+
+session_store = SessionStore()
@@ -0,0 +1,479 @@
+"""
+Cache shared by every worker process and node
+One get/set API with per-namespace TTLs over a pluggable backend:
+
+- memory: an in-process LRU (the default; nothing is shared)
+- sqlite: a database file, shared by the workers of a host or by nodes that
+  mount the same disk
+- redis: any server that speaks the Redis protocol (RESP), through the small
+  client below, so no extra dependency is needed
+
+Namespaces: llm (text model completions, off unless LLM_CACHE_TTL_SECONDS is
+set, since most prompts are meant to produce new content each time), pages
+(fetched webpage text), vision (image descriptions), images (provider
+renders), prompts (visual prompts by prompt id) and contexts (analyzed
+contexts by context id). A namespace with a TTL of 0 is disabled.
+
+prompt_store and context_store keep the ids handed out in responses. Each is
+a per-process LRU in front of its shared namespace, so a follow-up request
+(a lazy image render, more ideas) finds the id on whichever worker it lands.
+
+The cache never fails a request: backend errors count as misses, and a
+circuit breaker stops calling a remote backend that keeps failing.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import orjson
+
+from cache import (
+    CONTEXT_STORE_MAX_ENTRIES,
+    CONTEXT_STORE_TTL_SECONDS,
+    IMAGE_CACHE_TTL_SECONDS,
+    PROMPT_STORE_MAX_ENTRIES,
+    PROMPT_STORE_TTL_SECONDS,
+    TTLCache,
+)
+from metrics import SHARED_CACHE_REQUESTS
+from resilience import CircuitBreaker
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # "memory", "sqlite" or "redis"
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "cache.db")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_TIMEOUT_SECONDS = float(os.getenv("CACHE_REDIS_TIMEOUT_SECONDS", "0.5"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))  # memory and sqlite backends
+
+NAMESPACE_LLM = "llm"
+NAMESPACE_PAGES = "pages"
+NAMESPACE_VISION = "vision"
+NAMESPACE_IMAGES = "images"
+NAMESPACE_PROMPTS = "prompts"
+NAMESPACE_CONTEXTS = "contexts"
+
+NAMESPACE_TTL_SECONDS = {
+    NAMESPACE_LLM: float(os.getenv("LLM_CACHE_TTL_SECONDS", "0")),
+    NAMESPACE_PAGES: float(os.getenv("PAGE_CACHE_TTL_SECONDS", "3600")),
+    NAMESPACE_VISION: float(os.getenv("VISION_CACHE_TTL_SECONDS", "86400")),
+    NAMESPACE_IMAGES: IMAGE_CACHE_TTL_SECONDS,
+    NAMESPACE_PROMPTS: PROMPT_STORE_TTL_SECONDS,
+    NAMESPACE_CONTEXTS: CONTEXT_STORE_TTL_SECONDS,
+}
+
+_KEY_PREFIX = "cm:"
+
+
+class CacheBackendError(Exception):
+    """A backend could not serve a cache operation"""
+
+
+class MemoryBackend:
+    """Thread-safe in-process LRU with per-entry expiry"""
+
+    shared = False
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.time) -> None:
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def count(self, prefix: str) -> int:
+        now = self._clock()
+        with self._lock:
+            return sum(1 for key, (expires_at, _) in self._entries.items() if key.startswith(prefix) and expires_at > now)
+
+    def clear(self, prefix: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+
+class SQLiteBackend:
+    """
+    Entries in an SQLite file. WAL mode and a busy timeout let several
+    processes use the same file; beyond max_entries the least recently used
+    rows are deleted.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        path: str = CACHE_SQLITE_PATH,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time
+    ) -> None:
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        now = self._clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, now + ttl, now)
+                )
+                excess = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                        (excess,)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def count(self, prefix: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE substr(key, 1, ?) = ? AND expires_at > ?",
+                (len(prefix), prefix, self._clock())
+            ).fetchone()[0]
+
+    def clear(self, prefix: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+
+class RespError(CacheBackendError):
+    """Error reply from the server"""
+
+
+class RespClient:
+    """Minimal RESP2 client: one connection, opened lazily and reopened after errors"""
+
+    def __init__(self, url: str = CACHE_REDIS_URL, timeout: float = CACHE_REDIS_TIMEOUT_SECONDS) -> None:
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._socket.makefile("rb")
+        try:
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        except BaseException:
+            # An unauthenticated connection is useless; retry the handshake next time
+            self._close()
+            raise
+
+    def _close(self) -> None:
+        if self._socket is not None:
+            try:
+                self._reader.close()
+                self._socket.close()
+            except OSError:
+                pass
+        self._socket = self._reader = None
+
+    def _command(self, *args: Any) -> Any:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._socket.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the cache server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RespError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the cache server")
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise CacheBackendError(f"Unexpected reply from the cache server: {line!r}")
+
+    def execute(self, *args: Any) -> Any:
+        with self._lock:
+            try:
+                if self._socket is None:
+                    self._connect()
+                return self._command(*args)
+            except OSError:
+                # The connection is in an unknown state; the next command reconnects
+                self._close()
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+class RedisBackend:
+    """Entries on a Redis-protocol server; expiry and eviction are the server's"""
+
+    shared = True
+
+    def __init__(self, client: Optional[RespClient] = None) -> None:
+        self.client = client or RespClient()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.execute("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.client.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.client.execute("DEL", key)
+
+    def _scan(self, prefix: str) -> List[bytes]:
+        keys, cursor = [], "0"
+        while True:
+            cursor, batch = self.client.execute("SCAN", cursor, "MATCH", f"{prefix}*", "COUNT", 1000)
+            cursor = cursor.decode("utf-8")
+            keys.extend(batch)
+            if cursor == "0":
+                return keys
+
+    def count(self, prefix: str) -> int:
+        return len(set(self._scan(prefix)))
+
+    def clear(self, prefix: str) -> None:
+        keys = list(set(self._scan(prefix)))
+        for start in range(0, len(keys), 500):
+            self.client.execute("DEL", *keys[start:start + 500])
+
+
+def create_backend(name: str = CACHE_BACKEND):
+    """Backend selected by CACHE_BACKEND"""
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "redis":
+        return RedisBackend()
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown CACHE_BACKEND {name!r} (expected memory, sqlite or redis)")
+
+
+class SharedCache:
+    """Namespaced get/set with TTLs and hit/miss/error statistics over one backend"""
+
+    def __init__(self, backend, ttls: Optional[Dict[str, float]] = None) -> None:
+        self.backend = backend
+        self.ttls = dict(NAMESPACE_TTL_SECONDS if ttls is None else ttls)
+        # Only remote backends can fail on their own; the local ones fail loudly
+        self.breaker = CircuitBreaker("cache", slow_call_seconds=1.0) if isinstance(backend, RedisBackend) else None
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self) -> bool:
+        """Whether entries are visible to other processes"""
+        return self.backend.shared
+
+    def enabled(self, namespace: str) -> bool:
+        return self.ttls.get(namespace, 0) > 0
+
+    def _count(self, namespace: str, outcome: str) -> None:
+        SHARED_CACHE_REQUESTS.labels(namespace, outcome).inc()
+        with self._lock:
+            counts = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0, "errors": 0})
+            counts[outcome] += 1
+
+    def _call(self, namespace: str, operation: Callable[[], Any]) -> Tuple[bool, Any]:
+        """(ok, result) of a backend operation; failures are counted, never raised"""
+        if self.breaker is not None and not self.breaker.allow_request():
+            self._count(namespace, "errors")
+            return False, None
+        started = time.monotonic()
+        try:
+            result = operation()
+        except (OSError, sqlite3.Error, CacheBackendError, ValueError) as e:
+            if self.breaker is not None:
+                self.breaker.record_failure(time.monotonic() - started)
+            print(f"Cache backend error ({namespace}): {str(e)}")
+            self._count(namespace, "errors")
+            return False, None
+        if self.breaker is not None:
+            self.breaker.record_success(time.monotonic() - started)
+        return True, result
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        if not self.enabled(namespace):
+            return None
+        ok, value = self._call(namespace, lambda: self.backend.get(f"{_KEY_PREFIX}{namespace}:{key}"))
+        if ok:
+            self._count(namespace, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        ttl = self.ttls.get(namespace, 0) if ttl is None else ttl
+        if ttl <= 0:
+            return
+        ok, _ = self._call(namespace, lambda: self.backend.set(f"{_KEY_PREFIX}{namespace}:{key}", value, ttl))
+        if ok:
+            self._count(namespace, "sets")
+
+    def get_text(self, namespace: str, key: str) -> Optional[str]:
+        value = self.get(namespace, key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set_text(self, namespace: str, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self.set(namespace, key, value.encode("utf-8"), ttl)
+
+    def size(self, namespace: str) -> Optional[int]:
+        """Live entries in the namespace, or None if the backend cannot tell right now"""
+        try:
+            return self.backend.count(f"{_KEY_PREFIX}{namespace}:")
+        except (OSError, sqlite3.Error, CacheBackendError, ValueError):
+            return None
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        """Drop the namespace's entries (all of them without one) and its counters"""
+        prefix = _KEY_PREFIX if namespace is None else f"{_KEY_PREFIX}{namespace}:"
+        self.backend.clear(prefix)
+        with self._lock:
+            if namespace is None:
+                self._stats.clear()
+            else:
+                self._stats.pop(namespace, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-namespace TTL, counters, hit rate and current size"""
+        with self._lock:
+            counters = {namespace: dict(counts) for namespace, counts in self._stats.items()}
+        namespaces = {}
+        for namespace, ttl in self.ttls.items():
+            counts = counters.get(namespace, {"hits": 0, "misses": 0, "sets": 0, "errors": 0})
+            lookups = counts["hits"] + counts["misses"]
+            namespaces[namespace] = {
+                "ttl_seconds": ttl,
+                **counts,
+                "hit_rate": round(counts["hits"] / lookups, 3) if lookups else None,
+                "entries": self.size(namespace) if ttl > 0 else 0,
+            }
+        return {"backend": type(self.backend).__name__, "shared": self.shared, "namespaces": namespaces}
+
+
+class SharedStore:
+    """An in-process TTLCache backed by one namespace of the shared cache when it spans processes"""
+
+    def __init__(
+        self,
+        cache: SharedCache,
+        namespace: str,
+        local: TTLCache,
+        encode: Callable[[Any], bytes],
+        decode: Callable[[bytes], Any]
+    ) -> None:
+        self.cache = cache
+        self.namespace = namespace
+        self.local = local
+        self._encode = encode
+        self._decode = decode
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is None and self.cache.shared:
+            stored = self.cache.get(self.namespace, key)
+            if stored is not None:
+                value = self._decode(stored)
+                self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+        if self.cache.shared:
+            self.cache.set(self.namespace, key, self._encode(value))
+
+    def clear(self) -> None:
+        """Drop this process's copies; the shared entries expire with their TTL"""
+        self.local.clear()
+
+
+shared_cache = SharedCache(create_backend())
+
+# Visual prompt text by prompt id, so images can be rendered lazily on demand.
+# The id is the prompt's image cache key, which makes it stable across requests.
+prompt_store = SharedStore(
+    shared_cache, NAMESPACE_PROMPTS, TTLCache(PROMPT_STORE_MAX_ENTRIES, PROMPT_STORE_TTL_SECONDS),
+    lambda prompt: prompt.encode("utf-8"), lambda stored: stored.decode("utf-8")
+)
+
+# Analyzed context and the idea titles produced so far, by context id, so
+# "more ideas" continuations skip context analysis and avoid duplicates
+context_store = SharedStore(
+    shared_cache, NAMESPACE_CONTEXTS, TTLCache(CONTEXT_STORE_MAX_ENTRIES, CONTEXT_STORE_TTL_SECONDS),
+    orjson.dumps, orjson.loads
+)
@@ -0,0 +1,201 @@
+"""
+Structured output helpers for model calls that must return JSON
+response_schema() turns a pydantic model into the schema passed to the
+provider's structured-output mode; extract_json() is the tolerant second line
+for responses that still arrive wrapped in code fences, surrounded by prose
+or truncated mid-array. IncrementalArrayParser releases the elements of a
+streamed array one by one, as soon as each is complete in the token stream.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+PARSE_OK = "ok"
+PARSE_REPAIRED = "repaired"
+PARSE_FAILED = "failed"
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)\s*(?:```|$)", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[\]}])")
+
+
+def _strip_titles(schema: Any) -> Any:
+    # Pydantic adds "title" metadata everywhere; the provider schema format
+    # has no use for it
+    if isinstance(schema, dict):
+        stripped = {
+            key: _strip_titles(value)
+            for key, value in schema.items()
+            if not (key == "title" and isinstance(value, str))
+        }
+        properties = stripped.get("properties")
+        if isinstance(properties, dict) and isinstance(properties.get("title"), dict):
+            # langchain describes a property named "title" that has no
+            # description as "title is {...its schema...}"; name it plainly
+            properties["title"] = {"description": "title", **properties["title"]}
+        return stripped
+    if isinstance(schema, list):
+        return [_strip_titles(value) for value in schema]
+    return schema
+
+
+def response_schema(model: Type[BaseModel], array_length: Optional[int] = None) -> Dict[str, Any]:
+    """JSON schema for a model, or for an array of exactly array_length of them"""
+    schema = _strip_titles(model.model_json_schema())
+    if array_length is None:
+        return schema
+    return {"type": "array", "items": schema, "minItems": array_length, "maxItems": array_length}
+
+
+def _scan(text: str) -> Tuple[Optional[int], Optional[int], List[str], bool]:
+    """
+    Walk a JSON prefix tracking strings and brackets.
+    Returns (end of the top-level value or None, end of the last complete
+    top-level array element or None, open bracket stack, inside a string).
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    last_element_end = None
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "[{":
+            stack.append(char)
+        elif char in "]}":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return index + 1, last_element_end, stack, False
+            if len(stack) == 1:
+                last_element_end = index + 1
+    return None, last_element_end, stack, in_string
+
+
+def _loads(candidate: str) -> Any:
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", candidate))
+
+
+def extract_json(text: str, expected: type) -> Tuple[Any, str]:
+    """
+    Parse a model response into a list or dict.
+    Returns (value, PARSE_OK | PARSE_REPAIRED); raises ValueError when
+    nothing usable can be recovered.
+    """
+    content = text.strip()
+    fenced = _FENCE_RE.search(content)
+    if fenced:
+        content = fenced.group(1).strip()
+    try:
+        value = json.loads(content)
+        if isinstance(value, expected):
+            return value, PARSE_OK
+    except json.JSONDecodeError:
+        pass
+
+    opener = "[" if expected is list else "{"
+    start = content.find(opener)
+    if start < 0:
+        raise ValueError("No JSON value found in model response")
+    body = content[start:]
+    end, last_element_end, stack, in_string = _scan(body)
+
+    candidates = []
+    if end is not None:
+        # Complete value followed (or preceded) by stray prose
+        candidates.append(body[:end])
+    else:
+        if opener == "[" and last_element_end is not None:
+            # Truncated array: keep every element that was fully written
+            candidates.append(body[:last_element_end] + "]")
+        closers = "".join("]" if bracket == "[" else "}" for bracket in reversed(stack))
+        candidates.append(body + ('"' if in_string else "") + closers)
+
+    for candidate in candidates:
+        try:
+            value = _loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, expected):
+            return value, PARSE_REPAIRED
+    raise ValueError("Model response could not be repaired into JSON")
+
+
+class IncrementalArrayParser:
+    """
+    Parser for a JSON array that arrives in chunks. feed() returns the
+    top-level elements completed by that chunk; text before the opening
+    bracket (code fences, prose) is skipped.
+    """
+
+    def __init__(self) -> None:
+        self.complete = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element: List[str] = []
+
+    def _release(self, completed: List[Any]) -> None:
+        text = "".join(self._element).strip()
+        self._element = []
+        if not text:
+            return
+        try:
+            completed.append(_loads(text))
+        except json.JSONDecodeError:
+            # Malformed element: left for the final, whole-response parse
+            pass
+
+    def feed(self, chunk: str) -> List[Any]:
+        completed: List[Any] = []
+        for char in chunk:
+            if self.complete:
+                break
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                self._element.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == "," and self._depth == 1:
+                self._release(completed)
+                continue
+            if char in "]}" and self._depth == 1:
+                # Closes the array itself
+                self._release(completed)
+                self.complete = True
+                continue
+            self._element.append(char)
+            if char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}":
+                self._depth -= 1
+                if self._depth == 1:
+                    # An object or array element just closed
+                    self._release(completed)
+        return completed
@@ -0,0 +1,108 @@
+"""
+Tests para el control de admisión
+"""
+import json
+import pytest
+from unittest.mock import Mock, patch
+from fastapi.testclient import TestClient
+
+from admission import ADMIT, DOWNGRADE, REJECT, AdmissionController
+from scheduler import FairScheduler
+
+
+def busy_pool(name, call_seconds, busy=True):
+    """Pool de un hueco, ocupado por una llamada en curso"""
+    scheduler = FairScheduler(name, slots=1, expected_call_seconds=call_seconds)
+    if busy:
+        scheduler.acquire("ocupado")
+    return scheduler
+
+
+class TestEstimatedWait:
+    """Tests para la estimación de espera del planificador"""
+
+    def test_wait_from_backlog_and_hold_time(self):
+        scheduler = FairScheduler("text", slots=2, expected_call_seconds=4)
+        assert scheduler.estimated_wait() == 0.0
+
+        scheduler.acquire("a")
+        scheduler.acquire("b")
+        assert scheduler.estimated_wait() == 2.0
+
+        scheduler.release(held=9)
+        assert scheduler.snapshot()["mean_call_s"] == 5.0
+        assert scheduler.estimated_wait() == 0.0
+
+
+class TestAdmissionController:
+    """Tests para las decisiones de admisión"""
+
+    def test_decisions(self):
+        idle = AdmissionController(busy_pool("text", 5, False), busy_pool("image", 15, False), 10, 30)
+        slow_images = AdmissionController(busy_pool("text", 5), busy_pool("image", 15), 10, 30)
+        overloaded = AdmissionController(busy_pool("text", 42), busy_pool("image", 15), 10, 30)
+
+        assert idle.decide().action == ADMIT
+        assert slow_images.decide() == (DOWNGRADE, 15.0, 0)
+        # Un borrador no necesita imágenes
+        assert slow_images.decide(with_images=False).action == ADMIT
+        assert overloaded.decide() == (REJECT, 42.0, 12)
+
+    def test_image_queue_backlog_counts(self, tmp_path):
+        """En modo cola los renders pendientes de los workers cuentan en la espera de imágenes"""
+        from image_queue import ImageJobQueue
+
+        queue = ImageJobQueue(str(tmp_path / "queue.db"), worker_slots=2, expected_call_seconds=15)
+        controller = AdmissionController(busy_pool("text", 5, False), busy_pool("image", 15, False), 10, 30, image_queue=queue)
+        queue.enqueue("clave1", "prompt 1")
+        assert controller.decide().action == ADMIT
+
+        for i in range(2, 5):
+            queue.enqueue(f"clave{i}", f"prompt {i}")
+        assert controller.decide() == (DOWNGRADE, 22.5, 0)
+        assert controller.decide(with_images=False).action == ADMIT
+
+    def test_thresholds_can_be_disabled(self):
+        controller = AdmissionController(busy_pool("text", 100), busy_pool("image", 100), 0, 0)
+        assert controller.decide().action == ADMIT
+
+
+class TestGenerateContentAdmission:
+    """Tests de integración con /api/generate-content"""
+
+    def test_rejected_with_retry_after(self, monkeypatch):
+        from main import app
+
+        monkeypatch.setattr(
+            "main.admission_controller", AdmissionController(busy_pool("text", 42), busy_pool("image", 15), 10, 30)
+        )
+        response = TestClient(app).post("/api/generate-content", data={"input_type": "text", "content": "Café"})
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "12"
+
+    @patch('image_render.request_provider_image')
+    @patch('main.llm')
+    def test_downgraded_to_prompts_only(self, mock_llm, mock_image, monkeypatch):
+        """Con la cola de imágenes larga, el request se sirve sin imágenes y lo indica en degraded"""
+        from main import app
+
+        def invoke(messages, **kwargs):
+            prompt = messages[0].content
+            if "ideas creativas" in prompt:
+                return Mock(content=json.dumps([{"title": "Café de Etiopía", "description": "d"}]))
+            if "response_schema" in kwargs:
+                return Mock(content=json.dumps({"hook": "h", "body": "b", "cta": "c", "hashtags": []}))
+            return Mock(content="A cup of coffee")
+
+        mock_llm.invoke.side_effect = invoke
+        monkeypatch.setattr(
+            "main.admission_controller", AdmissionController(busy_pool("text", 1), busy_pool("image", 60), 10, 30)
+        )
+        response = TestClient(app).post(
+            "/api/generate-content", data={"input_type": "text", "content": "Café", "n_ideas": "1"}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["degraded"] == ["images"]
+        mock_image.assert_not_called()
@@ -61,31 +61,32 @@ class TestContextProcessing:
         
         assert "Error procesando URL" in result
     
-    @patch('main.genai.GenerativeModel')
-    def test_process_image_context_success(self, mock_model_class, sample_image, set_test_env_vars):
+    @patch('main.llm')
+    def test_process_image_context_success(self, mock_llm, sample_image, set_test_env_vars):
         """Test procesamiento exitoso de imagen"""
         from main import process_image_context
         
         # Mock del modelo Gemini Vision
-        mock_model = Mock()
         mock_response = Mock()
-        mock_response.text = "Descripción detallada de la imagen"
-        mock_model.generate_content.return_value = mock_response
-        mock_model_class.return_value = mock_model
+        mock_response.content = "Descripción detallada de la imagen"
+        mock_llm.invoke.return_value = mock_response
         
         result = process_image_context(sample_image)
         
         assert isinstance(result, str)
         assert "imagen" in result.lower()
-        mock_model.generate_content.assert_called_once()
+        mock_llm.invoke.assert_called_once()
+        # La imagen va en el mensaje, junto al prompt
+        content = mock_llm.invoke.call_args.args[0][0].content
+        assert content[1]["image_url"].startswith("data:image/")
     
-    @patch('main.genai.GenerativeModel')
-    def test_process_image_context_error(self, mock_model_class, sample_image, set_test_env_vars):
+    @patch('main.llm')
+    def test_process_image_context_error(self, mock_llm, sample_image, set_test_env_vars):
         """Test manejo de errores en procesamiento de imagen"""
         from main import process_image_context
         
         # Simular error en Gemini Vision
-        mock_model_class.side_effect = Exception("Vision API error")
+        mock_llm.invoke.side_effect = Exception("Vision API error")
         
         result = process_image_context(sample_image)
         
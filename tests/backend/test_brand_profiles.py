@@ -0,0 +1,141 @@
+"""
+Tests para los perfiles de marca persistentes
+"""
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+from brand_profiles import BrandProfileStore, profile_context
+
+ANALYSIS = {
+    "summary": "Cafetería de especialidad en Madrid",
+    "tone": "cercano y experto",
+    "audience": "amantes del café",
+    "keywords": ["café", "Etiopía"],
+}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Almacén vacío en memoria, también para los endpoints"""
+    now = [1000.0]
+    store = BrandProfileStore(":memory:", refresh_seconds=3600, clock=lambda: now[0])
+    store.now = now
+    monkeypatch.setattr("main.brand_profile_store", store)
+    return store
+
+
+def wait_for_refreshes():
+    import main
+    for thread in list(main.profile_refreshes.values()):
+        thread.join(5)
+
+
+class TestBrandProfileStore:
+    """Tests para el almacén SQLite"""
+
+    def test_create_update_and_staleness(self, store):
+        """Un perfil guarda su análisis y su entrada, y caduca tras refresh_seconds"""
+        profile = store.create("cafe", "url", "https://cafe.example", ANALYSIS, name="Café")
+
+        assert store.get(profile["id"])["keywords"] == ["café", "Etiopía"]
+        assert (profile["source"], profile["brand"], profile["name"]) == ("https://cafe.example", "cafe", "Café")
+        assert not store.is_stale(profile)
+
+        store.now[0] += 3600
+        assert store.is_stale(profile)
+        refreshed = store.update_analysis(profile["id"], {**ANALYSIS, "tone": "divertido"})
+        assert refreshed["tone"] == "divertido" and not store.is_stale(refreshed)
+
+        assert [p["id"] for p in store.list_profiles("cafe")] == [profile["id"]]
+        assert store.list_profiles("otra") == []
+        assert store.delete(profile["id"]) and store.get(profile["id"]) is None
+        assert store.update_analysis(profile["id"], ANALYSIS) is None
+
+    def test_profile_context(self):
+        context = profile_context(ANALYSIS)
+        assert context.startswith("Cafetería de especialidad en Madrid\n")
+        assert "Tono de la marca: cercano y experto" in context and "Palabras clave: café, Etiopía" in context
+
+
+class TestBrandProfileEndpoints:
+    """Tests de integración con la API"""
+
+    @patch('main.requests.get')
+    @patch('main.llm')
+    def test_profile_skips_fetch_and_context_analysis(self, mock_llm, mock_get, store):
+        """Con un perfil, la generación no descarga la página ni analiza el contexto"""
+        from main import app
+
+        def invoke(messages, **kwargs):
+            prompt = messages[0].content
+            if "Analiza esta marca" in prompt:
+                return Mock(content=json.dumps(ANALYSIS))
+            if "ideas creativas" in prompt:
+                return Mock(content=json.dumps([{"title": "Café de Etiopía", "description": "d"}]))
+            if "response_schema" in kwargs:
+                return Mock(content=json.dumps({"hook": "h", "body": "b", "cta": "c", "hashtags": []}))
+            return Mock(content="A cup of coffee")
+
+        mock_llm.invoke.side_effect = invoke
+        mock_get.return_value = Mock(content=b"<html><body>Granos tostados cada semana</body></html>")
+        client = TestClient(app)
+
+        profile = client.post("/api/brand-profiles", json={"input_type": "url", "content": "https://cafe.example", "brand": "cafe"}).json()
+        assert profile["tone"] == "cercano y experto"
+        assert "Granos tostados" in mock_llm.invoke.call_args_list[0].args[0][0].content
+
+        mock_get.reset_mock()
+        mock_llm.invoke.reset_mock()
+        response = client.post("/api/generate-content", data={
+            "input_type": "profile", "profile_id": profile["id"], "n_ideas": "1", "draft": "true"
+        })
+
+        assert response.status_code == 200
+        mock_get.assert_not_called()
+        prompts = [call.args[0][0].content for call in mock_llm.invoke.call_args_list]
+        assert "ideas creativas" in prompts[0] and "Palabras clave: café, Etiopía" in prompts[0]
+        assert not any("Analiza" in prompt for prompt in prompts)
+        assert response.json()["context_summary"] == profile_context(profile)
+
+    @patch('main.llm')
+    @patch('main.analyze_brand')
+    @patch('main.generate_ideas', return_value=[{"title": "Idea", "description": "d"}])
+    def test_stale_profile_is_refreshed_in_background(self, mock_ideas, mock_analyze, mock_llm, store):
+        """Un perfil caducado se usa tal cual y se vuelve a analizar en segundo plano"""
+        from main import app
+
+        mock_llm.invoke.return_value = Mock(content="Texto")
+        profile = store.create("cafe", "text", "Cafetería de especialidad", ANALYSIS)
+        mock_analyze.return_value = {**ANALYSIS, "tone": "divertido"}
+        client = TestClient(app)
+        data = {"input_type": "profile", "profile_id": profile["id"], "n_ideas": "1", "draft": "true"}
+
+        client.post("/api/generate-content", data=data)
+        mock_analyze.assert_not_called()
+
+        store.now[0] += 3600
+        response = client.post("/api/generate-content", data=data)
+        wait_for_refreshes()
+
+        assert "cercano y experto" in response.json()["context_summary"]
+        mock_analyze.assert_called_once_with("text", "Cafetería de especialidad")
+        assert store.get(profile["id"])["tone"] == "divertido"
+
+    @patch('main.analyze_brand', side_effect=ValueError("The brand analysis could not be parsed"))
+    def test_errors(self, mock_analyze, store):
+        from main import app
+
+        client = TestClient(app)
+        profile = store.create("cafe", "text", "Cafetería", ANALYSIS)
+
+        assert client.post("/api/brand-profiles", json={"input_type": "image", "content": "x"}).status_code == 400
+        assert client.post("/api/brand-profiles", json={"input_type": "text"}).status_code == 400
+        assert client.post("/api/brand-profiles", json={"input_type": "text", "content": "x"}).status_code == 502
+        # Un análisis fallido no sustituye al perfil guardado
+        assert client.post(f"/api/brand-profiles/{profile['id']}/refresh").status_code == 502
+        assert store.get(profile["id"])["tone"] == "cercano y experto"
+        assert client.post("/api/generate-content", data={"input_type": "profile", "profile_id": "x"}).status_code == 404
+        assert client.delete(f"/api/brand-profiles/{profile['id']}").status_code == 200
+        assert client.get(f"/api/brand-profiles/{profile['id']}").status_code == 404
@@ -0,0 +1,150 @@
+"""
+Tests para la cancelación de requests cuando el cliente se desconecta
+"""
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch, Mock
+from prometheus_client import REGISTRY
+from starlette.requests import Request
+
+import cancellation
+from cache import TTLCache, cache_key
+from cancellation import RequestCancelled, check_cancelled, current_cancel_event
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def disconnected_request(after_polls=0):
+    """Request de Starlette cuyo cliente se desconecta tras `after_polls` comprobaciones"""
+    polls = {"count": 0}
+
+    async def receive():
+        polls["count"] += 1
+        if polls["count"] > after_polls:
+            return {"type": "http.disconnect"}
+        return {"type": "http.request", "body": b"", "more_body": True}
+
+    scope = {"type": "http", "method": "POST", "path": "/api/generate-content", "headers": [], "query_string": b""}
+    return Request(scope, receive)
+
+
+@pytest.fixture
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(cancellation, "DISCONNECT_POLL_SECONDS", 0.01)
+
+
+class TestTTLCache:
+    """Tests para la caché en memoria"""
+
+    def test_entries_expire(self):
+        """Las entradas caducan tras el TTL"""
+        now = [0.0]
+        cache = TTLCache(max_entries=10, ttl=5, clock=lambda: now[0])
+        cache.set("clave", b"png")
+        assert cache.get("clave") == b"png"
+        now[0] = 6
+        assert cache.get("clave") is None
+
+    def test_least_recently_used_is_evicted(self):
+        """Al llenarse se descarta la entrada menos usada"""
+        cache = TTLCache(max_entries=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+    def test_key_depends_on_every_part(self):
+        assert cache_key("modelo", "prompt") != cache_key("modelo", "otro prompt")
+        assert cache_key("a", "bc") != cache_key("ab", "c")
+
+
+class TestCheckCancelled:
+    """Tests para la comprobación previa a cada llamada"""
+
+    def test_cancelled_request_blocks_calls(self):
+        """Con el evento activado no se inician nuevas llamadas"""
+        event = threading.Event()
+        token = current_cancel_event.set(event)
+        try:
+            check_cancelled("generate_copy")
+            event.set()
+            before = sample("cm_cancelled_provider_calls_total", operation="generate_copy")
+            with pytest.raises(RequestCancelled):
+                check_cancelled("generate_copy")
+        finally:
+            current_cancel_event.reset(token)
+
+        assert sample("cm_cancelled_provider_calls_total", operation="generate_copy") == before + 1
+
+    def test_no_request_never_cancelled(self):
+        check_cancelled("generate_copy")
+
+    def test_pipeline_result_when_client_stays(self, fast_polling):
+        """Si el cliente sigue conectado se devuelve el resultado del pipeline"""
+        result = asyncio.run(cancellation.run_until_disconnected(
+            disconnected_request(after_polls=1000), "/test", lambda: "resultado"
+        ))
+        assert result == "resultado"
+
+
+class TestDisconnectEndpoint:
+    """Tests de integración con /api/generate-content"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_disconnect_stops_remaining_calls(self, mock_llm, mock_client, fast_polling):
+        """Al desconectarse el cliente no se hacen más llamadas al proveedor"""
+        import main
+
+        def slow_invoke(*args, **kwargs):
+            time.sleep(0.1)
+            return Mock(content="respuesta sin JSON")
+
+        mock_llm.invoke.side_effect = slow_invoke
+        before = sample("cm_cancelled_requests_total", endpoint="/api/generate-content")
+
+        response = asyncio.run(main.generate_content(
+            request=disconnected_request(after_polls=2), input_type="text", content="Recetas veganas",
+            guided_answers=None, image=None, low_memory=False, deadline_seconds=None,
+            draft=False, n_ideas=5
+        ))
+        # La llamada en curso termina; después no se inicia ninguna más
+        time.sleep(0.3)
+
+        assert response.status_code == 499
+        assert sample("cm_cancelled_requests_total", endpoint="/api/generate-content") == before + 1
+        assert mock_llm.invoke.call_count <= 2
+        mock_client.models.generate_content.assert_not_called()
+
+    @patch('image_render.client')
+    def test_in_flight_image_finishes_into_cache(self, mock_client):
+        """Una imagen ya en curso al cancelar se guarda en caché y se reutiliza"""
+        from main import generate_image_with_imagen, visual_prompt_id
+        from cache import image_cache
+
+        event = threading.Event()
+        image_part = Mock(text=None, inline_data=Mock(data=b"\x89PNG imagen", mime_type="image/png"))
+
+        def cancel_during_render(*args, **kwargs):
+            event.set()  # el cliente se va mientras la imagen se genera
+            return Mock(candidates=[Mock(content=Mock(parts=[image_part]))])
+
+        mock_client.models.generate_content.side_effect = cancel_during_render
+        token = current_cancel_event.set(event)
+        try:
+            assert generate_image_with_imagen("a vegan bowl") == b"\x89PNG imagen"
+            # Ya cancelado: una imagen nueva no se pide, la cacheada sí se sirve
+            with pytest.raises(RequestCancelled):
+                generate_image_with_imagen("another prompt")
+            assert generate_image_with_imagen("a vegan bowl") == b"\x89PNG imagen"
+        finally:
+            current_cancel_event.reset(token)
+
+        assert image_cache.get(visual_prompt_id("a vegan bowl")) == b"\x89PNG imagen"
+        assert mock_client.models.generate_content.call_count == 1
@@ -0,0 +1,175 @@
+"""
+Tests para el presupuesto de tiempo por request
+"""
+import time
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+import deadline
+from deadline import deadline_scope, request_deadline, run_within_budget
+
+
+def initial_state(seconds_left):
+    return {
+        "context": "contexto de prueba", "ideas": [], "posts": [], "visual_prompts": [],
+        "error": None, "deadline": time.time() + seconds_left, "degraded": []
+    }
+
+
+IDEAS = [{"title": f"Idea {i}", "description": f"Descripción {i}"} for i in range(5)]
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+
+
+class TestBudgetHelpers:
+    """Tests para las funciones del presupuesto"""
+
+    def test_request_deadline_default_and_cap(self, monkeypatch):
+        """Sin valor del cliente se usa la configuración, y nunca se supera el máximo"""
+        monkeypatch.setattr(deadline, "REQUEST_DEADLINE_SECONDS", 60)
+        monkeypatch.setattr(deadline, "MAX_REQUEST_DEADLINE_SECONDS", 100)
+        now = time.time()
+
+        assert request_deadline() == pytest.approx(now + 60, abs=1)
+        assert request_deadline(20) == pytest.approx(now + 20, abs=1)
+        assert request_deadline(1000) == pytest.approx(now + 100, abs=1)
+
+    def test_fallback_without_budget(self):
+        """Con el presupuesto agotado la llamada ni siquiera se intenta"""
+        call = Mock()
+        with deadline_scope(time.time() + 1):
+            value, degraded = run_within_budget(call, lambda: "plantilla", 3)
+
+        assert (value, degraded) == ("plantilla", True)
+        call.assert_not_called()
+
+    def test_failure_with_budget_left_propagates(self):
+        """Un error que no se debe al presupuesto se propaga"""
+        with deadline_scope(time.time() + 60):
+            with pytest.raises(RuntimeError):
+                run_within_budget(Mock(side_effect=RuntimeError("boom")), lambda: "plantilla", 3)
+
+    def test_timed_out_llm_call_stops_within_deadline(self, monkeypatch):
+        """Una llamada de texto que agota su timeout no se reintenta más allá del presupuesto"""
+        from google.api_core.exceptions import DeadlineExceeded
+        import main
+
+        def timing_out(**kwargs):
+            time.sleep(min(kwargs["timeout"], 0.5))
+            raise DeadlineExceeded("timeout")
+
+        generate_content = Mock(side_effect=timing_out)
+        monkeypatch.setattr(main.llm.client, "generate_content", generate_content)
+        start = time.monotonic()
+        with deadline_scope(time.time() + 2):
+            with pytest.raises(DeadlineExceeded):
+                main.generate_visual_prompt({"title": "Bowl sin tiempo", "description": "d"}, "contexto")
+
+        assert time.monotonic() - start < 2
+        assert generate_content.call_count == 1
+
+    def test_no_deadline_is_unbounded(self):
+        """Fuera de un request no hay límite"""
+        assert deadline.remaining_seconds() is None
+        assert deadline.llm_timeout_kwargs() == {}
+
+
+class TestWorkflowDegradation:
+    """Tests de degradación en los nodos del workflow"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_low_budget_skips_images(self, mock_llm, mock_client):
+        """Si no queda tiempo para imágenes se devuelven solo los prompts visuales"""
+        import json
+        from main import create_content_workflow
+
+        responses = [json.dumps(IDEAS)] + [json.dumps(COPY)] * 5 + ["A vegan bowl"] * 5
+        mock_llm.invoke.side_effect = [Mock(content=content) for content in responses]
+
+        result = create_content_workflow().invoke(initial_state(6))
+
+        assert result["error"] is None
+        assert result["degraded"] == ["images"]
+        assert result["ideas"] == IDEAS
+        assert all(visual["image_source"] is None for visual in result["visual_prompts"])
+        assert all(visual["description"] == "A vegan bowl" for visual in result["visual_prompts"])
+        mock_client.models.generate_content.assert_not_called()
+        # Cada llamada recibe como timeout solo lo que queda del presupuesto
+        assert all(0 < call.kwargs["timeout"] <= 6 for call in mock_llm.invoke.call_args_list)
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_expired_budget_uses_templates(self, mock_llm, mock_client):
+        """Con el plazo vencido todas las partes usan plantillas"""
+        from main import create_content_workflow
+
+        result = create_content_workflow().invoke(initial_state(-1))
+
+        assert result["error"] is None
+        assert result["degraded"] == ["ideas", "posts", "visual_prompts", "images"]
+        assert len(result["posts"]) == 5
+        mock_llm.invoke.assert_not_called()
+        mock_client.models.generate_content.assert_not_called()
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_timeout_mid_call_falls_back(self, mock_llm, mock_client, monkeypatch):
+        """Si el plazo vence durante la llamada se usa la plantilla en lugar de fallar"""
+        from main import create_content_workflow
+
+        monkeypatch.setattr("main.MIN_TEXT_CALL_SECONDS", 0.2)
+
+        def slow_call(*args, **kwargs):
+            time.sleep(kwargs["timeout"])
+            raise TimeoutError("deadline exceeded")
+
+        mock_llm.invoke.side_effect = slow_call
+
+        result = create_content_workflow().invoke(initial_state(0.3))
+
+        assert result["error"] is None
+        assert "ideas" in result["degraded"]
+        assert mock_llm.invoke.call_count == 1
+
+
+class TestDeadlineEndpoint:
+    """Tests de integración con /api/generate-content"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_response_lists_degraded_parts(self, mock_llm, mock_client):
+        """El cliente puede fijar el plazo y la respuesta indica qué se degradó"""
+        from main import app
+
+        mock_llm.invoke.return_value = Mock(content="Contexto procesado")
+
+        response = TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas", "deadline_seconds": "1"}
+        )
+
+        assert response.status_code == 200
+        body = response.json()
+        assert "images" in body["degraded"]
+        assert all(visual["image_url"] is None for visual in body["visual_prompts"])
+        mock_client.models.generate_content.assert_not_called()
+
+    @patch('main.content_workflow')
+    @patch('main.process_text_context', return_value="Contexto procesado")
+    def test_full_budget_reports_nothing(self, mock_context, mock_workflow):
+        """Sin degradación la lista está vacía"""
+        from main import app
+
+        mock_workflow.invoke.return_value = {
+            "context": "Contexto procesado", "ideas": [], "posts": [], "visual_prompts": [],
+            "error": None, "degraded": []
+        }
+
+        response = TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas"}
+        )
+
+        assert response.json()["degraded"] == []
+        assert mock_workflow.invoke.call_args.args[0]["deadline"] > time.time()
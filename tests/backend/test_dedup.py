@@ -0,0 +1,151 @@
+"""
+Tests para la supresión de ideas casi duplicadas (MinHash + LSH)
+"""
+import json
+import time
+import pytest
+from unittest.mock import patch, Mock
+
+from dedup import IdeaDeduplicator, similarity
+
+GUIDE = {"title": "Guía completa de recetas veganas", "description": "Todo lo que necesitas saber sobre recetas veganas"}
+GUIDE_AGAIN = {"title": "Guía completa de recetas veganas", "description": "Todo lo que necesitas saber sobre las recetas veganas"}
+SMOOTHIE = {"title": "Batidos verdes para deportistas", "description": "Tres batidos con espinaca y mango"}
+YOGA = {"title": "Rutina de yoga al amanecer", "description": "Diez minutos de estiramientos en la playa"}
+
+
+def ideas_json(*ideas):
+    return json.dumps(list(ideas))
+
+
+class TestIdeaDeduplicator:
+    """Tests para el índice por cuenta"""
+
+    def test_signature_similarity(self):
+        """Las firmas estiman la similitud de Jaccard"""
+        deduplicator = IdeaDeduplicator()
+        guide = deduplicator.signature(GUIDE)
+
+        assert similarity(guide, deduplicator.signature(dict(GUIDE))) == 1.0
+        assert similarity(guide, deduplicator.signature(GUIDE_AGAIN)) >= 0.5
+        assert similarity(guide, deduplicator.signature(YOGA)) < 0.2
+
+    def test_history_and_same_list_duplicates(self):
+        """Se detectan repeticiones del historial de la cuenta y dentro de la lista"""
+        deduplicator = IdeaDeduplicator()
+        deduplicator.add("marca", [GUIDE])
+
+        duplicates = deduplicator.find_duplicates("marca", [GUIDE_AGAIN, YOGA, SMOOTHIE, dict(SMOOTHIE)])
+
+        assert duplicates == {0: GUIDE["title"], 3: SMOOTHIE["title"]}
+        assert deduplicator.find_duplicates("otra", [GUIDE]) == {}
+
+    def test_oldest_ideas_are_forgotten(self):
+        deduplicator = IdeaDeduplicator(max_per_account=2)
+        deduplicator.add("marca", [GUIDE, SMOOTHIE, YOGA])
+
+        assert deduplicator.size("marca") == 2
+        assert deduplicator.find_duplicates("marca", [GUIDE]) == {}
+        assert deduplicator.find_duplicates("marca", [YOGA]) == {0: YOGA["title"]}
+
+    def test_lookup_is_sub_millisecond(self):
+        """Una consulta con miles de ideas indexadas tarda menos de un milisegundo"""
+        deduplicator = IdeaDeduplicator()
+        deduplicator.add("marca", [
+            {"title": f"Idea número {i} sobre tema {i % 97}", "description": f"Descripción {i} con detalle {i % 13}"}
+            for i in range(5000)
+        ])
+
+        start = time.perf_counter()
+        for _ in range(100):
+            deduplicator.find_duplicates("marca", [GUIDE_AGAIN])
+        assert (time.perf_counter() - start) / 100 < 0.001
+
+
+class TestReplaceDuplicates:
+    """Tests para el re-pedido dirigido antes de generar copies e imágenes"""
+
+    @patch('main.llm')
+    def test_duplicate_is_replaced_with_one_reask(self, mock_llm):
+        """Una idea repetida se sustituye con una sola llamada (con candidatas de sobra)"""
+        from main import idea_deduplicator, replace_duplicate_ideas
+
+        idea_deduplicator.add("default", [GUIDE])
+        mock_llm.invoke.return_value = Mock(content=ideas_json(YOGA))
+
+        ideas = replace_duplicate_ideas([SMOOTHIE, GUIDE_AGAIN], "recetas veganas")
+
+        assert ideas == [SMOOTHIE, YOGA]
+        assert mock_llm.invoke.call_count == 1
+        prompt = mock_llm.invoke.call_args.args[0][0].content
+        assert "exactamente 3 ideas" in prompt and f"- {GUIDE['title']}" in prompt
+        # La lista final queda registrada
+        assert idea_deduplicator.find_duplicates("default", [YOGA]) == {0: YOGA["title"]}
+
+    @patch('main.llm')
+    def test_repeated_replacement_keeps_original(self, mock_llm):
+        """Si el re-pedido vuelve a repetir, se conserva la idea original"""
+        from main import idea_deduplicator, replace_duplicate_ideas
+
+        bread = {"title": "Pan de plátano sin huevo", "description": "Receta de merienda vegana"}
+        idea_deduplicator.add("default", [GUIDE, SMOOTHIE, YOGA, bread])
+        mock_llm.invoke.return_value = Mock(content=ideas_json(SMOOTHIE, YOGA, bread))
+
+        assert replace_duplicate_ideas([GUIDE_AGAIN], "recetas veganas") == [GUIDE_AGAIN]
+        assert mock_llm.invoke.call_count == 1
+
+    @patch('main.llm')
+    def test_replacements_do_not_repeat_each_other(self, mock_llm):
+        """Dos sustitutas casi iguales del mismo lote no entran ambas"""
+        from main import idea_deduplicator, replace_duplicate_ideas
+
+        yoga_again = {"title": "Rutina de yoga al amanecer en la playa", "description": YOGA["description"]}
+        bread = {"title": "Pan de plátano sin huevo", "description": "Receta de merienda vegana"}
+        idea_deduplicator.add("default", [GUIDE, SMOOTHIE])
+        mock_llm.invoke.return_value = Mock(content=ideas_json(YOGA, yoga_again, bread))
+
+        assert replace_duplicate_ideas([GUIDE_AGAIN, SMOOTHIE], "recetas veganas") == [YOGA, bread]
+
+    @patch('main.llm')
+    def test_no_duplicates_no_calls(self, mock_llm):
+        from main import replace_duplicate_ideas
+
+        assert replace_duplicate_ideas([GUIDE, YOGA], "contexto", brand="marca") == [GUIDE, YOGA]
+        mock_llm.invoke.assert_not_called()
+
+    @patch('main.generate_image_with_imagen', return_value=b"png")
+    @patch('main.generate_visual_prompt', return_value="Visual prompt")
+    @patch('main.generate_copy')
+    @patch('main.llm')
+    def test_second_run_only_builds_new_ideas(self, mock_llm, mock_copy, mock_visual, mock_image):
+        """En la segunda generación las ideas repetidas se cambian antes de hacer copies"""
+        from main import create_content_workflow
+
+        mock_copy.side_effect = lambda idea, context: {"hook": idea["title"], "body": "b", "cta": "c", "hashtags": []}
+        workflow = create_content_workflow(streamed=False)
+        state = {"context": "recetas veganas", "ideas": [], "posts": [], "visual_prompts": [], "error": None, "n_ideas": 2}
+
+        mock_llm.invoke.return_value = Mock(content=ideas_json(GUIDE, SMOOTHIE))
+        workflow.invoke(state)
+        mock_llm.invoke.side_effect = [Mock(content=ideas_json(GUIDE_AGAIN, YOGA)), Mock(content=ideas_json(SMOOTHIE, {
+            "title": "Pan de plátano sin huevo", "description": "Receta de merienda vegana"
+        }))]
+        result = workflow.invoke(state)
+
+        titles = [idea["title"] for idea in result["ideas"]]
+        assert titles == ["Pan de plátano sin huevo", YOGA["title"]]
+        assert [call.args[0]["title"] for call in mock_copy.call_args_list[2:]] == titles
+
+
+class TestSeedFromHistory:
+    def test_recent_ideas_keep_brand(self):
+        """El historial devuelve las ideas con su marca para sembrar el índice"""
+        from history import HistoryStore
+
+        store = HistoryStore(":memory:")
+        state = {"context": "c", "ideas": [GUIDE], "posts": [], "visual_prompts": [], "brand": "marca"}
+        store.record("text", "uno", state)
+        store.record("text", "dos", {**state, "ideas": [YOGA], "brand": None})
+
+        assert store.recent_ideas(10) == [("marca", GUIDE), (None, YOGA)]
+        assert store.recent_ideas(1) == [(None, YOGA)]
@@ -0,0 +1,103 @@
+"""
+Tests para la caché de imágenes en disco
+"""
+import multiprocessing
+import os
+import pytest
+from unittest.mock import patch
+
+from disk_cache import DiskImageCache
+
+
+def fill(directory, worker):
+    """Escritura concurrente desde otro proceso"""
+    cache = DiskImageCache(directory, max_bytes=500)
+    for i in range(30):
+        cache.put(f"{i % 10:02d}clave{i % 10}", bytes([worker]) * 100)
+
+
+class TestDiskImageCache:
+    """Tests para los ficheros y su índice"""
+
+    def test_roundtrip_survives_restart(self, tmp_path):
+        """Las imágenes y el índice siguen ahí tras reabrir la caché"""
+        DiskImageCache(str(tmp_path), max_bytes=1000).put("abcdef", b"\x89PNG uno")
+
+        reopened = DiskImageCache(str(tmp_path), max_bytes=1000)
+
+        assert reopened.get("abcdef") == b"\x89PNG uno"
+        assert reopened.get("otra") is None
+        assert reopened.stats() == {"enabled": True, "entries": 1, "bytes": 8, "max_bytes": 1000}
+        assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+    def test_least_recently_used_evicted_by_bytes(self, tmp_path):
+        now = [0.0]
+        cache = DiskImageCache(str(tmp_path), max_bytes=250, clock=lambda: now[0])
+        for key in ("aa1", "bb2"):
+            now[0] += 1
+            cache.put(key, b"x" * 100)
+        now[0] += 1
+        cache.get("aa1")
+        now[0] += 1
+        cache.put("cc3", b"y" * 100)
+
+        assert cache.get("bb2") is None
+        assert not os.path.exists(os.path.join(tmp_path, "bb", "bb2.png"))
+        assert cache.get("aa1") == b"x" * 100 and cache.get("cc3") == b"y" * 100
+        assert cache.stats()["bytes"] == 200
+        # Lo que no cabe ni sola no se guarda
+        cache.put("dd4", b"z" * 300)
+        assert cache.get("dd4") is None
+
+    def test_missing_file_is_a_miss(self, tmp_path):
+        """Un fichero borrado por otro proceso cuenta como fallo y se quita del índice"""
+        cache = DiskImageCache(str(tmp_path), max_bytes=1000)
+        cache.put("abcdef", b"png")
+        os.remove(os.path.join(tmp_path, "ab", "abcdef.png"))
+
+        assert cache.get("abcdef") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_disabled(self, tmp_path):
+        cache = DiskImageCache(str(tmp_path / "off"), max_bytes=0)
+        cache.put("abcdef", b"png")
+        assert cache.get("abcdef") is None
+        assert not os.path.exists(tmp_path / "off")
+
+    def test_concurrent_processes(self, tmp_path):
+        """Varios procesos escribiendo a la vez dejan imágenes completas y el límite respetado"""
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=fill, args=(str(tmp_path), worker)) for worker in (1, 2, 3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+            assert worker.exitcode == 0
+
+        cache = DiskImageCache(str(tmp_path), max_bytes=500)
+        for i in range(10):
+            data = cache.get(f"{i:02d}clave{i}")
+            assert data is None or (len(data) == 100 and len(set(data)) == 1)
+        assert cache.stats()["bytes"] <= 500
+
+
+class TestImageGenerationUsesDisk:
+    """Tests de integración con generate_image_with_imagen"""
+
+    @patch('image_render.request_provider_image', return_value=b"\x89PNG render")
+    def test_hit_after_restart_skips_provider(self, mock_provider, tmp_path, monkeypatch):
+        """Con la caché en memoria vacía (reinicio), la imagen sale del disco sin llamar al proveedor"""
+        from main import generate_image_with_imagen, visual_prompt_id
+        from cache import image_cache
+
+        monkeypatch.setattr("image_render.disk_image_cache", DiskImageCache(str(tmp_path), max_bytes=10_000))
+
+        assert generate_image_with_imagen("A vegan bowl") == b"\x89PNG render"
+        image_cache.clear()
+
+        assert generate_image_with_imagen("  A vegan   bowl ") == b"\x89PNG render"
+        assert mock_provider.call_count == 1
+        assert image_cache.get(visual_prompt_id("A vegan bowl")) == b"\x89PNG render"
+
+        generate_image_with_imagen("A vegan bowl", refresh=True)
+        assert mock_provider.call_count == 2
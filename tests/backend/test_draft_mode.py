@@ -0,0 +1,115 @@
+"""
+Tests para el modo borrador y el renderizado de imágenes bajo demanda
+"""
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+IDEAS = [{"title": f"Idea {i}", "description": f"Descripción {i}"} for i in range(5)]
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+
+
+def llm_responses():
+    """Contexto, ideas, 5 copies y 5 prompts visuales distintos"""
+    contents = ["Contexto procesado", json.dumps(IDEAS)] + [json.dumps(COPY)] * 5
+    contents += [f"Vegan bowl number {i}" for i in range(5)]
+    return [Mock(content=content) for content in contents]
+
+
+def image_response(data=b"\x89PNG imagen real"):
+    image_part = Mock(text=None, inline_data=Mock(data=data, mime_type="image/png"))
+    return Mock(candidates=[Mock(content=Mock(parts=[image_part]))])
+
+
+class TestDraftWorkflow:
+    """Tests del modo borrador en el workflow"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_draft_returns_prompts_without_images(self, mock_llm, mock_client):
+        """En modo borrador no se genera ninguna imagen"""
+        from main import create_content_workflow, visual_prompt_id
+        from shared_cache import prompt_store
+
+        mock_llm.invoke.side_effect = llm_responses()[1:]
+
+        result = create_content_workflow().invoke({
+            "context": "contexto", "ideas": [], "posts": [], "visual_prompts": [],
+            "error": None, "deadline": None, "degraded": [], "draft": True
+        })
+
+        assert result["error"] is None
+        assert result["degraded"] == []
+        mock_client.models.generate_content.assert_not_called()
+        for visual in result["visual_prompts"]:
+            assert visual["image_source"] is None
+            assert visual["prompt_id"] == visual_prompt_id(visual["description"])
+            assert prompt_store.get(visual["prompt_id"]) == visual["description"]
+
+    def test_prompt_id_is_stable(self):
+        """El mismo prompt tiene siempre el mismo id"""
+        from main import visual_prompt_id
+
+        assert visual_prompt_id("a vegan bowl") == visual_prompt_id("a vegan bowl")
+        assert visual_prompt_id("a vegan bowl") != visual_prompt_id("a vegan salad")
+
+
+class TestLazyRendering:
+    """Tests para GET /api/images/{prompt_id}"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_draft_then_render_one_image(self, mock_llm, mock_client):
+        """Solo se renderiza la imagen pedida, y una sola vez"""
+        from main import app
+
+        mock_llm.invoke.side_effect = llm_responses()
+        mock_client.models.generate_content.return_value = image_response()
+        client = TestClient(app)
+
+        draft = client.post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas", "draft": "true"}
+        ).json()
+
+        assert all(visual["image_url"] is None for visual in draft["visual_prompts"])
+        prompt_id = draft["visual_prompts"][2]["prompt_id"]
+
+        first = client.get(f"/api/images/{prompt_id}")
+        assert first.status_code == 200
+        assert first.headers["content-type"] == "image/png"
+        assert first.headers["x-image-source"] == "provider"
+        assert first.content == b"\x89PNG imagen real"
+
+        second = client.get(f"/api/images/{prompt_id}")
+        assert second.headers["x-image-source"] == "cache"
+        assert second.content == first.content
+        assert mock_client.models.generate_content.call_count == 1
+        assert mock_client.models.generate_content.call_args.kwargs["contents"] == "Vegan bowl number 2"
+
+    def test_unknown_prompt_id(self):
+        """Un id desconocido o caducado devuelve 404"""
+        from main import app
+
+        response = TestClient(app).get(f"/api/images/{'0' * 64}")
+        assert response.status_code == 404
+
+    @patch('image_render.client')
+    def test_placeholder_is_not_cached(self, mock_client):
+        """Si el proveedor falla se sirve el placeholder sin cachearlo"""
+        from main import app, visual_prompt_id
+        from shared_cache import prompt_store
+
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+        prompt_id = visual_prompt_id("a vegan bowl")
+        prompt_store.set(prompt_id, "a vegan bowl")
+        client = TestClient(app)
+
+        for _ in range(2):
+            response = client.get(f"/api/images/{prompt_id}")
+            assert response.status_code == 200
+            assert response.headers["x-image-source"] == "placeholder"
+            assert response.headers["cache-control"] == "no-store"
+
+        assert mock_client.models.generate_content.call_count == 2
@@ -0,0 +1,146 @@
+"""
+Tests para el historial de generaciones y su índice de texto completo
+"""
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+from history import HistoryStore, normalize_input
+
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+
+
+def finished_state(titles, hook="Transforma tu cocina", hashtags=("#vegano",)):
+    return {
+        "context": "Contexto de recetas veganas",
+        "ideas": [{"title": title, "description": "d"} for title in titles],
+        "posts": [{"hook": hook, "body": "Recetas fáciles para principiantes", "cta": "c", "hashtags": list(hashtags)}
+                  for _ in titles],
+        "visual_prompts": [{"description": "A vegan bowl", "image_data": b"png", "prompt_id": "p1"} for _ in titles],
+        "context_id": "ctx",
+        "session_id": "s",
+    }
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Historial vacío en memoria, también para los endpoints"""
+    store = HistoryStore(":memory:")
+    monkeypatch.setattr("main.history_store", store)
+    return store
+
+
+class TestHistoryStore:
+    """Tests para el almacén SQLite"""
+
+    def test_record_and_get_without_image_bytes(self, store):
+        """Se guarda el resultado comprimido, con referencias a las imágenes"""
+        entry_id = store.record("text", "Recetas veganas", finished_state(["Batidos"]))
+
+        entry = store.get(entry_id)
+        assert entry["ideas"] == [{"title": "Batidos", "description": "d"}]
+        assert entry["visual_prompts"] == [{"description": "A vegan bowl", "prompt_id": "p1"}]
+        assert entry["context_summary"] == "Contexto de recetas veganas"
+        assert store.get(entry_id + 1) is None
+
+    def test_full_text_search(self, store):
+        """La búsqueda cubre títulos, hooks y hashtags, sin acentos ni sintaxis FTS"""
+        first = store.record("text", "uno", finished_state(["Batidos verdes"], hashtags=("#plantbased",)))
+        second = store.record("text", "dos", finished_state(["Pasta rápida"], hook="Cena en 10 minutos"))
+
+        assert [r["id"] for r in store.search("batidos")] == [first]
+        assert [r["id"] for r in store.search("rapida cena")] == [second]
+        assert [r["id"] for r in store.search("plantbased")] == [first]
+        assert store.search('" OR NEAR(') == []
+        assert store.search("pasta batidos") == []
+
+    def test_exact_and_near_matches(self, store):
+        """Coincidencias exactas primero, luego casi exactas por encima del umbral"""
+        text = "Recetas veganas fáciles para principiantes con ingredientes de temporada y poco tiempo"
+        exact = store.record("text", text, finished_state(["A"]))
+        near = store.record("text", text + " rápidas", finished_state(["B"]))
+        store.record("text", "Rutinas de yoga para la mañana", finished_state(["C"]))
+        store.record("url", text, finished_state(["D"]))
+
+        matches = store.find_matches("text", text.upper() + "!!")
+
+        assert [(m["id"], m["exact"]) for m in matches] == [(exact, True), (near, False)]
+        assert 0.9 <= matches[1]["similarity"] < 1
+        assert store.find_matches("text", "Algo completamente distinto") == []
+
+    def test_matches_only_same_brand_size_and_mode(self, store):
+        """Otra marca con el mismo texto no recibe la generación guardada, ni otro tamaño o modo"""
+        text = "Recetas veganas fáciles para principiantes"
+        entry_id = store.record("text", text, {**finished_state(["A", "B"]), "brand": "marca-a", "draft": True})
+
+        assert [m["id"] for m in store.find_matches("text", text, brand="marca-a", n_ideas=2, draft=True)] == [entry_id]
+        assert store.find_matches("text", text, brand="marca-b") == []
+        assert store.find_matches("text", text) == []
+        assert store.find_matches("text", text, brand="marca-a", n_ideas=3) == []
+        assert store.find_matches("text", text, brand="marca-a", draft=False) == []
+
+    def test_max_entries(self):
+        """Se descartan las entradas más antiguas"""
+        store = HistoryStore(":memory:", max_entries=2)
+        ids = [store.record("text", f"entrada {i}", finished_state([f"T{i}"])) for i in range(3)]
+
+        assert store.get(ids[0]) is None
+        assert store.search("T0") == []
+        assert store.get(ids[2]) is not None
+
+    def test_normalize_input(self):
+        assert normalize_input("  Hola,   MUNDO! ") == "hola mundo"
+
+
+class TestHistoryEndpoints:
+    """Tests de integración con la generación"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_generation_is_recorded_and_reused(self, mock_llm, mock_client, store):
+        """Una generación se guarda y se reutiliza sin llamar a los modelos"""
+        from main import app
+        from shared_cache import prompt_store
+
+        def invoke(messages, **kwargs):
+            prompt = messages[0].content
+            if "ideas creativas" in prompt:
+                return Mock(content=json.dumps([{"title": "Batidos verdes", "description": "d"}]))
+            if "response_schema" in kwargs:
+                return Mock(content=json.dumps(COPY))
+            if "Analiza el siguiente texto" in prompt:
+                return Mock(content="Contexto de recetas veganas")
+            return Mock(content="A green smoothie")
+
+        mock_llm.invoke.side_effect = invoke
+        client = TestClient(app)
+        data = {"input_type": "text", "content": "Recetas veganas", "n_ideas": "1", "draft": "true"}
+
+        first = client.post("/api/generate-content", data=data)
+        history_id = first.json()["history_id"]
+        assert first.headers["x-history-id"] == str(history_id)
+
+        matches = client.post("/api/history/match", json={"input_type": "text", "content": "recetas  VEGANAS"}).json()
+        assert matches["matches"][0]["id"] == history_id
+        assert client.get("/api/history/search", params={"q": "batidos"}).json()["results"][0]["id"] == history_id
+
+        calls = mock_llm.invoke.call_count
+        prompt_store.clear()
+        reused = client.post("/api/generate-content", data={**data, "reuse_history": "true"})
+
+        assert mock_llm.invoke.call_count == calls
+        assert reused.json()["history_id"] == history_id
+        assert reused.json()["posts"] == [COPY]
+        prompt_id = reused.json()["visual_prompts"][0]["prompt_id"]
+        assert prompt_store.get(prompt_id) == "A green smoothie"
+
+        # Otra marca con el mismo texto genera de nuevo
+        other = client.post("/api/generate-content", data={**data, "reuse_history": "true", "brand": "otra-marca"})
+        assert mock_llm.invoke.call_count > calls
+        assert other.json()["history_id"] != history_id
+
+    def test_unknown_history_id(self, store):
+        from main import app
+
+        assert TestClient(app).get("/api/history/12345").status_code == 404
@@ -0,0 +1,244 @@
+"""
+Tests para la cola de imágenes y los workers de renderizado
+"""
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from contextvars import copy_context
+import pytest
+from unittest.mock import patch
+
+from deadline import current_deadline
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, current_priority, current_tenant
+
+from image_queue import STATUS_DONE, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, ImageJobQueue
+
+
+def claim_all(path, worker, results):
+    """Reclama trabajos desde otro proceso hasta vaciar la cola"""
+    queue = ImageJobQueue(path)
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            return
+        queue.complete(job["id"], worker, worker.encode())
+        results.put(job["id"])
+
+
+@pytest.fixture
+def queue(tmp_path):
+    now = [1000.0]
+    queue = ImageJobQueue(str(tmp_path / "queue.db"), lease_seconds=60, max_attempts=2, clock=lambda: now[0])
+    queue.now = now
+    return queue
+
+
+class TestImageJobQueue:
+    """Tests para los trabajos en SQLite"""
+
+    def test_enqueue_claim_complete(self, queue):
+        job_id = queue.enqueue("clave", "A vegan bowl")
+        # El mismo prompt pendiente se une al trabajo existente, salvo que se pida refrescar
+        assert queue.enqueue("clave", "A vegan bowl") == job_id
+        assert queue.enqueue("clave", "A vegan bowl", refresh=True) != job_id
+
+        job = queue.claim("w1")
+        assert (job["id"], job["status"], job["attempts"], job["worker"]) == (job_id, STATUS_RUNNING, 1, "w1")
+        assert queue.wait(job_id, timeout=0) is None
+
+        assert queue.complete(job_id, "w1", b"\x89PNG")
+        assert queue.wait(job_id, timeout=0)["result"] == b"\x89PNG"
+        assert queue.stats() == {STATUS_QUEUED: 1, STATUS_RUNNING: 0, STATUS_DONE: 1, STATUS_FAILED: 0}
+
+    def test_expired_lease_is_retried_then_failed(self, queue):
+        """Un trabajo de un worker caído vuelve a la cola hasta agotar los intentos"""
+        job_id = queue.enqueue("clave", "prompt")
+        queue.claim("caido")
+        assert queue.claim("w2") is None
+
+        queue.now[0] += 61
+        assert queue.claim("w2")["attempts"] == 2
+
+        queue.now[0] += 61
+        assert queue.claim("w3") is None
+        job = queue.get(job_id)
+        assert job["status"] == STATUS_FAILED and job["result"] is None
+
+    def test_stale_worker_result_is_dropped(self, queue):
+        """Un worker cuyo lease expiró y fue reclamado por otro no pisa el resultado del nuevo"""
+        job_id = queue.enqueue("clave", "prompt")
+        queue.claim("lento")
+        queue.now[0] += 61
+        assert queue.claim("w2")["worker"] == "w2"
+
+        assert queue.complete(job_id, "w2", b"nuevo")
+        assert not queue.complete(job_id, "lento", b"viejo")
+        job = queue.get(job_id)
+        assert (job["result"], job["worker"]) == (b"nuevo", "w2")
+
+    def test_claim_is_fair_across_tenants_and_priorities(self, tmp_path):
+        """Los workers reparten los trabajos por cliente y prioridad como el planificador, no por orden de llegada"""
+        path = str(tmp_path / "queue.db")
+        queue = ImageJobQueue(path, interactive_weight=2)
+        for i in range(5):
+            queue.enqueue(f"a{i}", "prompt", tenant="a", priority=PRIORITY_INTERACTIVE)
+        queue.enqueue("b0", "prompt", tenant="b", priority=PRIORITY_INTERACTIVE)
+        for i in range(2):
+            queue.enqueue(f"c{i}", "prompt", tenant="c", priority=PRIORITY_BATCH)
+
+        # El estado del reparto vive en el archivo: cada reclamo usa otra conexión, como otro worker
+        claimed = [ImageJobQueue(path, interactive_weight=2).claim(f"w{i}")["key"] for i in range(8)]
+        assert claimed == ["a0", "a1", "b0", "c0", "a2", "a3", "c1", "a4"]
+
+    def test_job_keeps_tenant_and_priority_of_its_request(self, queue):
+        def enqueue():
+            current_tenant.set("10.0.0.1")
+            current_priority.set(PRIORITY_BATCH)
+            return queue.enqueue("clave", "prompt")
+
+        job = queue.get(copy_context().run(enqueue))
+        assert (job["tenant"], job["priority"]) == ("10.0.0.1", PRIORITY_BATCH)
+
+    def test_old_queue_file_is_migrated(self, tmp_path):
+        """Un archivo de cola sin cliente ni prioridad se actualiza y sus trabajos se siguen sirviendo"""
+        path = str(tmp_path / "queue.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "CREATE TABLE jobs (id TEXT PRIMARY KEY, key TEXT NOT NULL, prompt TEXT NOT NULL, refresh INTEGER NOT NULL, "
+                "status TEXT NOT NULL, result BLOB, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+                "leased_until REAL, created_at REAL NOT NULL, finished_at REAL)"
+            )
+            conn.execute("INSERT INTO jobs (id, key, prompt, refresh, status, created_at) VALUES ('viejo', 'clave', 'prompt', 0, ?, 1)", (STATUS_QUEUED,))
+        queue = ImageJobQueue(path)
+
+        job = queue.claim("w1")
+        assert (job["id"], job["tenant"], job["priority"]) == ("viejo", "anonymous", PRIORITY_INTERACTIVE)
+
+    def test_estimated_wait_from_backlog(self, tmp_path):
+        queue = ImageJobQueue(str(tmp_path / "queue.db"), worker_slots=2, expected_call_seconds=10)
+        for i in range(3):
+            queue.enqueue(f"clave{i}", "prompt")
+        assert queue.estimated_wait() == 10.0
+
+        # Los trabajos en curso también van por delante
+        queue.complete(queue.claim("w1")["id"], "w1", b"\x89PNG")
+        queue.claim("w2")
+        assert queue.estimated_wait() == 5.0
+        queue.complete(queue.claim("w3")["id"], "w3", b"\x89PNG")
+        assert queue.estimated_wait() == 0.0
+
+    def test_purge_finished_jobs(self, queue):
+        job_id = queue.enqueue("clave", "prompt")
+        queue.complete(queue.claim("w1")["id"], "w1", None, "sin imagen")
+        assert queue.purge() == 0
+
+        queue.now[0] += queue.retention_seconds + 1
+        assert queue.purge() == 1 and queue.get(job_id) is None
+
+    def test_each_job_claimed_once_across_processes(self, tmp_path):
+        path = str(tmp_path / "queue.db")
+        queue = ImageJobQueue(path)
+        job_ids = {queue.enqueue(f"clave{i}", f"prompt {i}") for i in range(30)}
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [context.Process(target=claim_all, args=(path, f"w{i}", results)) for i in range(3)]
+        for worker in workers:
+            worker.start()
+        claimed = [results.get(timeout=30) for _ in job_ids]
+        for worker in workers:
+            worker.join(30)
+            assert worker.exitcode == 0
+
+        assert sorted(claimed) == sorted(job_ids)
+        assert queue.stats()[STATUS_DONE] == 30
+
+
+class TestImageWorker:
+    """Tests de integración entre la API y el worker"""
+
+    @patch('image_render.request_provider_image', return_value=b"\x89PNG render")
+    def test_api_waits_for_worker_render(self, mock_provider, tmp_path, monkeypatch):
+        """En modo cola la API encola, el worker llama al proveedor y la imagen llega a la API"""
+        import main
+        from image_worker import run_worker
+
+        path = str(tmp_path / "queue.db")
+        monkeypatch.setattr("main.IMAGE_RENDERING", "queue")
+        monkeypatch.setattr("main.image_job_queue", ImageJobQueue(path))
+        # El worker usa su propia conexión al mismo archivo, como otro proceso
+        worker_queue = ImageJobQueue(path)
+        stop = threading.Event()
+        worker = threading.Thread(target=run_worker, args=(worker_queue, 1, stop), daemon=True)
+        worker.start()
+        try:
+            assert main.generate_image_with_imagen("A vegan bowl") == b"\x89PNG render"
+            # La segunda vez sale de la caché sin pasar por la cola
+            assert main.generate_image_with_imagen("A vegan bowl") == b"\x89PNG render"
+        finally:
+            stop.set()
+            worker.join(10)
+
+        assert mock_provider.call_count == 1
+        assert worker_queue.stats()[STATUS_DONE] == 1
+
+    @patch('image_render.render_with_provider', return_value=None)
+    def test_no_image_from_worker_gives_placeholder(self, mock_render, tmp_path, monkeypatch):
+        import main
+        from image_worker import run_worker
+
+        queue = ImageJobQueue(str(tmp_path / "queue.db"))
+        monkeypatch.setattr("main.IMAGE_RENDERING", "queue")
+        monkeypatch.setattr("main.image_job_queue", queue)
+        stop = threading.Event()
+        worker = threading.Thread(target=run_worker, args=(queue, 1, stop), daemon=True)
+        worker.start()
+        try:
+            image = main.generate_image_with_imagen("A vegan bowl")
+        finally:
+            stop.set()
+            worker.join(10)
+
+        assert image is not None and image.startswith(b"\x89PNG")
+        assert queue.stats()[STATUS_DONE] == 1
+        # Un trabajo terminado sin imagen no se reutiliza: el siguiente request lo vuelve a intentar
+        job = queue.get(queue.enqueue(main.visual_prompt_id("A vegan bowl"), "A vegan bowl"))
+        assert job["status"] == STATUS_QUEUED
+
+    def test_worker_does_not_load_the_api(self):
+        """El worker solo necesita las claves de imágenes y no abre las bases de datos de la API"""
+        backend = os.path.join(os.path.dirname(__file__), "..", "..", "backend")
+        env = {name: value for name, value in os.environ.items() if not name.startswith("GEMINI_TEXT_API_KEY")}
+        env["GEMINI_IMAGE_API_KEY"] = "clave"
+        loaded = subprocess.run(
+            [sys.executable, "-c", "import sys, image_worker; print(sorted(set(sys.modules) & {'main', 'sessions', 'history', 'knowledge'}))"],
+            cwd=backend, env=env, capture_output=True, text=True, timeout=60
+        )
+        assert loaded.returncode == 0, loaded.stderr
+        assert loaded.stdout.strip() == "[]"
+
+    def test_render_deadline_within_lease(self, queue):
+        """El render termina antes que el lease y su resultado se descarta si otro worker tomó el trabajo"""
+        from image_worker import IMAGE_WORKER_LEASE_MARGIN_SECONDS, process_job
+
+        job_id = queue.enqueue("clave", "prompt", refresh=True, tenant="cliente")
+        job = queue.claim("lento")
+        deadlines, tenants = [], []
+
+        def slow_render(prompt, key):
+            deadlines.append(current_deadline.get())
+            tenants.append(current_tenant.get())
+            # Mientras renderiza, el lease expira y otro worker termina el trabajo
+            queue.now[0] += 61
+            queue.complete(queue.claim("w2")["id"], "w2", b"nuevo")
+            return b"viejo"
+
+        with patch('image_render.render_with_provider', side_effect=slow_render):
+            process_job(queue, job)
+
+        assert deadlines == [job["leased_until"] - IMAGE_WORKER_LEASE_MARGIN_SECONDS]
+        # Los huecos de imagen del worker se reparten por el cliente del trabajo
+        assert tenants == ["cliente"] and current_tenant.get() == "anonymous"
+        assert queue.get(job_id)["result"] == b"nuevo"
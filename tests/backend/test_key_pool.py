@@ -0,0 +1,164 @@
+"""
+Tests para el pool de claves de API
+"""
+import pytest
+from unittest.mock import Mock
+
+from key_pool import KeyPool, is_throttle_error, parse_keys
+
+
+class QuotaExceeded(Exception):
+    """Error del proveedor con código HTTP, como los de google.api_core"""
+    code = 429
+
+
+def make_pool(keys=("a", "b"), **kwargs):
+    now = [100.0]
+    pool = KeyPool("text", list(keys), lambda key: f"cliente-{key}", clock=lambda: now[0], **kwargs)
+    pool.now = now
+    return pool
+
+
+class TestKeyPool:
+    """Tests para la selección de claves y el enfriamiento"""
+
+    def test_parse_keys(self):
+        assert parse_keys(" a, b ,,a", "x") == ["a", "b"]
+        assert parse_keys(None, "x") == ["x"]
+        assert parse_keys("", None) == []
+
+    def test_least_loaded_key(self):
+        """Se elige la clave con menos llamadas en curso y, a igualdad, la que lleva más tiempo sin usarse"""
+        pool = make_pool()
+
+        with pool.lease() as first:
+            pool.now[0] += 1
+            with pool.lease() as second:
+                assert {first.client, second.client} == {"cliente-a", "cliente-b"}
+                assert pool.snapshot()["keys"][0]["in_flight"] == 1
+        pool.now[0] += 1
+        with pool.lease() as third:
+            assert third.key == first.key
+
+        assert [key["calls"] for key in pool.snapshot()["keys"]] == [2, 1]
+
+    def test_throttled_key_cools_down(self):
+        """Un 429 saca la clave de la rotación, cada vez durante más tiempo"""
+        pool = make_pool(cooldown_seconds=60, max_cooldown_seconds=100)
+
+        with pytest.raises(QuotaExceeded):
+            with pool.lease() as entry:
+                assert entry.key == "a"
+                raise QuotaExceeded("quota")
+        assert pool.snapshot()["keys"][0]["cooldown_remaining_s"] == 60
+        for _ in range(3):
+            with pool.lease() as entry:
+                assert entry.key == "b"
+
+        pool.now[0] += 60
+        # De vuelta en la rotación pierde el desempate frente a la clave sin 429
+        with pool.lease() as entry:
+            assert entry.key == "b"
+            with pytest.raises(QuotaExceeded):
+                with pool.lease() as retried:
+                    assert retried.key == "a"
+                    raise QuotaExceeded("quota")
+        assert pool.snapshot()["keys"][0]["cooldown_remaining_s"] == 100
+
+        snapshot = pool.snapshot()
+        assert snapshot["available"] == 1
+        assert snapshot["keys"][0]["throttles"] == 2 and snapshot["keys"][1]["throttles"] == 0
+
+    def test_all_keys_cooling_uses_first_back(self):
+        pool = make_pool(cooldown_seconds=60)
+        for _ in range(2):
+            with pytest.raises(QuotaExceeded):
+                with pool.lease():
+                    pool.now[0] += 1
+                    raise QuotaExceeded("quota")
+
+        assert pool.available() == 0
+        with pool.lease() as entry:
+            assert entry.key == "a"
+
+    def test_other_errors_do_not_cool_down(self):
+        pool = make_pool()
+        with pytest.raises(RuntimeError):
+            with pool.lease():
+                raise RuntimeError("timeout")
+
+        assert pool.available() == 2
+        assert pool.snapshot()["keys"][0]["errors"] == 1
+
+    def test_throttle_detection(self):
+        assert is_throttle_error(QuotaExceeded())
+        assert is_throttle_error(Exception("429 RESOURCE_EXHAUSTED. Quota exceeded"))
+        assert not is_throttle_error(Exception("500 internal"))
+
+    def test_single_key_creates_no_client(self):
+        factory = Mock()
+        pool = KeyPool("image", ["solo"], factory)
+        with pool.lease() as entry:
+            assert entry.client is None
+        factory.assert_not_called()
+
+
+class TestProviderCallsUseThePool:
+    """Tests de integración con las llamadas al modelo de texto"""
+
+    def test_throttled_key_skipped_on_next_call(self, monkeypatch):
+        """Tras un 429 en una clave, las siguientes llamadas van por la otra"""
+        from main import app, generate_visual_prompt
+        from fastapi.testclient import TestClient
+
+        throttled, healthy = Mock(), Mock()
+        throttled.invoke.side_effect = QuotaExceeded("quota")
+        healthy.invoke.return_value = Mock(content="A vegan bowl")
+        clients = {"a": throttled, "b": healthy}
+        monkeypatch.setattr("main.text_key_pool", KeyPool("text", ["a", "b"], clients.get))
+        idea = {"title": "Bowl", "description": "d"}
+
+        with pytest.raises(QuotaExceeded):
+            generate_visual_prompt(idea, "contexto")
+        for _ in range(3):
+            assert generate_visual_prompt(idea, "contexto") == "A vegan bowl"
+
+        assert throttled.invoke.call_count == 1 and healthy.invoke.call_count == 3
+        health = TestClient(app).get("/api/health").json()
+        assert health["key_pools"]["text"]["available"] == 1
+        assert [key["calls"] for key in health["key_pools"]["text"]["keys"]] == [1, 3]
+
+    def test_throttle_not_retried_on_the_same_key(self, monkeypatch):
+        """Un 429 del modelo real sale al primer intento, sin reintentos internos de langchain en la misma clave"""
+        from google.api_core.exceptions import ResourceExhausted
+        from main import chat_model, generate_visual_prompt
+
+        throttled, healthy = chat_model("a"), Mock()
+        monkeypatch.setattr(throttled.client, "generate_content", Mock(side_effect=ResourceExhausted("quota")))
+        healthy.invoke.return_value = Mock(content="A vegan bowl")
+        clients = {"a": throttled, "b": healthy}
+        monkeypatch.setattr("main.text_key_pool", KeyPool("text", ["a", "b"], clients.get))
+        idea = {"title": "Bowl sin reintentos", "description": "d"}
+
+        with pytest.raises(ResourceExhausted):
+            generate_visual_prompt(idea, "contexto")
+        assert generate_visual_prompt(idea, "contexto") == "A vegan bowl"
+
+        assert throttled.client.generate_content.call_count == 1
+
+    def test_image_context_uses_pooled_key(self, monkeypatch, sample_image):
+        """El análisis de imágenes también pasa por el pool de claves y el planificador"""
+        from main import process_image_context, text_scheduler
+
+        clients = {"a": Mock(), "b": Mock()}
+        for client in clients.values():
+            client.invoke.return_value = Mock(content="Una taza de café")
+        pool = KeyPool("text", ["a", "b"], clients.get)
+        monkeypatch.setattr("main.text_key_pool", pool)
+        calls = text_scheduler.snapshot()["tenants"].get("anonymous", {}).get("calls", 0)
+
+        assert process_image_context(sample_image + b"pool") == "Una taza de café"
+
+        assert sum(client.invoke.call_count for client in clients.values()) == 1
+        assert sum(key["calls"] for key in pool.snapshot()["keys"]) == 1
+        assert text_scheduler.snapshot()["tenants"]["anonymous"]["calls"] == calls + 1
@@ -0,0 +1,189 @@
+"""
+Tests para la base de conocimiento de marca (RAG local)
+"""
+import json
+import numpy as np
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+from knowledge import HashedTfidf, KnowledgeBase, VectorIndex, chunk_text, enrich_context, tokenize
+
+VEGAN = "Nuestra marca vende batidos veganos de espinaca y mango sin azúcar añadido para deportistas"
+COFFEE = "Cafetería de especialidad con granos de Etiopía tostados cada semana en Madrid"
+YOGA = "Clases de yoga al amanecer en la playa con meditación guiada y respiración consciente"
+
+
+@pytest.fixture
+def base(monkeypatch):
+    """Base de conocimiento vacía en memoria, también para los endpoints"""
+    base = KnowledgeBase(":memory:")
+    monkeypatch.setattr("main.knowledge_base", base)
+    return base
+
+
+class TestEmbedding:
+    """Tests para el troceado y el embedding TF-IDF con hashing"""
+
+    def test_chunks_overlap(self):
+        """Las ventanas comparten `overlap` palabras y cubren todo el texto"""
+        words = [f"p{i}" for i in range(25)]
+        chunks = chunk_text(" ".join(words), words=10, overlap=3)
+
+        assert chunks[0].split() == words[:10]
+        assert chunks[1].split()[:3] == words[7:10]
+        assert chunks[-1].split()[-1] == "p24"
+        assert chunk_text("   ") == []
+
+    def test_embedding_is_unit_and_accent_insensitive(self):
+        """Vectores unitarios, deterministas e independientes de acentos y mayúsculas"""
+        embedder = HashedTfidf(64)
+        vectors = embedder.embed(["Azúcar AÑADIDO", "azucar anadido", ""])
+
+        assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+        assert np.allclose(vectors[0], vectors[1])
+        assert not vectors[2].any()
+        assert tokenize("Él y yo, 2 cafés") == ["el", "yo", "cafes"]
+
+
+class TestVectorIndex:
+    """Tests para el índice NumPy"""
+
+    def test_growth_brand_filter_and_removal(self):
+        """El índice crece, filtra por marca y olvida los vectores borrados"""
+        index = VectorIndex(4, capacity=2)
+        basis = np.eye(4, dtype=np.float32)
+        index.add([10, 11, 12], basis[:3], brand_code=0)
+        index.add([20], basis[3:], brand_code=1)
+
+        assert index.size == 4
+        assert index.search(basis[1:2], 2)[0] == [(11, 1.0)]
+        assert index.search(basis[3:4], 1, brand_code=0)[0] == []
+        assert index.search(basis[3:4], 1, brand_code=1)[0] == [(20, 1.0)]
+
+        index.remove([11])
+        assert index.search(basis[1:2], 2)[0] == []
+        assert index.live == 3
+
+    def test_batched_search_matches_single(self):
+        """La búsqueda por lotes devuelve lo mismo que las búsquedas individuales"""
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(500, 32)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = VectorIndex(32)
+        index.add(range(500), vectors, brand_code=0)
+
+        batch = index.search(vectors[:5], 3)
+        assert [hits[0][0] for hits in batch] == [0, 1, 2, 3, 4]
+        singles = [index.search(vectors[i:i + 1], 3)[0] for i in range(5)]
+        assert [[chunk_id for chunk_id, _ in hits] for hits in batch] == [[chunk_id for chunk_id, _ in hits] for hits in singles]
+        assert [score for hits in batch for _, score in hits] == pytest.approx([score for hits in singles for _, score in hits])
+
+    def test_sparse_query_matches_full_product(self, monkeypatch):
+        """Puntuar solo las dimensiones de la consulta da el mismo ranking que el producto completo"""
+        rng = np.random.default_rng(2)
+        vectors = np.abs(rng.normal(size=(300, 48))).astype(np.float32)
+        index = VectorIndex(48)
+        index.add(range(300), vectors / np.linalg.norm(vectors, axis=1, keepdims=True), brand_code=0)
+        query = np.zeros((1, 48), dtype=np.float32)
+        query[0, [3, 17, 40]] = [0.5, 0.7, 0.5]
+
+        sparse = index.search(query, 5)
+        monkeypatch.setattr("knowledge.SPARSE_QUERY_MAX_FRACTION", 0)
+        assert [chunk_id for chunk_id, _ in index.search(query, 5)[0]] == [chunk_id for chunk_id, _ in sparse[0]]
+
+    def test_snapshot_unaffected_by_later_adds(self):
+        """Una búsqueda sobre una instantánea no ve lo añadido después, aunque el índice crezca"""
+        from knowledge import search_snapshot
+
+        index = VectorIndex(4, capacity=1)
+        basis = np.eye(4, dtype=np.float32)
+        index.add([1], basis[:1], brand_code=0)
+        snapshot = index.snapshot(0)
+        index.add([2, 3], basis[1:3], brand_code=0)
+
+        assert search_snapshot(snapshot, basis[1:2], 1) == [[]]
+        assert index.search(basis[1:2], 1) == [[(2, 1.0)]]
+
+
+class TestKnowledgeBase:
+    """Tests para el almacén persistente"""
+
+    def test_relevant_chunk_ranks_first(self, base):
+        """El documento relacionado con la consulta sale primero"""
+        for text in (VEGAN, COFFEE, YOGA):
+            base.add_document(text)
+
+        hits = base.search("batidos de mango para deportistas")
+
+        assert hits[0]["text"] == VEGAN
+        assert hits[0]["score"] > 0.3
+        assert base.search("meditación en la playa", k=1)[0]["text"] == YOGA
+
+    def test_brand_namespaces_and_delete(self, base):
+        """Cada marca busca en sus documentos y los borrados desaparecen"""
+        coffee = base.add_document(COFFEE, brand="cafe")
+        base.add_document(VEGAN, brand="batidos")
+
+        assert base.search("granos tostados", brand="batidos") == []
+        assert base.search("granos tostados", brand="cafe")[0]["text"] == COFFEE
+        assert base.search("granos", brand="otra") == []
+
+        assert base.delete_document(coffee["document_id"])
+        assert base.search("granos tostados", brand="cafe") == []
+        assert not base.delete_document(coffee["document_id"])
+
+    def test_reloads_from_disk(self, tmp_path):
+        """Los vectores guardados se cargan de nuevo al arrancar"""
+        path = str(tmp_path / "knowledge.db")
+        KnowledgeBase(path).add_document(YOGA, source="post", title="Post de yoga")
+
+        reloaded = KnowledgeBase(path)
+
+        hit = reloaded.search("yoga al amanecer")[0]
+        assert (hit["text"], hit["source"], hit["title"]) == (YOGA, "post", "Post de yoga")
+        assert reloaded.stats()["chunks"] == 1
+
+    def test_enrich_context_threshold(self):
+        hits = [{"text": "relevante", "score": 0.5}, {"text": "ruido", "score": 0.01}]
+        enriched = enrich_context("Contexto", hits, min_score=0.1)
+        assert enriched.startswith("Contexto\n\n") and "- relevante" in enriched and "ruido" not in enriched
+        assert enrich_context("Contexto", hits[1:], min_score=0.1) == "Contexto"
+
+
+class TestKnowledgeEndpoints:
+    """Tests de integración con la API"""
+
+    @patch('main.llm')
+    def test_ingested_knowledge_enriches_ideas(self, mock_llm, base):
+        """Los fragmentos recuperados llegan al prompt de ideas de la marca"""
+        from main import app
+
+        mock_llm.invoke.return_value = Mock(content=json.dumps([{"title": "Batido", "description": "d"}]))
+        client = TestClient(app)
+
+        added = client.post("/api/knowledge/documents", json={"text": VEGAN, "brand": "batidos"}).json()
+        assert added["chunks"] == 1
+        client.post("/api/stages/ideas", json={"context": "batidos veganos de mango", "n_ideas": 1, "brand": "batidos"})
+        prompt = mock_llm.invoke.call_args.args[0][0].content
+        assert "Conocimiento de la marca relevante" in prompt and "espinaca y mango" in prompt
+
+        client.post("/api/stages/ideas", json={"context": "batidos veganos de mango", "n_ideas": 1, "brand": "otra"})
+        assert "Conocimiento de la marca" not in mock_llm.invoke.call_args.args[0][0].content
+
+    @patch('main.requests.get')
+    def test_page_ingestion_and_validation(self, mock_get, base):
+        """Las páginas se descargan y se guardan como source=page"""
+        from main import app
+
+        mock_get.return_value = Mock(content=f"<html><body><p>{COFFEE}</p></body></html>".encode())
+        client = TestClient(app)
+
+        response = client.post("/api/knowledge/documents", json={"url": "https://cafe.example"})
+        assert response.status_code == 200
+        hit = client.get("/api/knowledge/search", params={"q": "café de Etiopía"}).json()["results"][0]
+        assert (hit["source"], hit["title"]) == ("page", "https://cafe.example")
+
+        assert client.post("/api/knowledge/documents", json={}).status_code == 400
+        assert client.post("/api/knowledge/documents", json={"text": "x", "source": "tweet"}).status_code == 400
+        assert client.delete("/api/knowledge/documents/999").status_code == 404
@@ -0,0 +1,117 @@
+"""
+Tests para la medición de memoria por request y el modo de baja memoria
+"""
+import base64
+import json
+import tracemalloc
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+import memory
+import profiling
+
+
+@pytest.fixture
+def memory_tracking(monkeypatch):
+    """Activa tracemalloc solo durante el test"""
+    monkeypatch.setattr(memory, "MEMORY_TRACKING", True)
+    yield
+    tracemalloc.stop()
+
+
+def workflow_state(image_bytes):
+    return {
+        "context": "Contexto",
+        "ideas": [{"title": f"Idea {i}", "description": f"Descripción {i}"} for i in range(2)],
+        "posts": [{"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]} for _ in range(2)],
+        "visual_prompts": [
+            {"description": "Prompt con imagen", "image_data": image_bytes},
+            {"description": "Prompt sin imagen", "image_data": None},
+        ],
+        "error": None,
+    }
+
+
+class TestMemoryTracker:
+    """Tests para MemoryTracker"""
+
+    def test_peak_covers_allocations(self, memory_tracking):
+        """El pico refleja lo reservado durante el request"""
+        tracker = memory.MemoryTracker("a" * 32, "text", "standard")
+        tracker.start()
+        buffer = bytearray(4 * 1024 * 1024)
+        peak = tracker.stop()
+        del buffer
+
+        assert peak >= 4 * 1024 * 1024
+        assert memory.recent_requests[-1]["request_id"] == "a" * 32
+        # Una segunda llamada no vuelve a registrar la medición
+        assert tracker.stop() == peak
+
+    def test_disabled_tracking_is_noop(self, monkeypatch):
+        """Sin MEMORY_TRACKING no se arranca tracemalloc"""
+        monkeypatch.setattr(memory, "MEMORY_TRACKING", False)
+        tracker = memory.MemoryTracker("b" * 32, "text", "standard")
+        tracker.start()
+
+        assert tracker.stop() is None
+        assert not tracemalloc.is_tracing()
+
+
+class TestLowMemoryStreaming:
+    """Tests para la escritura incremental del cuerpo JSON"""
+
+    def test_stream_matches_content_response(self, sample_image):
+        """El JSON por fragmentos es válido y libera las imágenes del estado"""
+        from main import stream_content_response
+        from metrics import RequestTimings
+
+        state = workflow_state(sample_image)
+        tracker = memory.MemoryTracker("c" * 32, "text", "low_memory")
+        body = b"".join(stream_content_response(state, "Contexto", RequestTimings(), tracker))
+        data = json.loads(body)
+
+        assert [idea["title"] for idea in data["ideas"]] == ["Idea 0", "Idea 1"]
+        assert data["posts"][0]["hashtags"] == ["#test"]
+        assert data["context_summary"] == "Contexto"
+        assert data["visual_prompts"][1] == {"description": "Prompt sin imagen", "prompt_id": None, "image_url": None}
+        prefix, encoded = data["visual_prompts"][0]["image_url"].split(",", 1)
+        assert prefix == "data:image/png;base64"
+        assert base64.b64decode(encoded) == sample_image
+        assert state["visual_prompts"] == [None, None]
+
+    @patch('main.content_workflow')
+    @patch('main.process_text_context', return_value="Contexto")
+    def test_low_memory_endpoint(self, mock_context, mock_workflow, sample_image):
+        """low_memory=true devuelve el mismo contenido en streaming"""
+        from main import app
+
+        mock_workflow.invoke.return_value = workflow_state(sample_image)
+
+        response = TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas", "low_memory": "true"}
+        )
+
+        assert response.status_code == 200
+        assert "server-timing" in response.headers
+        data = response.json()
+        assert len(data["visual_prompts"]) == 2
+        assert data["timings"]["total_ms"] > 0
+
+
+class TestMemoryDebugEndpoint:
+    """Tests para /api/debug/memory"""
+
+    def test_requires_admin_token(self, monkeypatch):
+        """El endpoint de diagnóstico exige el token de administración"""
+        from main import app
+
+        monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", "secreto")
+        client = TestClient(app)
+
+        assert client.get("/api/debug/memory").status_code == 403
+        response = client.get("/api/debug/memory", headers={"X-Profile-Token": "secreto"})
+        assert response.status_code == 200
+        assert "recent_requests" in response.json()
@@ -0,0 +1,206 @@
+"""
+Tests para la instrumentación Prometheus del pipeline
+"""
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+
+def sample(name, **labels):
+    """Valor actual de una muestra del registro (0 si aún no existe)"""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestObserveHelpers:
+    """Tests para los context managers de medición"""
+
+    def test_observe_call_ok(self):
+        """Una llamada sin incidencias se registra con outcome=ok"""
+        from metrics import observe_call
+
+        labels = dict(operation="test_op_ok", model="m", outcome="ok", input_type="unknown")
+        before = sample("cm_provider_call_duration_seconds_count", **labels)
+
+        with observe_call("test_op_ok", "m"):
+            pass
+
+        assert sample("cm_provider_call_duration_seconds_count", **labels) == before + 1
+
+    def test_observe_call_fallback_counts_fallback(self):
+        """Marcar fallback etiqueta la latencia y suma al contador de fallbacks"""
+        from metrics import observe_call
+
+        before = sample("cm_fallbacks_total", operation="test_op_fb", input_type="unknown")
+
+        with observe_call("test_op_fb", "m") as obs:
+            obs.fallback()
+
+        assert sample("cm_fallbacks_total", operation="test_op_fb", input_type="unknown") == before + 1
+        assert sample(
+            "cm_provider_call_duration_seconds_count",
+            operation="test_op_fb", model="m", outcome="fallback", input_type="unknown"
+        ) >= 1
+
+    def test_observe_call_exception_is_error(self):
+        """Las excepciones se registran con outcome=error y se propagan"""
+        from metrics import observe_call
+
+        with pytest.raises(RuntimeError):
+            with observe_call("test_op_err", "m"):
+                raise RuntimeError("boom")
+
+        assert sample(
+            "cm_provider_call_duration_seconds_count",
+            operation="test_op_err", model="m", outcome="error", input_type="unknown"
+        ) == 1
+
+    def test_input_type_label(self):
+        """El tipo de entrada del request actual se usa como etiqueta"""
+        from metrics import observe_call, current_input_type
+
+        token = current_input_type.set("guided")
+        try:
+            with observe_call("test_op_input", "m"):
+                pass
+        finally:
+            current_input_type.reset(token)
+
+        assert sample(
+            "cm_provider_call_duration_seconds_count",
+            operation="test_op_input", model="m", outcome="ok", input_type="guided"
+        ) == 1
+
+
+class TestPipelineInstrumentation:
+    """Tests de instrumentación sobre las funciones del pipeline"""
+
+    @patch('main.llm')
+    def test_generate_ideas_fallback_is_counted(self, mock_llm):
+        """El fallback de generate_ideas queda contabilizado"""
+        from main import generate_ideas
+
+        mock_llm.invoke.return_value = Mock(content="respuesta no válida como JSON")
+        before = sample("cm_fallbacks_total", operation="generate_ideas", input_type="unknown")
+
+        generate_ideas("contexto de prueba")
+
+        assert sample("cm_fallbacks_total", operation="generate_ideas", input_type="unknown") == before + 1
+
+    @patch('image_render.client')
+    def test_placeholder_image_bytes_are_counted(self, mock_client):
+        """Las imágenes placeholder suman bytes y cuentan como fallback"""
+        from main import generate_image_with_imagen
+
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+        before = sample("cm_image_bytes_total", source="placeholder")
+
+        image_data = generate_image_with_imagen("a vegan bowl")
+
+        assert image_data.startswith(b"\x89PNG")
+        assert sample("cm_image_bytes_total", source="placeholder") == before + len(image_data)
+
+    @patch('main.generate_image_with_imagen', return_value=b"png")
+    @patch('main.generate_visual_prompt', return_value="Visual prompt")
+    @patch('main.generate_copy')
+    @patch('main.generate_ideas')
+    def test_workflow_nodes_are_timed(self, mock_ideas, mock_copy, mock_visual, mock_image):
+        """Cada nodo del workflow registra su latencia"""
+        from main import create_content_workflow
+
+        mock_ideas.return_value = [{"title": "Idea 1", "description": "Desc 1"}]
+        mock_copy.return_value = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+        before = sample(
+            "cm_workflow_node_duration_seconds_count",
+            node="generate_posts", model="gemini-2.5-flash", outcome="ok", input_type="unknown"
+        )
+
+        create_content_workflow().invoke({
+            "context": "contexto", "ideas": [], "posts": [], "visual_prompts": [], "error": None
+        })
+
+        assert sample(
+            "cm_workflow_node_duration_seconds_count",
+            node="generate_posts", model="gemini-2.5-flash", outcome="ok", input_type="unknown"
+        ) == before + 1
+
+
+class TestMetricsEndpoint:
+    """Tests para el endpoint /metrics"""
+
+    def test_metrics_endpoint_exposes_pipeline_metrics(self):
+        """/metrics devuelve el formato de texto de Prometheus"""
+        from main import app
+
+        response = TestClient(app).get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "cm_provider_call_duration_seconds" in response.text
+        assert "cm_requests_in_flight" in response.text
+
+
+class TestRequestTimings:
+    """Tests para el desglose de tiempos por request"""
+
+    def test_server_timing_header_numbers_repeated_calls(self):
+        """Las llamadas repetidas se numeran y se añade el total"""
+        from metrics import RequestTimings, current_timings, observe_call, observe_node
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            with observe_node("generate_posts", "m"):
+                for _ in range(2):
+                    with observe_call("generate_copy", "m") as obs:
+                        obs.fallback()
+        finally:
+            current_timings.reset(token)
+
+        header = timings.server_timing_header()
+        assert "node.generate_posts;dur=" in header
+        assert "call.generate_copy;dur=" in header
+        assert "call.generate_copy.2;dur=" in header
+        assert header.split(", ")[-1].startswith("total;dur=")
+
+        summary = timings.as_dict()
+        assert [stage["name"] for stage in summary["stages"]] == ["generate_posts", "generate_copy", "generate_copy"]
+        assert summary["llm_calls"] == 2
+        assert summary["fallbacks"] == 2
+        assert summary["cache_hits"] == 0
+
+    def test_no_collection_outside_requests(self):
+        """Sin request activo no se acumula nada"""
+        from metrics import current_timings, observe_call
+
+        with observe_call("generate_copy", "m"):
+            pass
+
+        assert current_timings.get() is None
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_generate_content_returns_timings(self, mock_llm, mock_client):
+        """El endpoint devuelve Server-Timing y el campo timings"""
+        from main import app
+
+        mock_llm.invoke.return_value = Mock(content="respuesta sin JSON")
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+
+        response = TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas fáciles"}
+        )
+
+        assert response.status_code == 200
+        header = response.headers["server-timing"]
+        assert "call.process_text_context;dur=" in header
+        assert "node.generate_visuals;dur=" in header
+        assert "call.image_provider_call.5;dur=" in header
+
+        timings = response.json()["timings"]
+        # contexto + ideas + 5 copies + 5 prompts visuales + 5 imágenes
+        assert timings["llm_calls"] == 17
+        # ideas + 5 copies + 5 placeholders
+        assert timings["fallbacks"] == 11
+        assert timings["total_ms"] > 0
@@ -0,0 +1,163 @@
+"""
+Tests para el número de ideas configurable y la continuación "más ideas"
+"""
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+
+
+def ideas_json(*titles):
+    return json.dumps([{"title": title, "description": f"Sobre {title}"} for title in titles])
+
+
+def scripted_llm(*ideas_responses):
+    """Contexto, listas de ideas en orden, copies y prompts visuales según la llamada"""
+    queue = list(ideas_responses)
+
+    def invoke(messages, **kwargs):
+        prompt = messages[0].content
+        if "ideas creativas" in prompt:
+            return Mock(content=queue.pop(0))
+        if "response_schema" in kwargs:
+            return Mock(content=json.dumps(COPY))
+        if "Analiza el siguiente texto" in prompt:
+            return Mock(content="Contexto de recetas veganas")
+        return Mock(content="A vegan bowl")
+    return invoke
+
+
+class TestIdeaCount:
+    """Tests para n_ideas en las funciones de generación"""
+
+    @patch('main.llm')
+    def test_generate_two_ideas(self, mock_llm):
+        """Se piden y se devuelven exactamente n ideas"""
+        from main import generate_ideas
+
+        mock_llm.invoke.return_value = Mock(content=ideas_json("Batidos", "Pasta", "Tacos"))
+
+        ideas = generate_ideas("contexto", n_ideas=2)
+
+        assert [idea["title"] for idea in ideas] == ["Batidos", "Pasta"]
+        schema = mock_llm.invoke.call_args.kwargs["response_schema"]
+        assert schema["minItems"] == schema["maxItems"] == 2
+        assert "exactamente 2 ideas" in mock_llm.invoke.call_args.args[0][0].content
+
+    @patch('main.llm')
+    def test_repeated_titles_are_replaced(self, mock_llm):
+        """Las ideas ya propuestas se descartan y se completan con plantillas nuevas"""
+        from main import generate_ideas
+
+        mock_llm.invoke.return_value = Mock(content=ideas_json("Batidos", "pasta  ", "Tacos"))
+
+        ideas = generate_ideas("veganos", n_ideas=3, exclude_titles=["Pasta"])
+
+        titles = [idea["title"] for idea in ideas]
+        assert titles[:2] == ["Batidos", "Tacos"]
+        assert len(titles) == 3 and "Pasta" not in titles
+        prompt = mock_llm.invoke.call_args.args[0][0].content
+        assert "- Pasta" in prompt
+
+    def test_fallback_ideas_scale_and_stay_unique(self):
+        """Las ideas de plantilla cubren cualquier n sin repetir títulos"""
+        from main import fallback_ideas
+
+        assert len(fallback_ideas("veganos", 1)) == 1
+        ideas = fallback_ideas("veganos", 12, exclude_titles=["Guía completa de veganos"])
+        titles = [idea["title"] for idea in ideas]
+        assert len(titles) == 12 == len(set(titles))
+        assert "Guía completa de veganos" not in titles
+
+
+class TestMoreIdeasEndpoint:
+    """Tests para /api/more-ideas"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_small_request_and_continuation(self, mock_llm, mock_client):
+        """Dos ideas cuestan dos pipelines, y la continuación reutiliza el contexto"""
+        from main import app
+
+        mock_llm.invoke.side_effect = scripted_llm(ideas_json("Batidos", "Pasta"), ideas_json("Tacos"))
+        client = TestClient(app)
+
+        first = client.post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas", "n_ideas": "2", "draft": "true"}
+        ).json()
+
+        assert [idea["title"] for idea in first["ideas"]] == ["Batidos", "Pasta"]
+        assert len(first["posts"]) == 2
+        # contexto + ideas + 2 copies + 2 prompts visuales
+        assert first["timings"]["llm_calls"] == 6
+        assert first["context_id"]
+
+        more = client.post(
+            "/api/more-ideas",
+            data={"context_id": first["context_id"], "n_ideas": "1", "draft": "true"}
+        ).json()
+
+        assert [idea["title"] for idea in more["ideas"]] == ["Tacos"]
+        assert more["context_summary"] == "Contexto de recetas veganas"
+        assert more["context_id"] == first["context_id"]
+        # Sin análisis de contexto: ideas + copy + prompt visual
+        assert more["timings"]["llm_calls"] == 3
+        ideas_prompt = [
+            call.args[0][0].content for call in mock_llm.invoke.call_args_list
+            if "ideas creativas" in call.args[0][0].content
+        ][-1]
+        assert "- Batidos" in ideas_prompt and "- Pasta" in ideas_prompt
+
+        from shared_cache import context_store
+        assert context_store.get(first["context_id"])["titles"] == ["Batidos", "Pasta", "Tacos"]
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_continuation_keeps_brand(self, mock_llm, mock_client):
+        """La continuación deduplica contra las ideas de la marca de la generación original y las registra en ella"""
+        from main import app, idea_deduplicator
+
+        tacos = {"title": "Tacos veganos de jackfruit", "description": "Receta de tacos con jackfruit desmenuzado"}
+        churros = {"title": "Churros al horno sin lactosa", "description": "Merienda dulce y ligera"}
+        idea_deduplicator.add("cafe", [tacos])
+        mock_llm.invoke.side_effect = scripted_llm(ideas_json("Batidos"), json.dumps([tacos]), json.dumps([churros]))
+        client = TestClient(app)
+        first = client.post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas", "n_ideas": "1", "draft": "true", "brand": "cafe"}
+        ).json()
+
+        more = client.post("/api/more-ideas", data={"context_id": first["context_id"], "n_ideas": "1", "draft": "true"}).json()
+
+        # La idea ya publicada por la marca se cambia antes de generar su copy
+        assert more["ideas"] == [churros]
+        assert idea_deduplicator.find_duplicates("cafe", [churros]) == {0: churros["title"]}
+        assert idea_deduplicator.find_duplicates("default", [churros]) == {}
+
+    @patch('main.content_workflow')
+    @patch('main.process_text_context', return_value="Contexto")
+    def test_idea_count_is_capped(self, mock_context, mock_workflow, monkeypatch):
+        """n_ideas se limita al máximo del servidor"""
+        from main import app
+
+        monkeypatch.setattr("main.MAX_IDEAS", 8)
+        mock_workflow.invoke.return_value = {
+            "context": "Contexto", "ideas": [], "posts": [], "visual_prompts": [], "error": None
+        }
+
+        TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas", "n_ideas": "50"}
+        )
+
+        assert mock_workflow.invoke.call_args.args[0]["n_ideas"] == 8
+
+    def test_unknown_context_id(self):
+        """Un context_id desconocido o caducado devuelve 404"""
+        from main import app
+
+        response = TestClient(app).post("/api/more-ideas", data={"context_id": "no-existe"})
+        assert response.status_code == 404
@@ -0,0 +1,117 @@
+"""
+Tests para el modo de profiling bajo demanda
+"""
+import time
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+import profiling
+
+
+@pytest.fixture
+def profiling_enabled(tmp_path, monkeypatch):
+    """Token de administración y directorio de perfiles temporales"""
+    monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", "secreto")
+    monkeypatch.setattr(profiling, "PROFILES_DIR", tmp_path)
+    return tmp_path
+
+
+def busy_loop_for_profiler(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+class TestSamplingProfiler:
+    """Tests para el muestreador de pilas"""
+
+    def test_collapsed_output_contains_busy_function(self):
+        """El formato colapsado incluye la función que consume CPU"""
+        profiler = profiling.SamplingProfiler(interval=0.001)
+        profiler.start()
+        busy_loop_for_profiler(0.1)
+        profiler.stop()
+
+        collapsed = profiler.collapsed()
+        assert "busy_loop_for_profiler" in collapsed
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0
+            assert ";" in stack
+
+    def test_profile_path_rejects_foreign_ids(self, profiling_enabled):
+        """Solo se aceptan ids generados por el servidor"""
+        assert profiling.profile_path("../../etc/passwd") is None
+        assert profiling.profile_path("a" * 32) == profiling_enabled / ("a" * 32 + ".collapsed")
+
+
+class TestShouldProfile:
+    """Tests para la decisión de perfilar un request"""
+
+    def test_disabled_without_token(self, monkeypatch):
+        """Sin token configurado ni muestreo no se perfila nada"""
+        monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", None)
+        monkeypatch.setattr(profiling, "PROFILE_SAMPLE_ONE_IN", 0)
+        assert not profiling.should_profile({"x-profile-token": "cualquiera"}, {})
+
+    def test_admin_header_or_query(self, profiling_enabled):
+        """El token de administración activa el profiling por cabecera o query"""
+        assert profiling.should_profile({"x-profile-token": "secreto"}, {})
+        assert profiling.should_profile({}, {"profile_token": "secreto"})
+        assert not profiling.should_profile({"x-profile-token": "otro"}, {})
+
+    def test_random_sampling(self, monkeypatch):
+        """PROFILE_SAMPLE_ONE_IN=1 perfila todos los requests"""
+        monkeypatch.setattr(profiling, "PROFILE_SAMPLE_ONE_IN", 1)
+        assert profiling.should_profile({}, {})
+
+
+class TestProfilingEndpoints:
+    """Tests de integración con /api/generate-content"""
+
+    @patch('main.content_workflow')
+    @patch('main.process_text_context', return_value="Contexto procesado")
+    def test_profiled_request_is_retrievable(self, mock_context, mock_workflow, profiling_enabled):
+        """Un request perfilado deja un archivo descargable por su id"""
+        from main import app
+
+        mock_workflow.invoke.return_value = {
+            "context": "Contexto procesado", "ideas": [], "posts": [], "visual_prompts": [], "error": None
+        }
+        client = TestClient(app)
+
+        response = client.post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas"},
+            headers={"X-Profile-Token": "secreto"}
+        )
+        assert response.status_code == 200
+        request_id = response.headers["x-profile-id"]
+        assert (profiling_enabled / f"{request_id}.collapsed").exists()
+
+        denied = client.get(f"/api/profiles/{request_id}")
+        assert denied.status_code == 403
+
+        profile = client.get(f"/api/profiles/{request_id}", headers={"X-Profile-Token": "secreto"})
+        assert profile.status_code == 200
+        assert profile.headers["content-type"].startswith("text/plain")
+
+    @patch('main.content_workflow')
+    @patch('main.process_text_context', return_value="Contexto procesado")
+    def test_unprofiled_request_writes_nothing(self, mock_context, mock_workflow, profiling_enabled):
+        """Sin token el request no se perfila"""
+        from main import app
+
+        mock_workflow.invoke.return_value = {
+            "context": "Contexto procesado", "ideas": [], "posts": [], "visual_prompts": [], "error": None
+        }
+
+        response = TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas"}
+        )
+
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+        assert list(profiling_enabled.iterdir()) == []
@@ -0,0 +1,177 @@
+"""
+Tests para el circuit breaker de generación de imágenes
+"""
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+from resilience import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+
+class FakeClock:
+    """Reloj controlable para no depender de esperas reales"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_breaker(clock, **overrides):
+    settings = dict(failure_rate_threshold=0.5, slow_call_seconds=5.0, window_size=10,
+                    min_calls=4, open_seconds=30.0, clock=clock)
+    settings.update(overrides)
+    return CircuitBreaker("test_breaker", **settings)
+
+
+class TestCircuitBreaker:
+    """Tests para las transiciones de estado"""
+
+    def test_stays_closed_below_min_calls(self, clock):
+        """No se abre antes de tener suficientes llamadas en la ventana"""
+        breaker = make_breaker(clock)
+        for _ in range(3):
+            assert breaker.allow_request()
+            breaker.record_failure(0.1)
+        assert breaker.state == STATE_CLOSED
+
+    def test_opens_on_error_rate(self, clock):
+        """Con una tasa de error sobre el umbral el circuito se abre"""
+        breaker = make_breaker(clock)
+        breaker.record_success(0.1)
+        breaker.record_failure(0.1)
+        breaker.record_success(0.1)
+        breaker.record_failure(0.1)
+
+        assert breaker.state == STATE_OPEN
+        assert not breaker.allow_request()
+        assert breaker.snapshot()["retry_in_s"] == 30.0
+
+    def test_slow_calls_count_as_failures(self, clock):
+        """Las respuestas lentas cuentan como error aunque tengan éxito"""
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_success(6.0)
+        assert breaker.state == STATE_OPEN
+
+    def test_half_open_probe_success_closes(self, clock):
+        """Tras el enfriamiento se deja pasar una sonda; si va bien se cierra"""
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure(0.1)
+        clock.now += 31
+
+        assert breaker.allow_request()
+        assert breaker.state == STATE_HALF_OPEN
+        # Solo una sonda a la vez
+        assert not breaker.allow_request()
+
+        breaker.record_success(0.1)
+        assert breaker.state == STATE_CLOSED
+        assert breaker.snapshot()["window_calls"] == 0
+
+    def test_half_open_probe_failure_reopens(self, clock):
+        """Si la sonda falla el circuito vuelve a abrirse con nuevo enfriamiento"""
+        breaker = make_breaker(clock)
+        for _ in range(4):
+            breaker.record_failure(0.1)
+        clock.now += 31
+
+        assert breaker.allow_request()
+        breaker.record_failure(0.1)
+
+        assert breaker.state == STATE_OPEN
+        assert not breaker.allow_request()
+
+    def test_rejects_does_not_start_a_probe(self, clock):
+        """Consultar el estado antes de encolarse no consume la sonda del semiabierto"""
+        breaker = make_breaker(clock)
+        assert not breaker.rejects()
+        for _ in range(4):
+            breaker.record_failure(0.1)
+        assert breaker.rejects()
+
+        clock.now += 31
+        assert not breaker.rejects()
+        assert breaker.allow_request()
+        assert breaker.rejects()
+
+
+class TestImageDegradation:
+    """Tests de integración con generate_image_with_imagen"""
+
+    @patch('image_render.client')
+    def test_open_circuit_skips_provider(self, mock_client):
+        """Con el circuito abierto se usa el placeholder sin llamar al proveedor"""
+        from main import generate_image_with_imagen, image_breaker
+
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+        for _ in range(image_breaker.min_calls):
+            assert generate_image_with_imagen("a vegan bowl").startswith(b"\x89PNG")
+        assert image_breaker.state == STATE_OPEN
+        calls = mock_client.models.generate_content.call_count
+
+        image_data = generate_image_with_imagen("a vegan bowl")
+
+        assert image_data.startswith(b"\x89PNG")
+        assert mock_client.models.generate_content.call_count == calls
+
+    @patch('image_render.client')
+    def test_open_circuit_does_not_wait_for_a_slot(self, mock_client):
+        """Con el circuito abierto el placeholder llega sin esperar detrás de los renders en curso"""
+        import threading
+        import image_render
+        from scheduler import FairScheduler
+
+        for _ in range(image_render.image_breaker.min_calls):
+            image_render.image_breaker.record_failure(0.1)
+        busy = FairScheduler("image", 1)
+        busy.acquire()
+        results = []
+
+        with patch('image_render.image_scheduler', busy):
+            thread = threading.Thread(target=lambda: results.append(image_render.render_with_provider("a vegan bowl", "k")), daemon=True)
+            thread.start()
+            thread.join(2)
+            # El slot sigue ocupado: la respuesta no esperó a que se liberara
+            assert results == [None]
+        busy.release()
+        mock_client.models.generate_content.assert_not_called()
+
+    @patch('image_render.client')
+    def test_response_without_image_is_failure(self, mock_client):
+        """Una respuesta sin imagen cuenta como fallo del proveedor"""
+        from main import generate_image_with_imagen, image_breaker
+
+        text_part = Mock(text="sin imagen", inline_data=None)
+        mock_client.models.generate_content.return_value = Mock(
+            candidates=[Mock(content=Mock(parts=[text_part]))]
+        )
+
+        generate_image_with_imagen("a vegan bowl")
+
+        assert image_breaker.snapshot()["failure_rate"] == 1.0
+
+    @patch('image_render.client')
+    def test_health_reports_breaker(self, mock_client):
+        """/api/health expone el estado del breaker"""
+        from main import app, generate_image_with_imagen, image_breaker
+
+        client = TestClient(app)
+        healthy = client.get("/api/health").json()
+        assert healthy["status"] == "ok"
+        assert healthy["circuit_breakers"]["image_generation"]["state"] == "closed"
+
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+        for _ in range(image_breaker.min_calls):
+            generate_image_with_imagen("a vegan bowl")
+
+        degraded = client.get("/api/health").json()
+        assert degraded["status"] == "degraded"
+        assert degraded["circuit_breakers"]["image_generation"]["state"] == "open"
@@ -0,0 +1,156 @@
+"""
+Tests para el planificador justo de llamadas al proveedor
+"""
+import threading
+import time
+import pytest
+from contextvars import copy_context
+from unittest.mock import Mock, patch
+
+from cancellation import RequestCancelled, current_cancel_event
+from deadline import current_deadline
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, FairScheduler
+
+
+def queue_call(scheduler, tenant, priority, order):
+    """Encola una llamada desde otro hilo y espera a que esté en la cola"""
+    def run():
+        scheduler.acquire(tenant, priority)
+        order.append(tenant)
+        scheduler.release()
+
+    queued = scheduler.snapshot()["queued"]
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    limit = time.monotonic() + 5
+    while scheduler.snapshot()["queued"] == queued and time.monotonic() < limit:
+        time.sleep(0.005)
+    return thread
+
+
+def drain(scheduler, threads):
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+
+
+class TestFairScheduler:
+    """Tests para el reparto de huecos"""
+
+    def test_round_robin_between_tenants(self):
+        """Una petición con muchas llamadas se turna con las que llegan después"""
+        scheduler = FairScheduler("text", slots=1)
+        scheduler.acquire("ocupado", PRIORITY_BATCH)
+        order = []
+        threads = [queue_call(scheduler, "a", PRIORITY_BATCH, order) for _ in range(3)]
+        threads += [queue_call(scheduler, tenant, PRIORITY_BATCH, order) for tenant in ("b", "c")]
+
+        drain(scheduler, threads)
+
+        assert order == ["a", "b", "c", "a", "a"]
+
+    def test_interactive_weighted_over_batch(self):
+        """Las peticiones interactivas reciben más turnos sin dejar sin servicio a los lotes"""
+        scheduler = FairScheduler("image", slots=1, interactive_weight=2)
+        scheduler.acquire("ocupado", PRIORITY_BATCH)
+        order = []
+        threads = [queue_call(scheduler, "lote", PRIORITY_BATCH, order) for _ in range(3)]
+        threads += [queue_call(scheduler, "web", PRIORITY_INTERACTIVE, order) for _ in range(3)]
+
+        drain(scheduler, threads)
+
+        assert order == ["lote", "web", "web", "lote", "web", "lote"]
+
+    def test_free_slots_are_not_queued(self):
+        scheduler = FairScheduler("text", slots=2)
+        assert scheduler.acquire("a") == 0.0 and scheduler.acquire("b") == 0.0
+        assert scheduler.snapshot()["in_use"] == 2
+        assert FairScheduler("text", slots=0).acquire("a") == 0.0
+
+    def test_cancelled_and_expired_calls_leave_the_queue(self):
+        """Un request cancelado o sin plazo deja su sitio en la cola"""
+        scheduler = FairScheduler("text", slots=1)
+        scheduler.acquire("ocupado")
+        errors = []
+
+        def queued(setup):
+            setup()
+            try:
+                scheduler.acquire("a")
+            except Exception as e:
+                errors.append(type(e))
+
+        cancelled = threading.Event()
+        cancelled.set()
+        for setup in (lambda: current_cancel_event.set(cancelled), lambda: current_deadline.set(time.time() - 1)):
+            thread = threading.Thread(target=copy_context().run, args=(queued, setup))
+            thread.start()
+            thread.join(5)
+
+        assert errors == [RequestCancelled, TimeoutError]
+        snapshot = scheduler.snapshot()
+        assert snapshot["queued"] == 0 and snapshot["in_use"] == 1
+
+    def test_per_tenant_wait(self):
+        """El tiempo en cola se acumula por tenant"""
+        now = [0.0]
+        scheduler = FairScheduler("text", slots=1, clock=lambda: now[0])
+        scheduler.acquire("a")
+        order = []
+        thread = queue_call(scheduler, "b", PRIORITY_INTERACTIVE, order)
+        assert scheduler.snapshot()["tenants"]["b"]["queued"] == 1
+
+        now[0] = 2.0
+        drain(scheduler, [thread])
+
+        tenants = scheduler.snapshot()["tenants"]
+        assert tenants["a"] == {"calls": 1, "mean_wait_s": 0.0, "max_wait_s": 0.0, "queued": 0}
+        assert tenants["b"] == {"calls": 1, "mean_wait_s": 2.0, "max_wait_s": 2.0, "queued": 0}
+
+
+class TestProviderCallsAreScheduled:
+    """Tests de integración con las llamadas al modelo"""
+
+    @patch('main.llm')
+    def test_calls_recorded_under_client_tenant(self, mock_llm):
+        """Las llamadas de un request cuentan para el tenant del cliente y se ven en /api/scheduler"""
+        from main import app
+        from fastapi.testclient import TestClient
+
+        mock_llm.invoke.return_value = Mock(content="A vegan bowl")
+        client = TestClient(app)
+
+        response = client.post("/api/stages/visual-prompt", json={"idea": {"title": "Bowl", "description": "d"}, "context": "c"})
+
+        assert response.status_code == 200
+        stats = client.get("/api/scheduler").json()
+        assert stats["text"]["tenants"]["testclient"]["calls"] == 1
+        assert stats["text"]["in_use"] == 0 and stats["image"]["queued"] == 0
+
+    @patch('main.llm')
+    def test_queue_wait_not_counted_as_call_latency(self, mock_llm):
+        """La espera por un slot de texto no entra en la latencia de la llamada al proveedor"""
+        import main
+        from metrics import RequestTimings, current_timings
+
+        mock_llm.invoke.return_value = Mock(content="A vegan bowl")
+        scheduler = FairScheduler("text", 1)
+        scheduler.acquire()
+        timings = RequestTimings()
+
+        def call():
+            current_timings.set(timings)
+            main.generate_visual_prompt({"title": "Bowl en cola", "description": "d"}, "c")
+
+        with patch('main.text_scheduler', scheduler):
+            thread = threading.Thread(target=copy_context().run, args=(call,), daemon=True)
+            thread.start()
+            limit = time.monotonic() + 5
+            while scheduler.snapshot()["queued"] == 0 and time.monotonic() < limit:
+                time.sleep(0.005)
+            time.sleep(0.3)
+            scheduler.release()
+            thread.join(5)
+
+        stage = next(s for s in timings.as_dict()["stages"] if s["name"] == "generate_visual_prompt")
+        assert stage["duration_ms"] < 300
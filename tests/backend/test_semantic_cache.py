@@ -0,0 +1,233 @@
+"""
+Tests para la caché semántica de generaciones por contexto (SimHash)
+"""
+import itertools
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+from semantic_cache import SEMANTIC_CACHE_THRESHOLD, SemanticCache, fingerprint_similarity, simhash
+
+EASY = ("El usuario quiere publicar recetas veganas fáciles para principiantes. Público: personas que "
+        "empiezan con la cocina vegana. Tono cercano y educativo, con ideas sencillas y rápidas.")
+SIMPLE = ("El usuario quiere publicar recetas veganas sencillas para principiantes. Público: personas que "
+          "empiezan con la cocina vegana. Tono cercano y educativo, con ideas fáciles y rápidas.")
+COFFEE = ("Cafetería de especialidad en Madrid que quiere dar a conocer sus granos de Etiopía tostados "
+          "cada semana. Tono experto y cálido.")
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#vegano"]}
+
+# Resúmenes con el formato de process_text_context: cada par es la misma petición reformulada
+SUMMARIES = {
+    "finanzas": (
+        "El tema principal son las finanzas personales para jóvenes: ahorrar cada mes, salir de deudas y empezar "
+        "a invertir con poco dinero. La audiencia objetivo son veinteañeros con su primer empleo. El tono sugerido "
+        "es claro, práctico y motivador. Palabras clave importantes: ahorro, presupuesto mensual, deudas, "
+        "inversión, fondos indexados.",
+        "El tema principal es la educación financiera para jóvenes que quieren ahorrar cada mes, pagar sus deudas "
+        "e invertir con poco dinero. La audiencia objetivo son personas de veintitantos años con su primer trabajo. "
+        "El tono sugerido es práctico, claro y motivador. Palabras clave importantes: presupuesto mensual, ahorro, "
+        "deudas, fondos indexados, invertir.",
+    ),
+    "mascotas": (
+        "El tema principal es una peluquería canina que ofrece baño, corte de pelo y cuidado de uñas para perros y "
+        "gatos. La audiencia objetivo son dueños de mascotas del barrio que quieren a sus animales limpios y "
+        "felices. El tono sugerido es divertido y cariñoso. Palabras clave importantes: peluquería canina, baño "
+        "de perros, corte de pelo, cuidado de mascotas, gatos.",
+        "El tema principal es una peluquería para perros y gatos con baño, corte de pelo y cuidado de uñas. La "
+        "audiencia objetivo son los dueños de mascotas del barrio que quieren animales limpios y contentos. El tono "
+        "sugerido es cariñoso y divertido. Palabras clave importantes: peluquería canina, corte de pelo, baño, "
+        "mascotas, cuidado de uñas.",
+    ),
+    "fitness": (
+        "El tema principal es un gimnasio de barrio con entrenamiento funcional, clases de fuerza y planes "
+        "personalizados para perder grasa. La audiencia objetivo son adultos que quieren ponerse en forma sin pasar "
+        "horas en el gimnasio. El tono sugerido es enérgico y motivador. Palabras clave importantes: entrenamiento "
+        "funcional, fuerza, pérdida de grasa, rutina, entrenador personal.",
+        "El tema principal es el entrenamiento funcional y de fuerza en un gimnasio de barrio con planes "
+        "personalizados para quemar grasa. La audiencia objetivo son adultos que quieren ponerse en forma en poco "
+        "tiempo. El tono sugerido es motivador y enérgico. Palabras clave importantes: fuerza, entrenamiento "
+        "funcional, rutina, perder grasa, entrenador personal.",
+    ),
+}
+SPINNING = ("El tema principal son las nuevas clases de spinning y movilidad para mayores de sesenta años en el "
+            "gimnasio del barrio. La audiencia objetivo son jubilados activos que quieren cuidar sus articulaciones. "
+            "El tono sugerido es amable y animado. Palabras clave importantes: spinning, movilidad, mayores, "
+            "articulaciones, envejecimiento activo.")
+
+
+def generation(n_ideas):
+    return {
+        "ideas": [{"title": f"Idea {i}", "description": "d"} for i in range(n_ideas)],
+        "posts": [COPY] * n_ideas,
+        "visual_prompts": [{"description": f"Prompt {i}", "prompt_id": f"p{i}"} for i in range(n_ideas)],
+    }
+
+
+class TestSimHash:
+    """Tests para la huella de los contextos"""
+
+    def test_rephrasing_is_close_and_other_topics_are_not(self):
+        """Reformular el mismo contexto apenas cambia la huella; otro tema la cambia mucho"""
+        assert fingerprint_similarity(simhash(EASY), simhash(EASY.upper())) == 1.0
+        assert fingerprint_similarity(simhash(EASY), simhash(SIMPLE)) >= 0.85
+        assert fingerprint_similarity(simhash(EASY), simhash(COFFEE)) < 0.7
+
+    def test_threshold_separates_summaries(self):
+        """Con el umbral por defecto se reutilizan las reformulaciones y no otros temas con las mismas secciones"""
+        for first, second in SUMMARIES.values():
+            assert fingerprint_similarity(simhash(first), simhash(second)) >= SEMANTIC_CACHE_THRESHOLD
+        for summaries, other_summaries in itertools.combinations(SUMMARIES.values(), 2):
+            for first, second in itertools.product(summaries, other_summaries):
+                assert fingerprint_similarity(simhash(first), simhash(second)) < SEMANTIC_CACHE_THRESHOLD
+        # Otra petición del mismo negocio tampoco
+        for summary in SUMMARIES["fitness"]:
+            assert fingerprint_similarity(simhash(summary), simhash(SPINNING)) < SEMANTIC_CACHE_THRESHOLD
+
+
+class TestSemanticCache:
+    """Tests para el almacén por cuenta con LRU"""
+
+    def test_hit_is_scoped_to_account(self):
+        cache = SemanticCache(max_entries=10, threshold=0.85)
+        cache.store("marca", EASY, "valor")
+
+        value, similarity = cache.lookup("marca", SIMPLE)
+        assert value == "valor" and similarity >= 0.85
+        assert cache.lookup("otra", SIMPLE) == (None, None)
+        value, similarity = cache.lookup("marca", COFFEE)
+        assert value is None and similarity < 0.85
+
+    def test_accept_filters_entries(self):
+        """Solo se usan entradas que sirven al request (por ejemplo, con ideas suficientes)"""
+        cache = SemanticCache(max_entries=10, threshold=0.85)
+        cache.store("marca", EASY, generation(2))
+
+        assert cache.lookup("marca", EASY, accept=lambda value: len(value["ideas"]) >= 3)[0] is None
+        assert cache.lookup("marca", EASY, accept=lambda value: len(value["ideas"]) >= 2)[0] == generation(2)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = SemanticCache(max_entries=2, threshold=0.85)
+        cache.store("marca", EASY, "recetas")
+        cache.store("marca", COFFEE, "cafe")
+        cache.lookup("marca", EASY)
+        cache.store("otra", COFFEE, "cafe de otra")
+
+        assert len(cache) == 2
+        assert cache.lookup("marca", EASY)[0] == "recetas"
+        assert cache.lookup("marca", COFFEE)[0] is None
+
+    def test_entries_expire(self):
+        now = [0.0]
+        cache = SemanticCache(max_entries=10, threshold=0.85, ttl=60, clock=lambda: now[0])
+        cache.store("marca", EASY, "recetas")
+
+        now[0] = 61
+        assert cache.lookup("marca", EASY) == (None, None)
+        assert len(cache) == 0
+
+    def test_disabled(self):
+        cache = SemanticCache(max_entries=0)
+        cache.store("marca", EASY, "recetas")
+        assert cache.lookup("marca", EASY) == (None, None)
+
+
+class TestSemanticCacheEndpoint:
+    """Tests de integración con /api/generate-content"""
+
+    @pytest.fixture
+    def mock_models(self):
+        contexts = {"recetas veganas fáciles": EASY, "recetas veganas sencillas para principiantes": SIMPLE}
+        with patch('main.llm') as mock_llm, \
+                patch('main.process_text_context', side_effect=lambda text: contexts[text]), \
+                patch('main.generate_image_with_imagen', return_value=b"png") as mock_image:
+            def invoke(messages, **kwargs):
+                prompt = messages[0].content
+                if "ideas creativas" in prompt:
+                    return Mock(content=json.dumps([{"title": f"Idea {i}", "description": "d"} for i in range(3)]))
+                if "response_schema" in kwargs:
+                    return Mock(content=json.dumps(COPY))
+                return Mock(content="A green smoothie")
+
+            mock_llm.invoke.side_effect = invoke
+            yield mock_llm, mock_image
+
+    def test_near_identical_context_reuses_generation(self, mock_models):
+        """Una reformulación devuelve las ideas y posts ya generados sin llamar al modelo de texto"""
+        from main import app
+
+        mock_llm, mock_image = mock_models
+        client = TestClient(app)
+        data = {"input_type": "text", "n_ideas": "2", "brand": "recetas"}
+
+        first = client.post("/api/generate-content", data={**data, "content": "recetas veganas fáciles"})
+        calls = mock_llm.invoke.call_count
+        second = client.post("/api/generate-content", data={**data, "content": "recetas veganas sencillas para principiantes"})
+
+        assert second.status_code == 200
+        assert mock_llm.invoke.call_count == calls
+        assert second.json()["ideas"] == first.json()["ideas"]
+        assert second.json()["posts"] == first.json()["posts"]
+        assert second.json()["session_id"] != first.json()["session_id"]
+        assert float(second.headers["x-semantic-cache-similarity"]) >= 0.85
+        assert "x-semantic-cache-similarity" not in first.headers
+        assert mock_image.call_args.kwargs == {"refresh": False}
+
+        # La sesión del acierto se puede consultar como cualquier otra
+        session = client.get(f"/api/sessions/{second.json()['session_id']}").json()
+        assert session["ideas"] == first.json()["ideas"]
+
+    def test_fresh_images_and_more_ideas(self, mock_models):
+        """fresh_images vuelve a renderizar; pedir más ideas de las guardadas no acierta"""
+        from main import app
+
+        mock_llm, mock_image = mock_models
+        client = TestClient(app)
+        data = {"input_type": "text", "content": "recetas veganas fáciles", "brand": "recetas"}
+
+        client.post("/api/generate-content", data={**data, "n_ideas": "2"})
+        calls = mock_llm.invoke.call_count
+        client.post("/api/generate-content", data={**data, "n_ideas": "1", "fresh_images": "true"})
+        assert mock_llm.invoke.call_count == calls
+        assert mock_image.call_args.kwargs == {"refresh": True}
+
+        response = client.post("/api/generate-content", data={**data, "n_ideas": "3"})
+        assert mock_llm.invoke.call_count > calls
+        assert "x-semantic-cache-similarity" not in response.headers
+
+    def test_requests_without_brand_do_not_share(self, mock_models):
+        """Sin marca explícita cada cliente genera su propio contenido"""
+        from main import app
+
+        mock_llm, _ = mock_models
+        client = TestClient(app)
+        data = {"input_type": "text", "n_ideas": "2"}
+
+        client.post("/api/generate-content", data={**data, "content": "recetas veganas fáciles"})
+        calls = mock_llm.invoke.call_count
+        second = client.post("/api/generate-content", data={**data, "content": "recetas veganas sencillas para principiantes"})
+
+        assert mock_llm.invoke.call_count > calls
+        assert "x-semantic-cache-similarity" not in second.headers
+
+    def test_guided_requests_differing_by_niche_do_not_share(self, mock_models):
+        """Dos cuestionarios guiados que solo cambian el nicho no reutilizan la generación del otro"""
+        from main import app
+
+        mock_llm, _ = mock_models
+        client = TestClient(app)
+        answers = {"objective": "vender", "tone": "cercano"}
+
+        def guided(niche):
+            return client.post("/api/generate-content", data={
+                "input_type": "guided", "n_ideas": "2", "brand": "agencia",
+                "guided_answers": json.dumps({**answers, "niche": niche})
+            })
+
+        guided("fitness")
+        calls = mock_llm.invoke.call_count
+        second = guided("mascotas")
+
+        assert second.status_code == 200
+        assert mock_llm.invoke.call_count > calls
+        assert "x-semantic-cache-similarity" not in second.headers
@@ -0,0 +1,65 @@
+"""
+Tests para la serialización rápida de ContentResponse
+"""
+import base64
+import orjson
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+from serialization import FastJSONResponse, content_response_payload, image_url_fragment
+
+
+def workflow_state(image_bytes):
+    return {
+        "context": "Contexto",
+        "ideas": [{"title": "Idea 1", "description": "Descripción 1"}],
+        "posts": [{"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}],
+        "visual_prompts": [{"description": "Prompt visual", "image_data": image_bytes}],
+        "error": None,
+    }
+
+
+class TestFastSerialization:
+    """Tests para FastJSONResponse y los fragmentos de imagen"""
+
+    def test_image_fragment_is_data_url(self, sample_image):
+        """El fragmento es una cadena JSON con la data URL completa"""
+        decoded = orjson.loads(orjson.dumps({"image_url": image_url_fragment(sample_image)}))
+        prefix, encoded = decoded["image_url"].split(",", 1)
+        assert prefix == "data:image/png;base64"
+        assert base64.b64decode(encoded) == sample_image
+
+    def test_missing_image_is_null(self):
+        """Sin imagen el campo queda en null"""
+        assert image_url_fragment(None) is None
+
+    def test_payload_matches_content_response_schema(self, sample_image):
+        """El cuerpo generado valida contra ContentResponse"""
+        from main import ContentResponse
+
+        body = FastJSONResponse(content_response_payload(workflow_state(sample_image), "Contexto")).body
+        response = ContentResponse.model_validate(orjson.loads(body))
+
+        assert response.ideas[0].title == "Idea 1"
+        assert response.visual_prompts[0].image_url.startswith("data:image/png;base64,")
+        assert response.timings is None
+
+    @patch('main.content_workflow')
+    @patch('main.process_text_context', return_value="Contexto")
+    def test_endpoint_uses_fast_path(self, mock_context, mock_workflow, sample_image):
+        """El endpoint devuelve JSON con imágenes y cabecera Server-Timing"""
+        from main import app
+
+        mock_workflow.invoke.return_value = workflow_state(sample_image)
+
+        response = TestClient(app).post(
+            "/api/generate-content",
+            data={"input_type": "text", "content": "Recetas veganas"}
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert "server-timing" in response.headers
+        data = response.json()
+        assert data["posts"][0]["hashtags"] == ["#test"]
+        assert data["visual_prompts"][0]["image_url"].startswith("data:image/png;base64,")
@@ -0,0 +1,217 @@
+"""
+Tests para las sesiones persistentes y la regeneración parcial
+"""
+import json
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+NEW_COPY = {"hook": "Nuevo hook", "body": "Nuevo body", "cta": "Nuevo CTA", "hashtags": ["#nuevo"]}
+
+
+def scripted_llm(copies=None, visuals=None):
+    """Contexto, dos ideas, copies y prompts visuales según la llamada"""
+    copies = copies if copies is not None else []
+    visuals = visuals if visuals is not None else []
+
+    def invoke(messages, **kwargs):
+        prompt = messages[0].content
+        if "ideas creativas" in prompt:
+            return Mock(content=json.dumps([
+                {"title": "Batidos", "description": "Sobre batidos"},
+                {"title": "Pasta", "description": "Sobre pasta"},
+            ]))
+        if "response_schema" in kwargs:
+            return Mock(content=json.dumps(copies.pop(0) if copies else COPY))
+        if "Analiza el siguiente texto" in prompt:
+            return Mock(content="Contexto de recetas veganas")
+        return Mock(content=visuals.pop(0) if visuals else "A vegan bowl")
+    return invoke
+
+
+def generate(client, **fields):
+    data = {"input_type": "text", "content": "Recetas veganas", "n_ideas": "2", "draft": "true"}
+    data.update(fields)
+    return client.post("/api/generate-content", data=data)
+
+
+class TestSessionStore:
+    """Tests para la retención acotada de las sesiones"""
+
+    @pytest.fixture
+    def clock(self):
+        now = [1000.0]
+        clock = lambda: now[0]
+        clock.advance = lambda seconds: now.__setitem__(0, now[0] + seconds)
+        return clock
+
+    def run(self, store, session_id, size=10):
+        """Ejecuta un workflow mínimo checkpointeado bajo session_id"""
+        from langgraph.graph import StateGraph, END
+        from typing import TypedDict
+
+        class State(TypedDict):
+            data: str
+
+        graph = StateGraph(State)
+        graph.add_node("step", lambda state: {"data": "x" * size})
+        graph.set_entry_point("step")
+        graph.add_edge("step", END)
+        workflow = graph.compile(checkpointer=store.checkpointer)
+        store.register(session_id)
+        workflow.invoke({"data": ""}, store.config(session_id))
+        store.save(session_id)
+        return workflow
+
+    def test_only_latest_checkpoint_is_kept(self, clock):
+        """Tras guardar solo queda el último checkpoint de la sesión"""
+        from sessions import SessionStore
+
+        store = SessionStore(":memory:", clock=clock)
+        workflow = self.run(store, "s1")
+
+        assert len(list(store.checkpointer.list(store.config("s1")))) == 1
+        assert workflow.get_state(store.config("s1")).values["data"] == "x" * 10
+
+    def test_ttl_expiry(self, clock):
+        """Una sesión caducada deja de existir y se borra al podar"""
+        from sessions import SessionStore
+
+        store = SessionStore(":memory:", ttl=60, clock=clock)
+        self.run(store, "vieja")
+        clock.advance(61)
+
+        assert not store.exists("vieja")
+        self.run(store, "nueva")
+        assert [row[0] for row in store.sizes()] == ["nueva"]
+
+    def test_count_and_byte_limits_evict_oldest(self, clock):
+        """Se desalojan las sesiones menos usadas por número y por bytes"""
+        from sessions import SessionStore
+
+        store = SessionStore(":memory:", max_count=2, clock=clock)
+        for session_id in ("a", "b", "c"):
+            self.run(store, session_id)
+            clock.advance(1)
+        assert [row[0] for row in store.sizes()] == ["b", "c"]
+
+        store = SessionStore(":memory:", max_bytes=30_000, clock=clock)
+        for session_id in ("a", "b"):
+            self.run(store, session_id, size=20_000)
+            clock.advance(1)
+        assert [row[0] for row in store.sizes()] == ["b"]
+        assert store.sizes()[0][2] <= 30_000
+
+
+class TestSessionEndpoints:
+    """Tests para la regeneración parcial desde una sesión"""
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_regenerate_single_post(self, mock_llm, mock_client):
+        """Regenerar un post cuesta una sola llamada y conserva el resto"""
+        from main import app
+
+        mock_llm.invoke.side_effect = scripted_llm(copies=[COPY, COPY, NEW_COPY])
+        client = TestClient(app)
+        first = generate(client)
+        session_id = first.json()["session_id"]
+        assert first.headers["x-session-id"] == session_id
+        calls = mock_llm.invoke.call_count
+
+        response = client.post(f"/api/sessions/{session_id}/posts/1/regenerate")
+
+        assert response.status_code == 200
+        assert response.json()["posts"] == NEW_COPY
+        assert mock_llm.invoke.call_count == calls + 1
+        stored = client.get(f"/api/sessions/{session_id}").json()
+        assert stored["posts"] == [COPY, NEW_COPY]
+        assert stored["ideas"] == first.json()["ideas"]
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_regenerate_visual_prompt_and_image(self, mock_llm, mock_client, tmp_path, monkeypatch):
+        """Se puede rehacer un prompt visual o solo su imagen"""
+        from main import app
+
+        monkeypatch.chdir(tmp_path)
+        mock_llm.invoke.side_effect = scripted_llm(visuals=["A vegan bowl", "Fresh pasta", "Green smoothie"])
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+        client = TestClient(app)
+        session_id = generate(client).json()["session_id"]
+
+        visual = client.post(f"/api/sessions/{session_id}/visual-prompts/0/regenerate").json()
+        # Borrador: prompt nuevo sin imagen
+        assert visual["visual_prompts"]["description"] == "Green smoothie"
+        assert visual["visual_prompts"]["image_url"] is None
+
+        image = client.post(f"/api/sessions/{session_id}/images/0/regenerate").json()
+        assert image["visual_prompts"]["description"] == "Green smoothie"
+        assert image["visual_prompts"]["image_url"].startswith("data:image/png;base64,")
+        stored = client.get(f"/api/sessions/{session_id}").json()
+        assert stored["visual_prompts"][0]["image_url"] == image["visual_prompts"]["image_url"]
+        assert stored["visual_prompts"][1]["description"] == "Fresh pasta"
+
+    @patch('image_render.request_provider_image', return_value=b"\x89PNG" + b"x" * 50_000)
+    @patch('main.llm')
+    def test_checkpoint_keeps_image_sources_not_bytes(self, mock_llm, mock_image):
+        """El checkpoint no guarda los PNG; la sesión los recupera de la caché o los vuelve a generar"""
+        from main import app, content_workflow, image_cache
+        from sessions import session_store
+
+        mock_llm.invoke.side_effect = scripted_llm(visuals=["A vegan bowl", "Fresh pasta"])
+        client = TestClient(app)
+        first = generate(client, draft="false").json()
+        session_id = first["session_id"]
+        assert all(visual["image_url"].startswith("data:image/png;base64,") for visual in first["visual_prompts"])
+
+        checkpointed = content_workflow.get_state(session_store.config(session_id)).values["visual_prompts"]
+        assert [visual["image_source"] for visual in checkpointed] == ["provider", "provider"]
+        assert all("image_data" not in visual for visual in checkpointed)
+        assert dict((row[0], row[2]) for row in session_store.sizes())[session_id] < 50_000
+
+        assert client.get(f"/api/sessions/{session_id}").json()["visual_prompts"] == first["visual_prompts"]
+        assert mock_image.call_count == 2
+        # Sin la caché de imágenes se vuelven a generar
+        image_cache.clear()
+        assert client.get(f"/api/sessions/{session_id}").json()["visual_prompts"] == first["visual_prompts"]
+        assert mock_image.call_count == 4
+
+    @patch('image_render.client')
+    @patch('main.llm')
+    def test_resume_failed_posts_stage(self, mock_llm, mock_client):
+        """Un fallo en los posts se reanuda sin repetir contexto ni ideas"""
+        from main import app
+
+        mock_llm.invoke.side_effect = scripted_llm()
+        client = TestClient(app)
+        with patch('main.record_first_post', side_effect=RuntimeError("cuota agotada")):
+            failed = generate(client)
+        assert failed.status_code == 500
+        session_id = failed.headers["x-session-id"]
+        prompts_before = [call.args[0][0].content for call in mock_llm.invoke.call_args_list]
+
+        resumed = client.post(f"/api/sessions/{session_id}/resume")
+
+        assert resumed.status_code == 200
+        body = resumed.json()
+        assert [idea["title"] for idea in body["ideas"]] == ["Batidos", "Pasta"]
+        assert body["posts"] == [COPY, COPY]
+        new_prompts = [call.args[0][0].content for call in mock_llm.invoke.call_args_list][len(prompts_before):]
+        assert not any("ideas creativas" in prompt or "Analiza el siguiente texto" in prompt for prompt in new_prompts)
+        # Una sesión sin error no se puede reanudar
+        assert client.post(f"/api/sessions/{session_id}/resume").status_code == 409
+
+    def test_unknown_session_or_index(self):
+        """Sesiones desconocidas e índices fuera de rango devuelven 404"""
+        from main import app
+
+        client = TestClient(app)
+        assert client.get("/api/sessions/no-existe").status_code == 404
+        assert client.post("/api/sessions/no-existe/posts/0/regenerate").status_code == 404
+
+        with patch('main.llm') as mock_llm, patch('image_render.client'):
+            mock_llm.invoke.side_effect = scripted_llm()
+            session_id = generate(client).json()["session_id"]
+        assert client.post(f"/api/sessions/{session_id}/posts/5/regenerate").status_code == 404
@@ -0,0 +1,272 @@
+"""
+Tests para la caché compartida y sus backends
+"""
+import fnmatch
+import json
+import socket
+import socketserver
+import threading
+import pytest
+from unittest.mock import patch, Mock
+
+from shared_cache import (
+    NAMESPACE_CONTEXTS, NAMESPACE_LLM, NAMESPACE_PAGES, NAMESPACE_PROMPTS, NAMESPACE_VISION,
+    MemoryBackend, RedisBackend, RespClient, SharedCache, SharedStore, SQLiteBackend, create_backend
+)
+from cache import TTLCache
+
+TTLS = {NAMESPACE_LLM: 0, NAMESPACE_PAGES: 60, NAMESPACE_VISION: 60}
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    """Servidor de prueba que habla el protocolo de Redis (lo justo para el backend)"""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self.reply(item) for item in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        server = self.server
+        authenticated = server.password is None
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command, args = args[0].upper(), args[1:]
+            server.commands.append(command)
+            if command == b"AUTH":
+                authenticated = args[0].decode() == server.password
+                self.wfile.write(b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n")
+            elif not authenticated:
+                self.wfile.write(b"-NOAUTH Authentication required.\r\n")
+            elif command in (b"PING", b"SELECT"):
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"GET":
+                self.wfile.write(self.reply(server.data.get(args[0])))
+            elif command == b"SET":
+                server.data[args[0]] = args[1]
+                server.ttls[args[0]] = int(args[3])
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                removed = sum(server.data.pop(key, None) is not None for key in args)
+                self.wfile.write(self.reply(removed))
+            elif command == b"SCAN":
+                pattern = args[2].decode()
+                keys = [key for key in server.data if fnmatch.fnmatchcase(key.decode(), pattern)]
+                self.wfile.write(self.reply([b"0", keys]))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def resp_server():
+    """Servidor RESP local en un puerto libre"""
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RespHandler)
+    server.daemon_threads = True
+    server.data, server.ttls, server.commands, server.password = {}, {}, [], "secreto"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestLocalBackends:
+    """Tests para los backends en memoria y SQLite"""
+
+    @pytest.mark.parametrize("make_backend", [
+        lambda clock: MemoryBackend(max_entries=2, clock=clock),
+        lambda clock: SQLiteBackend(":memory:", max_entries=2, clock=clock),
+    ])
+    def test_ttl_and_lru(self, make_backend):
+        now = [0.0]
+        backend = make_backend(lambda: now[0])
+        backend.set("cm:pages:a", b"A", 10)
+        now[0] += 1
+        backend.set("cm:pages:b", b"B", 100)
+        now[0] += 1
+        assert backend.get("cm:pages:a") == b"A"
+        now[0] += 1
+        backend.set("cm:vision:c", b"C", 100)
+
+        # "b" era la menos usada
+        assert backend.get("cm:pages:b") is None
+        assert backend.count("cm:pages:") == 1 and backend.count("cm:") == 2
+        now[0] += 10
+        assert backend.get("cm:pages:a") is None
+        assert backend.count("cm:pages:") == 0
+
+        backend.clear("cm:vision:")
+        assert backend.get("cm:vision:c") is None
+
+    def test_sqlite_shared_between_instances(self, tmp_path):
+        """Dos procesos (dos conexiones) sobre el mismo fichero ven las mismas entradas"""
+        path = str(tmp_path / "cache.db")
+        writer = SharedCache(SQLiteBackend(path), TTLS)
+        reader = SharedCache(SQLiteBackend(path), TTLS)
+
+        writer.set_text(NAMESPACE_PAGES, "clave", "Texto de la página")
+
+        assert reader.shared
+        assert reader.get_text(NAMESPACE_PAGES, "clave") == "Texto de la página"
+        assert reader.size(NAMESPACE_PAGES) == 1
+
+    def test_create_backend(self):
+        assert isinstance(create_backend("memory"), MemoryBackend)
+        with pytest.raises(ValueError):
+            create_backend("memcached")
+
+
+class TestSharedCache:
+    """Tests para la API por espacios de nombres"""
+
+    def test_stats_and_disabled_namespace(self):
+        cache = SharedCache(MemoryBackend(), TTLS)
+
+        assert cache.get_text(NAMESPACE_PAGES, "k") is None
+        cache.set_text(NAMESPACE_PAGES, "k", "v")
+        assert cache.get_text(NAMESPACE_PAGES, "k") == "v"
+        # Un espacio con TTL 0 no guarda ni cuenta nada
+        cache.set_text(NAMESPACE_LLM, "k", "v")
+        assert cache.get_text(NAMESPACE_LLM, "k") is None
+
+        stats = cache.stats()
+        assert stats["backend"] == "MemoryBackend" and not stats["shared"]
+        assert stats["namespaces"][NAMESPACE_PAGES] == {
+            "ttl_seconds": 60, "hits": 1, "misses": 1, "sets": 1, "errors": 0, "hit_rate": 0.5, "entries": 1
+        }
+        assert stats["namespaces"][NAMESPACE_LLM]["hit_rate"] is None
+
+        cache.clear(NAMESPACE_PAGES)
+        assert cache.stats()["namespaces"][NAMESPACE_PAGES]["entries"] == 0
+
+
+class TestSharedStores:
+    """Tests para los ids de las respuestas vistos desde cualquier worker"""
+
+    def test_store_visible_from_another_process(self, tmp_path):
+        """Un context_id guardado por un worker se encuentra desde otro con el mismo fichero"""
+        path = str(tmp_path / "cache.db")
+        ttls = {NAMESPACE_CONTEXTS: 60}
+
+        def store():
+            return SharedStore(SharedCache(SQLiteBackend(path), ttls), NAMESPACE_CONTEXTS, TTLCache(10, 60),
+                               json.dumps, json.loads)
+
+        writer, reader = store(), store()
+        writer.set("ctx", {"context": "Recetas", "titles": ["Batidos"], "brand": None})
+
+        assert reader.get("ctx") == {"context": "Recetas", "titles": ["Batidos"], "brand": None}
+        assert reader.get("otro") is None
+
+    @patch('image_render.client')
+    def test_lazy_image_on_another_worker(self, mock_client, tmp_path, monkeypatch):
+        """GET /api/images/{prompt_id} funciona aunque el borrador lo atendiera otro worker"""
+        from fastapi.testclient import TestClient
+        from main import app, visual_prompt_id
+        from shared_cache import prompt_store, shared_cache
+
+        monkeypatch.setattr(shared_cache, "backend", SQLiteBackend(str(tmp_path / "cache.db")))
+        mock_client.models.generate_content.side_effect = Exception("Imagen caído")
+        prompt_id = visual_prompt_id("a vegan bowl")
+        prompt_store.set(prompt_id, "a vegan bowl")
+        # Otro worker: sin la copia en memoria de este proceso
+        prompt_store.local.clear()
+
+        response = TestClient(app).get(f"/api/images/{prompt_id}")
+
+        assert response.status_code == 200
+        assert shared_cache.get_text(NAMESPACE_PROMPTS, prompt_id) == "a vegan bowl"
+
+
+class TestRedisBackend:
+    """Tests contra un servidor RESP local"""
+
+    def test_roundtrip_through_server(self, resp_server):
+        port = resp_server.server_address[1]
+        cache = SharedCache(RedisBackend(RespClient(f"redis://:secreto@127.0.0.1:{port}/2")), TTLS)
+
+        cache.set(NAMESPACE_VISION, "foto", b"\x00binario\r\n")
+
+        assert cache.get(NAMESPACE_VISION, "foto") == b"\x00binario\r\n"
+        assert cache.get(NAMESPACE_VISION, "otra") is None
+        assert resp_server.ttls[b"cm:vision:foto"] == 60_000
+        assert resp_server.commands[:2] == [b"AUTH", b"SELECT"]
+        assert cache.size(NAMESPACE_VISION) == 1
+        assert cache.stats()["namespaces"][NAMESPACE_VISION]["hits"] == 1
+
+        cache.clear(NAMESPACE_VISION)
+        assert resp_server.data == {}
+
+    def test_wrong_password_is_an_error(self, resp_server):
+        port = resp_server.server_address[1]
+        cache = SharedCache(RedisBackend(RespClient(f"redis://:otra@127.0.0.1:{port}")), TTLS)
+
+        assert cache.get(NAMESPACE_PAGES, "k") is None
+        assert cache.get(NAMESPACE_PAGES, "k") is None
+        # Cada intento repite la autenticación en lugar de reutilizar la conexión rechazada
+        assert resp_server.commands == [b"AUTH", b"AUTH"]
+        assert cache.stats()["namespaces"][NAMESPACE_PAGES]["errors"] == 2
+
+    def test_unreachable_server_opens_breaker(self):
+        """Sin servidor, cada operación es un fallo contado y el circuito acaba abierto"""
+        cache = SharedCache(RedisBackend(RespClient(f"redis://127.0.0.1:{free_port()}", timeout=0.2)), TTLS)
+
+        for _ in range(10):
+            assert cache.get(NAMESPACE_PAGES, "k") is None
+            cache.set(NAMESPACE_PAGES, "k", b"v")
+
+        assert cache.breaker.state == "open"
+        stats = cache.stats()["namespaces"][NAMESPACE_PAGES]
+        assert stats["errors"] == 20 and stats["entries"] is None
+
+
+class TestContextStagesUseCache:
+    """Tests de integración con la descarga de páginas y la visión"""
+
+    @patch('main.requests.get')
+    def test_page_fetched_once(self, mock_get):
+        from main import fetch_page_text
+
+        mock_get.return_value = Mock(content=b"<html><body>Granos tostados</body></html>")
+
+        assert fetch_page_text("https://cafe.example") == "Granos tostados"
+        assert fetch_page_text("https://cafe.example") == "Granos tostados"
+        assert mock_get.call_count == 1
+
+    @patch('main.llm')
+    def test_vision_description_cached_by_image_bytes(self, mock_llm, sample_image):
+        from main import process_image_context
+
+        mock_llm.invoke.return_value = Mock(content="Una taza de café")
+
+        assert process_image_context(sample_image) == "Una taza de café"
+        assert process_image_context(sample_image) == "Una taza de café"
+        assert mock_llm.invoke.call_count == 1
+
+        # El texto de reserva tras un fallo no se guarda
+        mock_llm.invoke.side_effect = RuntimeError("caído")
+        assert process_image_context(sample_image + b"\x00").startswith("Error procesando imagen")
+        mock_llm.invoke.side_effect = None
+        assert process_image_context(sample_image + b"\x00") == "Una taza de café"
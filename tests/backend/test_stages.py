@@ -0,0 +1,168 @@
+"""
+Tests para los endpoints por etapa y el límite de peticiones
+"""
+import base64
+import json
+import threading
+import pytest
+from unittest.mock import patch, Mock
+from fastapi.testclient import TestClient
+
+IDEA = {"title": "Batidos verdes", "description": "Sobre batidos"}
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+
+
+class TestRateLimiter:
+    """Tests para el token bucket por cliente"""
+
+    def test_burst_refill_and_retry_after(self):
+        """Se agota la ráfaga, se indica la espera y se recarga con el tiempo"""
+        from ratelimit import RateLimiter
+
+        now = [0.0]
+        limiter = RateLimiter(per_minute=60, burst=2, clock=lambda: now[0])
+
+        assert limiter.acquire("a") == 0
+        assert limiter.acquire("a") == 0
+        assert limiter.acquire("a") == pytest.approx(1.0)
+        # Otro cliente tiene su propio bucket
+        assert limiter.acquire("b") == 0
+
+        now[0] = 1.0
+        assert limiter.acquire("a") == 0
+
+    def test_batch_cost_and_disabled(self):
+        """Un lote cuesta un token por elemento; sin tasa no se limita nada"""
+        from ratelimit import RateLimiter
+
+        limiter = RateLimiter(per_minute=60, burst=3, clock=lambda: 0.0)
+        assert limiter.acquire("a", cost=3) == 0
+        assert limiter.acquire("a") > 0
+
+        assert not RateLimiter(per_minute=0).enabled
+        assert RateLimiter(per_minute=0).acquire("a", cost=100) == 0
+
+
+class TestStageEndpoints:
+    """Tests para /api/stages/*"""
+
+    @patch('main.llm')
+    def test_copy_stage_makes_one_call(self, mock_llm):
+        """La etapa de copy solo llama al modelo una vez"""
+        from main import app
+
+        mock_llm.invoke.return_value = Mock(content=json.dumps(COPY))
+
+        response = TestClient(app).post("/api/stages/copy", json={"idea": IDEA, "context": "veganos"})
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["post"] == COPY
+        assert body["timings"]["llm_calls"] == 1
+        assert mock_llm.invoke.call_count == 1
+        assert "call.generate_copy;dur=" in response.headers["server-timing"]
+
+    @patch('main.llm')
+    def test_context_and_ideas_stages(self, mock_llm):
+        """El contexto se analiza por separado y las ideas se piden sobre él"""
+        from main import app
+
+        mock_llm.invoke.side_effect = [
+            Mock(content="Contexto de recetas veganas"),
+            Mock(content=json.dumps([IDEA, {"title": "Pasta", "description": "Sobre pasta"}])),
+        ]
+        client = TestClient(app)
+
+        context = client.post("/api/stages/context", json={"input_type": "text", "content": "Recetas"}).json()
+        ideas = client.post("/api/stages/ideas", json={"context": context["context"], "n_ideas": 2}).json()
+
+        assert context["context"] == "Contexto de recetas veganas"
+        assert [idea["title"] for idea in ideas["ideas"]] == ["Batidos verdes", "Pasta"]
+
+    def test_invalid_context_inputs(self):
+        """Entradas inválidas se rechazan antes de llamar al proveedor"""
+        from main import app
+
+        client = TestClient(app)
+        assert client.post("/api/stages/context", json={"input_type": "video"}).status_code == 400
+        assert client.post("/api/stages/context", json={"input_type": "text"}).status_code == 400
+        assert client.post(
+            "/api/stages/context", json={"input_type": "image", "image_base64": "no es base64!"}
+        ).status_code == 400
+
+    @patch('main.llm')
+    def test_visual_prompt_is_renderable_by_id(self, mock_llm):
+        """El prompt visual devuelto se puede renderizar con /api/images/{prompt_id}"""
+        from main import app
+        from shared_cache import prompt_store
+
+        mock_llm.invoke.return_value = Mock(content="A vegan bowl")
+
+        response = TestClient(app).post("/api/stages/visual-prompt", json={"idea": IDEA, "context": "veganos"})
+
+        visual = response.json()["visual_prompt"]
+        assert visual["description"] == "A vegan bowl"
+        assert prompt_store.get(visual["prompt_id"]) == "A vegan bowl"
+
+    @patch('image_render.request_provider_image', return_value=b"\x89PNG-render")
+    def test_image_stage_uses_shared_cache(self, mock_provider):
+        """La segunda petición del mismo prompt sale de la caché de imágenes"""
+        from main import app
+
+        client = TestClient(app)
+        first = client.post("/api/stages/image", json={"prompt": "A vegan bowl"}).json()["image"]
+        second = client.post("/api/stages/image", json={"prompt": "A vegan bowl"}).json()["image"]
+
+        assert first["source"] == "provider" and second["source"] == "cache"
+        assert first["image_url"] == "data:image/png;base64," + base64.b64encode(b"\x89PNG-render").decode()
+        assert mock_provider.call_count == 1
+        # Disponible también para el render bajo demanda
+        assert client.get(f"/api/images/{first['prompt_id']}").content == b"\x89PNG-render"
+
+    @patch('main.llm')
+    def test_batch_runs_concurrently_in_order(self, mock_llm):
+        """Los lotes se ejecutan en paralelo y conservan el orden de entrada"""
+        from main import app
+
+        barrier = threading.Barrier(3, timeout=5)
+
+        def invoke(messages, **kwargs):
+            # Solo se supera si las tres llamadas están en curso a la vez
+            barrier.wait()
+            title = messages[0].content.split("Título: ")[1].split("\n")[0]
+            return Mock(content=json.dumps({**COPY, "hook": title}))
+
+        mock_llm.invoke.side_effect = invoke
+        items = [{"idea": {"title": f"Idea {i}", "description": "d"}, "context": "veganos"} for i in range(3)]
+
+        response = TestClient(app).post("/api/stages/copy/batch", json={"items": items})
+
+        assert response.status_code == 200
+        assert [result["post"]["hook"] for result in response.json()["results"]] == ["Idea 0", "Idea 1", "Idea 2"]
+
+    def test_batch_size_limit(self, monkeypatch):
+        """Los lotes demasiado grandes se rechazan"""
+        from main import app
+
+        monkeypatch.setattr("main.STAGE_BATCH_MAX_ITEMS", 2)
+        response = TestClient(app).post("/api/stages/image/batch", json={"items": [{"prompt": "p"}] * 3})
+        assert response.status_code == 422
+
+    @patch('image_render.request_provider_image', return_value=b"\x89PNG-render")
+    @patch('main.llm')
+    def test_rate_limit_is_shared(self, mock_llm, mock_provider, monkeypatch):
+        """Las etapas y el pipeline completo consumen del mismo límite"""
+        from main import app
+        from ratelimit import RateLimiter
+
+        monkeypatch.setattr("main.rate_limiter", RateLimiter(per_minute=1, burst=3))
+        client = TestClient(app)
+
+        batch = client.post("/api/stages/image/batch", json={"items": [{"prompt": "a"}, {"prompt": "b"}]})
+        single = client.post("/api/stages/image", json={"prompt": "c"})
+        limited = client.post("/api/generate-content", data={"input_type": "text", "content": "Recetas"})
+
+        assert batch.status_code == 200 and single.status_code == 200
+        assert limited.status_code == 429
+        assert int(limited.headers["retry-after"]) > 0
+        mock_llm.invoke.assert_not_called()
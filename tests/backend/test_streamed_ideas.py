@@ -0,0 +1,187 @@
+"""
+Tests para la generación de ideas en streaming con trabajo especulativo
+"""
+import json
+import threading
+import time
+import pytest
+from unittest.mock import patch, Mock
+
+from metrics import RequestTimings, current_timings
+
+IDEAS = [{"title": f"Idea {i}", "description": f"Descripción {i}"} for i in range(5)]
+COPY = {"hook": "Hook", "body": "Body", "cta": "CTA", "hashtags": ["#test"]}
+
+
+def initial_state():
+    return {
+        "context": "contexto", "ideas": [], "posts": [], "visual_prompts": [],
+        "error": None, "deadline": None, "degraded": [], "draft": True
+    }
+
+
+def idea_chunks(ideas):
+    """Texto del array partido en trozos pequeños, como llega del modelo"""
+    text = json.dumps(ideas)
+    return [Mock(content=text[index:index + 7]) for index in range(0, len(text), 7)]
+
+
+def fake_invoke(delay=0.0):
+    """Responde copies y prompts visuales según la llamada"""
+    def invoke(messages, **kwargs):
+        time.sleep(delay)
+        if "response_schema" in kwargs:
+            return Mock(content=json.dumps(COPY))
+        return Mock(content=f"Image for {messages[0].content.split('Título: ')[1].split(chr(10))[0]}")
+    return invoke
+
+
+class TestStreamedWorkflow:
+    """Tests del nodo generate_streamed"""
+
+    @patch('main.llm')
+    def test_copy_starts_before_stream_ends(self, mock_llm):
+        """El copy de la primera idea empieza mientras el resto de ideas sigue llegando"""
+        from main import create_content_workflow
+
+        first_copy_started = threading.Event()
+        seen_before_end = []
+
+        def invoke(messages, **kwargs):
+            first_copy_started.set()
+            return fake_invoke()(messages, **kwargs)
+
+        def stream(messages, **kwargs):
+            text = json.dumps(IDEAS)
+            first_end = text.index("}") + 1
+            yield Mock(content=text[:first_end])
+            seen_before_end.append(first_copy_started.wait(timeout=2))
+            yield Mock(content=text[first_end:])
+
+        mock_llm.invoke.side_effect = invoke
+        mock_llm.stream.side_effect = stream
+
+        result = create_content_workflow(streamed=True).invoke(initial_state())
+
+        assert result["error"] is None
+        assert seen_before_end == [True]
+        assert result["ideas"] == IDEAS
+        assert len(result["posts"]) == 5
+        # El orden de posts y visuales sigue el de las ideas
+        assert [visual["description"] for visual in result["visual_prompts"]] == [
+            f"Image for Idea {i}" for i in range(5)
+        ]
+
+    @patch('main.llm')
+    def test_interrupted_stream_is_reconciled(self, mock_llm):
+        """Si el stream se corta se conservan las ideas recibidas y se completan las demás"""
+        from main import create_content_workflow
+
+        def stream(messages, **kwargs):
+            text = json.dumps(IDEAS)
+            yield Mock(content=text[:text.index("Idea 2") - 12])
+            raise ConnectionError("stream cortado")
+
+        mock_llm.invoke.side_effect = fake_invoke()
+        mock_llm.stream.side_effect = stream
+
+        result = create_content_workflow(streamed=True).invoke(initial_state())
+
+        assert result["error"] is None
+        assert result["ideas"][:2] == IDEAS[:2]
+        assert len(result["ideas"]) == 5
+        assert len(result["posts"]) == 5
+        # 5 copies + 5 prompts visuales: nada se genera dos veces
+        assert mock_llm.invoke.call_count == 10
+
+    @patch('main.llm')
+    def test_invalid_stream_cancels_speculation(self, mock_llm):
+        """Sin ideas válidas se usan las de plantilla y el trabajo especulativo no se conserva"""
+        from main import create_content_workflow, fallback_ideas
+
+        mock_llm.invoke.side_effect = fake_invoke()
+        mock_llm.stream.return_value = iter([Mock(content="no es JSON")])
+
+        result = create_content_workflow(streamed=True).invoke(initial_state())
+
+        assert result["error"] is None
+        assert result["ideas"] == fallback_ideas("contexto")
+        assert len(result["posts"]) == 5
+
+    @patch('image_render.request_provider_image', return_value=b"\x89PNG")
+    @patch('main.llm')
+    def test_discarded_idea_stops_calling_provider(self, mock_llm, mock_image):
+        """Una idea especulativa descartada no pide más llamadas y la respuesta no la espera"""
+        from main import create_content_workflow
+
+        replaced = threading.Event()
+        discarded_copy_done = threading.Event()
+        calls = []
+
+        def invoke(messages, **kwargs):
+            title = messages[0].content.split("Título: ")[1].split(chr(10))[0]
+            calls.append(("copy" if "response_schema" in kwargs else "visual", title))
+            if title == "Idea 0":
+                # El copy en vuelo de la idea descartada termina después de la reconciliación
+                replaced.wait(timeout=2)
+                time.sleep(0.3)
+                discarded_copy_done.set()
+            return fake_invoke()(messages, **kwargs)
+
+        def stream(messages, **kwargs):
+            text = json.dumps(IDEAS)
+            first_end = text.index("}") + 1
+            yield Mock(content=text[:first_end])
+            yield Mock(content=text[first_end:])
+
+        def replace(ideas, *args):
+            replaced.set()
+            return [{"title": "Idea nueva", "description": "Otra"}] + ideas[1:]
+
+        mock_llm.invoke.side_effect = invoke
+        mock_llm.stream.side_effect = stream
+        state = {**initial_state(), "draft": False}
+
+        with patch('main.replace_duplicate_ideas', side_effect=replace):
+            result = create_content_workflow(streamed=True).invoke(state)
+        returned_before_discarded = not discarded_copy_done.is_set()
+        discarded_copy_done.wait(timeout=2)
+        time.sleep(0.1)
+
+        assert result["ideas"][0]["title"] == "Idea nueva"
+        assert returned_before_discarded
+        assert [call for call in calls if call[1] == "Idea 0"] == [("copy", "Idea 0")]
+        assert mock_image.call_count == 5
+        assert all("Idea 0" not in call.args[0] for call in mock_image.call_args_list)
+
+    @patch('main.llm')
+    def test_first_post_sooner_than_sequential(self, mock_llm):
+        """El primer post termina antes que en el workflow secuencial"""
+        from main import create_content_workflow, idea_deduplicator
+
+        def slow_stream(messages, **kwargs):
+            for chunk in idea_chunks(IDEAS):
+                time.sleep(0.01)
+                yield chunk
+
+        def sequential_invoke(messages, **kwargs):
+            if kwargs.get("response_schema") and "exactamente 5 ideas" in messages[0].content:
+                time.sleep(0.01 * len(idea_chunks(IDEAS)))
+                return Mock(content=json.dumps(IDEAS))
+            return fake_invoke(delay=0.01)(messages, **kwargs)
+
+        first_post_ms = {}
+        for streamed in (False, True):
+            # Las mismas ideas en la segunda pasada no deben contar como repetidas
+            idea_deduplicator.clear()
+            mock_llm.invoke.side_effect = sequential_invoke
+            mock_llm.stream.side_effect = slow_stream
+            timings = RequestTimings()
+            token = current_timings.set(timings)
+            try:
+                create_content_workflow(streamed=streamed).invoke(initial_state())
+            finally:
+                current_timings.reset(token)
+            first_post_ms[streamed] = timings.first_post_ms
+
+        assert first_post_ms[True] < first_post_ms[False] / 2
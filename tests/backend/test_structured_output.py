@@ -0,0 +1,152 @@
+"""
+Tests para la salida estructurada y el extractor tolerante de JSON
+"""
+import json
+import pytest
+from unittest.mock import patch, Mock
+from prometheus_client import REGISTRY
+
+from structured_output import PARSE_OK, PARSE_REPAIRED, IncrementalArrayParser, extract_json, response_schema
+
+
+def parse_count(operation, result):
+    return REGISTRY.get_sample_value("cm_json_parse_total", {"operation": operation, "result": result}) or 0.0
+
+
+class TestIncrementalArrayParser:
+    """Tests para el parser incremental de arrays"""
+
+    def test_objects_released_as_they_close(self):
+        """Cada objeto se entrega en cuanto se cierra, sin esperar al resto"""
+        parser = IncrementalArrayParser()
+
+        assert parser.feed('```json\n[{"title": "Uno", "desc') == []
+        assert parser.feed('ription": "A"}, {"title"') == [{"title": "Uno", "description": "A"}]
+        assert parser.feed(': "Dos", "description": "B"}]\n```') == [{"title": "Dos", "description": "B"}]
+        assert parser.complete
+
+    def test_brackets_and_escapes_inside_strings(self):
+        """Los corchetes y comillas escapadas dentro de strings no cierran elementos"""
+        parser = IncrementalArrayParser()
+        text = '[{"title": "a ] } \\" b", "tags": [1, 2]}, 3, "x"]'
+
+        released = []
+        for char in text:
+            released += parser.feed(char)
+
+        assert released == [{"title": 'a ] } " b', "tags": [1, 2]}, 3, "x"]
+
+    def test_malformed_element_is_skipped(self):
+        """Un elemento mal formado no se entrega y no bloquea los siguientes"""
+        parser = IncrementalArrayParser()
+        assert parser.feed('[{"title": tal}, {"title": "ok"}]') == [{"title": "ok"}]
+
+
+class TestExtractJson:
+    """Tests para extract_json"""
+
+    def test_clean_json(self):
+        """Un JSON limpio se parsea sin reparación"""
+        assert extract_json('[{"title": "a"}]', list) == ([{"title": "a"}], PARSE_OK)
+
+    def test_code_fences(self):
+        """Los bloques de código Markdown se eliminan"""
+        value, result = extract_json('```json\n{"hook": "h"}\n```', dict)
+        assert value == {"hook": "h"}
+        assert result == PARSE_OK
+
+    def test_stray_prose(self):
+        """Se ignora el texto antes y después del JSON"""
+        value, result = extract_json('Claro, aquí tienes: {"hook": "h", "tags": ["#a"]} ¡Suerte!', dict)
+        assert value == {"hook": "h", "tags": ["#a"]}
+        assert result == PARSE_REPAIRED
+
+    def test_truncated_array_keeps_complete_elements(self):
+        """Un array truncado conserva los elementos completos"""
+        text = '[{"title": "Uno", "description": "a"}, {"title": "Dos", "description": "b"}, {"title": "Tr'
+        value, result = extract_json(text, list)
+        assert [item["title"] for item in value] == ["Uno", "Dos"]
+        assert result == PARSE_REPAIRED
+
+    def test_trailing_comma(self):
+        """Las comas finales se toleran"""
+        value, _ = extract_json('{"hashtags": ["#a", "#b",],}', dict)
+        assert value == {"hashtags": ["#a", "#b"]}
+
+    def test_brackets_inside_strings(self):
+        """Los corchetes dentro de cadenas no confunden al escáner"""
+        value, _ = extract_json('Nota: [{"title": "Top [5] ideas \\"}\\"", "description": "x"}] fin', list)
+        assert value[0]["title"] == 'Top [5] ideas "}"'
+
+    def test_unrecoverable(self):
+        """Si no hay JSON utilizable se lanza ValueError"""
+        with pytest.raises(ValueError):
+            extract_json("respuesta no válida como JSON", list)
+
+
+class TestResponseSchema:
+    """Tests para los esquemas de respuesta del proveedor"""
+
+    def test_array_schema_without_titles(self):
+        """El esquema de ideas fija la longitud y no lleva metadatos title"""
+        from main import ContentIdea
+
+        schema = response_schema(ContentIdea, array_length=5)
+        assert schema["type"] == "array"
+        assert schema["minItems"] == schema["maxItems"] == 5
+        assert schema["items"]["properties"]["title"] == {"description": "title", "type": "string"}
+        assert "title" not in schema["items"]
+
+    def test_title_property_not_described_as_its_schema(self):
+        """La propiedad title no llega al proveedor descrita con su propio esquema"""
+        from langchain_google_genai._function_utils import _dict_to_gapic_schema
+        from main import ContentIdea
+
+        gapic_schema = _dict_to_gapic_schema(response_schema(ContentIdea, array_length=5))
+        assert gapic_schema.items.properties["title"].description == "title"
+
+
+class TestStructuredGeneration:
+    """Tests para generate_ideas y generate_copy con salida estructurada"""
+
+    @patch('main.llm')
+    def test_generate_ideas_requests_schema(self, mock_llm):
+        """generate_ideas pide JSON con el esquema de ContentIdea"""
+        from main import generate_ideas, IDEAS_RESPONSE_SCHEMA
+
+        ideas = [{"title": f"Idea {i}", "description": f"Descripción {i}"} for i in range(5)]
+        mock_llm.invoke.return_value = Mock(content=json.dumps(ideas))
+
+        assert generate_ideas("contexto") == ideas
+        kwargs = mock_llm.invoke.call_args.kwargs
+        assert kwargs["response_mime_type"] == "application/json"
+        assert kwargs["response_schema"] is IDEAS_RESPONSE_SCHEMA
+
+    @patch('main.llm')
+    def test_truncated_ideas_are_completed(self, mock_llm):
+        """Un array truncado conserva las ideas del modelo y completa el resto"""
+        from main import generate_ideas
+
+        mock_llm.invoke.return_value = Mock(
+            content='[{"title": "Batido verde", "description": "Receta rápida"}, {"title": "Pasta'
+        )
+        before = parse_count("generate_ideas", "repaired")
+
+        result = generate_ideas("veganos principiantes")
+
+        assert len(result) == 5
+        assert result[0]["title"] == "Batido verde"
+        assert parse_count("generate_ideas", "repaired") == before + 1
+
+    @patch('main.llm')
+    def test_copy_with_missing_fields_falls_back(self, mock_llm):
+        """Un copy sin todos los campos usa el fallback y cuenta el fallo"""
+        from main import generate_copy
+
+        mock_llm.invoke.return_value = Mock(content='{"hook": "Solo hook"}')
+        before = parse_count("generate_copy", "failed")
+
+        result = generate_copy({"title": "Test Idea", "description": "Test"}, "contexto")
+
+        assert "Test Idea" in result["hook"]
+        assert parse_count("generate_copy", "failed") == before + 1
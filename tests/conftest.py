@@ -11,6 +11,43 @@ import io
 # Agregar el directorio backend al path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
+# Las sesiones, el historial, la base de conocimiento y los perfiles de marca de los tests no se escriben en disco
+os.environ.setdefault("SESSIONS_DB", ":memory:")
+os.environ.setdefault("HISTORY_DB", ":memory:")
+os.environ.setdefault("KNOWLEDGE_DB", ":memory:")
+os.environ.setdefault("BRAND_PROFILES_DB", ":memory:")
+# Sin caché de imágenes en disco salvo en los tests que la crean en tmp_path
+os.environ.setdefault("IMAGE_DISK_CACHE_MAX_BYTES", "0")
+
+@pytest.fixture(autouse=True)
+def reset_provider_state():
+    """Breakers, cachés e ideas vistas son globales; cada test empieza con el circuito cerrado y todo vacío"""
+    yield
+    main = sys.modules.get("main")
+    if main is not None and hasattr(main, "idea_deduplicator"):
+        main.idea_deduplicator.clear()
+    if main is not None and hasattr(main, "text_key_pool"):
+        main.text_key_pool.reset()
+    image_render = sys.modules.get("image_render")
+    if image_render is not None:
+        image_render.image_breaker.reset()
+        image_render.image_key_pool.reset()
+    scheduler = sys.modules.get("scheduler")
+    if scheduler is not None:
+        scheduler.text_scheduler.reset()
+        scheduler.image_scheduler.reset()
+    cache = sys.modules.get("cache")
+    if cache is not None:
+        cache.image_cache.clear()
+    semantic = sys.modules.get("semantic_cache")
+    if semantic is not None:
+        semantic.semantic_cache.clear()
+    shared = sys.modules.get("shared_cache")
+    if shared is not None:
+        shared.prompt_store.clear()
+        shared.context_store.clear()
+        shared.shared_cache.clear()
+
 @pytest.fixture
 def mock_gemini_api():
     """Mock de la API de Gemini para tests"""